@@ -0,0 +1,318 @@
+"""
+Benchmark suite for the Image Processor pipeline
+Generates a synthetic corpus across source sizes, colour modes and output formats,
+times each stage (decode, resize, watermark, encode) and the end-to-end handler
+against an in-memory S3, and writes machine-readable results
+
+Run: python bench_image_pipeline.py --output results.json
+Compare two commits: python bench_image_pipeline.py --compare baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'lambdas/image_processor'))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'lambdas'))
+sys.path.insert(0, BACKEND_DIR)
+
+import PIL
+from PIL import Image
+
+import handler as image_processor
+from emulator import FakeS3Client
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SOURCE_BUCKET = 'bench-source'
+STAGES = ('decode', 'resize', 'watermark', 'flatten', 'encode')
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def make_source(size, mode):
+    """
+    Build a synthetic source image with gradients and noise so encoders do real work
+    Returns (encoded_bytes, source_format)
+    """
+    red = Image.linear_gradient('L').resize(size)
+    green = Image.effect_noise(size, 48).point(lambda v: v // 2 + 64)
+    blue = Image.radial_gradient('L').resize(size)
+
+    if mode == 'L':
+        image = Image.blend(red, green, 0.5)
+    elif mode == 'RGBA':
+        image = Image.merge('RGBA', (red, green, blue, blue.point(lambda v: 255 - v)))
+    else:
+        image = Image.merge('RGB', (red, green, blue))
+        if mode == 'P':
+            image = image.quantize(256)
+
+    source_format = 'JPEG' if mode in ('RGB', 'L') else 'PNG'
+    output = BytesIO()
+    image.save(output, format=source_format, quality=90)
+    return output.getvalue(), source_format
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB, None where unsupported
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_stages(source_bytes, metadata):
+    """
+    Run the primary rendition through the pipeline one stage at a time
+    Mirrors process_renditions; returns (stage timings in seconds, output size in bytes)
+    """
+    timings = {}
+    rendition = image_processor.get_renditions(metadata)[0]
+
+    start = time.perf_counter()
+    image = Image.open(BytesIO(source_bytes))
+    source_size = image.size
+    target = image_processor.fit_size(source_size, (rendition['width'], rendition['height']))
+    image = image_processor.load_reduced(image, target)
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if image.size != target:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+    timings['resize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if metadata['watermark']:
+        image = image_processor.add_watermark(image, metadata['watermark'])
+    timings['watermark'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if image_processor.color.has_alpha(image) and rendition['format'] in ('jpeg', 'jpg'):
+        image = image_processor.color.flatten(image)
+    timings['flatten'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    output = image_processor.encode_image(image, rendition['format'], rendition['quality'])
+    timings['encode'] = time.perf_counter() - start
+
+    return timings, len(output.getvalue())
+
+
+def bench_case(size, mode, output_format, args):
+    """
+    Benchmark one (source size, mode, output format) combination
+    """
+    source_bytes, source_format = make_source(size, mode)
+    metadata = {
+        'width': args.target[0],
+        'height': args.target[1],
+        'quality': args.quality,
+        'format': output_format,
+        'watermark': args.watermark
+    }
+
+    # Warm up caches (fonts, watermark tiles, codec state) outside the measurements
+    run_stages(source_bytes, metadata)
+
+    samples = {stage: [] for stage in STAGES}
+    output_bytes = 0
+    for _ in range(args.iterations):
+        timings, output_bytes = run_stages(source_bytes, metadata)
+        for stage in STAGES:
+            samples[stage].append(timings[stage])
+
+    stages_ms = {stage: round(statistics.median(values) * 1000, 3) for stage, values in samples.items()}
+    total_ms = sum(stages_ms.values())
+
+    return {
+        'source_size': f"{size[0]}x{size[1]}",
+        'mode': mode,
+        'source_format': source_format,
+        'output_format': output_format,
+        'iterations': args.iterations,
+        'stages_ms': stages_ms,
+        'total_ms': round(total_ms, 3),
+        'images_per_sec': round(1000 / total_ms, 2) if total_ms else None,
+        'input_bytes': len(source_bytes),
+        'output_bytes': output_bytes,
+        'source_pixels': size[0] * size[1],
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def bench_end_to_end(args):
+    """
+    Push a batch of S3 records through handler() against an in-memory S3
+    Measures throughput including download, dedup lookups and upload
+    """
+    fake_s3 = FakeS3Client()
+    size = args.sizes[len(args.sizes) // 2]
+    source_bytes, _ = make_source(size, 'RGB')
+    watermark = args.watermark or 'none'
+
+    records = []
+    for index in range(args.batch):
+        # Distinct bytes per record so the dedup cache can't short-circuit processing
+        key = f"uploads/{index}_{args.target[0]}x{args.target[1]}_{args.quality}_jpeg_{watermark}_bench{index}.jpg"
+        fake_s3.put_object(Bucket=SOURCE_BUCKET, Key=key, Body=source_bytes + index.to_bytes(4, 'big'))
+        records.append({'s3': {'bucket': {'name': SOURCE_BUCKET}, 'object': {'key': key}}})
+
+    original_client, original_cache = image_processor.s3_client, image_processor.rendition_cache
+    image_processor.s3_client, image_processor.rendition_cache = fake_s3, None
+    try:
+        # Silence the handler's per-image log lines
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            response = image_processor.handler({'Records': records}, None)
+            elapsed = time.perf_counter() - start
+    finally:
+        image_processor.s3_client, image_processor.rendition_cache = original_client, original_cache
+
+    return {
+        'source_size': f"{size[0]}x{size[1]}",
+        'batch': args.batch,
+        'max_workers': image_processor.MAX_WORKERS,
+        'status_code': response['statusCode'],
+        'elapsed_ms': round(elapsed * 1000, 3),
+        'images_per_sec': round(args.batch / elapsed, 2),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def run_isolated(function, *args):
+    """
+    Run a benchmark in a forked child so peak RSS is measured per case
+    Falls back to running in-process where fork is unavailable
+    """
+    import multiprocessing
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return function(*args)
+
+    context = multiprocessing.get_context('fork')
+    parent, child = context.Pipe(duplex=False)
+
+    def target():
+        child.send(function(*args))
+        child.close()
+
+    process = context.Process(target=target)
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """
+    Print the total time change of every case against a previous results file
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def case_key(case):
+        return (case['source_size'], case['mode'], case['output_format'])
+
+    previous = {case_key(case): case for case in baseline['cases']}
+    print()
+    print(f"Compared with {baseline_path} (commit {baseline.get('commit')})")
+    for case in results['cases']:
+        before = previous.get(case_key(case))
+        if not before:
+            continue
+        change = (case['total_ms'] - before['total_ms']) / before['total_ms'] * 100
+        print(f"  {case['source_size']:>10} {case['mode']:<4} -> {case['output_format']:<4} "
+              f"{before['total_ms']:9.2f} ms -> {case['total_ms']:9.2f} ms  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ImageHub image pipeline')
+    parser.add_argument('--sizes', default='640x480,1920x1080,4000x3000', help='Source sizes, comma separated')
+    parser.add_argument('--modes', default='RGB,RGBA,P,L', help='Source colour modes, comma separated')
+    parser.add_argument('--formats', default='jpeg,webp,png', help='Output formats, comma separated')
+    parser.add_argument('--target', default='800x600', help='Output bounding box')
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--watermark', default='ImageHub', help="Watermark text, 'none' to disable")
+    parser.add_argument('--iterations', type=int, default=3, help='Measured runs per case (median is reported)')
+    parser.add_argument('--batch', type=int, default=8, help='Records in the end-to-end handler batch')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--compare', help='Previous JSON results to compare against')
+    args = parser.parse_args()
+
+    args.sizes = [parse_size(size) for size in args.sizes.split(',')]
+    args.target = parse_size(args.target)
+    args.watermark = None if args.watermark.lower() == 'none' else args.watermark
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'target': f"{args.target[0]}x{args.target[1]}",
+            'quality': args.quality,
+            'watermark': args.watermark,
+            'iterations': args.iterations
+        },
+        'cases': []
+    }
+
+    print(f"{'source':>10} {'mode':<4}    {'fmt':<4} " + ' '.join(f"{stage:>10}" for stage in STAGES)
+          + f" {'total ms':>10} {'img/s':>8} {'rss MB':>8}")
+    for size in args.sizes:
+        for mode in args.modes.split(','):
+            for output_format in args.formats.split(','):
+                case = run_isolated(bench_case, size, mode, output_format, args)
+                results['cases'].append(case)
+                print(f"{case['source_size']:>10} {mode:<4} -> {output_format:<4} "
+                      + ' '.join(f"{case['stages_ms'][stage]:10.2f}" for stage in STAGES)
+                      + f" {case['total_ms']:10.2f} {case['images_per_sec']:8.2f} {case['peak_rss_mb'] or '-':>8}")
+
+    results['end_to_end'] = run_isolated(bench_end_to_end, args)
+    end_to_end = results['end_to_end']
+    print()
+    print(f"End-to-end handler: {end_to_end['batch']} x {end_to_end['source_size']} in "
+          f"{end_to_end['elapsed_ms']:.1f} ms ({end_to_end['images_per_sec']} images/sec, "
+          f"{end_to_end['max_workers']} workers)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Replay synthetic uploads through the whole ImageHub pipeline locally
+Every event goes get_presigned_url -> PUT -> image_processor -> save_image_history
+-> get_image_history against the in-memory fakes in emulator/, with configurable
+concurrency and simulated AWS latency. Reports throughput and latency
+percentiles per phase plus image_processor stage timings
+
+Run: python replay_pipeline.py --events 2000 --concurrency 8
+     python replay_pipeline.py --events 500 --s3-latency 20 --dynamodb-latency 5 --output replay.json
+Compare two commits: python replay_pipeline.py --compare baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'lambdas'))
+sys.path.insert(0, BACKEND_DIR)
+
+from emulator import Pipeline
+from bench_image_pipeline import git_commit, make_source, parse_size
+
+PHASES = ('upload', 'process', 'history')
+
+
+def percentiles(samples):
+    """
+    p50/p95/p99/max of latency samples in seconds, as milliseconds
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+    return {'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99), 'max': round(ordered[-1] * 1000, 3)}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run_phase(name, function, jobs, concurrency):
+    """
+    Run function over jobs on a thread pool; returns (results, phase summary)
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(lambda job: timed(function, job), jobs))
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        'phase': name,
+        'calls': len(jobs),
+        'elapsed_ms': round(elapsed * 1000, 3),
+        'calls_per_sec': round(len(jobs) / elapsed, 2) if elapsed else None,
+        'latency_ms': percentiles([duration for _, duration in outcomes])
+    }
+    return [result for result, _ in outcomes], summary
+
+
+def build_events(args):
+    """
+    Synthetic uploads: (user_id, filename, data, options), cycling through the
+    configured sizes and formats. Bytes are made unique per event unless
+    --duplicates is set, so the dedup cache only hits when asked to
+    """
+    sources = {size: make_source(size, 'RGB')[0] for size in args.sizes}
+    formats = args.formats.split(',')
+
+    events = []
+    for index in range(args.events):
+        size = args.sizes[index % len(args.sizes)]
+        data = sources[size]
+        if not args.duplicates:
+            data += index.to_bytes(4, 'big')
+        options = {
+            'width': args.target[0],
+            'height': args.target[1],
+            'quality': args.quality,
+            'format': formats[index % len(formats)],
+            'watermark': args.watermark
+        }
+        events.append((f"user-{index % args.users}", f"replay {index}.jpg", data, options))
+    return events
+
+
+def replay(args):
+    events = build_events(args)
+    pipeline = Pipeline(
+        s3_latency=args.s3_latency / 1000,
+        dynamodb_latency=args.dynamodb_latency / 1000,
+        unprocessed_rate=args.unprocessed_rate
+    )
+    phases = []
+
+    try:
+        # Silence the handlers' per-request log lines
+        with contextlib.redirect_stdout(io.StringIO()):
+            uploads, summary = run_phase(
+                'upload',
+                lambda event: pipeline.upload(event[2], event[1], 'image/jpeg', event[0], **event[3]),
+                events,
+                args.concurrency
+            )
+            phases.append(summary)
+
+            # Each call stands for one S3 notification delivered to a Lambda container
+            keys = [upload['key'] for upload in uploads]
+            batches = [keys[start:start + args.batch] for start in range(0, len(keys), args.batch)]
+            responses, summary = run_phase('process', pipeline.process, batches, args.concurrency)
+            pipeline.drain()
+            summary['images_per_sec'] = round(len(keys) / (summary['elapsed_ms'] / 1000), 2)
+            phases.append(summary)
+
+            users = sorted({event[0] for event in events})
+            histories, summary = run_phase(
+                'history',
+                lambda user_id: pipeline.history(user_id, limit=str(args.page_size)),
+                users,
+                args.concurrency
+            )
+            phases.append(summary)
+    finally:
+        pipeline.close()
+
+    failed = sum(1 for response in responses if response['statusCode'] != 200)
+    recorded = sum(len(items) for items in histories)
+    stages = {}
+    for record in pipeline.metrics:
+        for name, value in record.items():
+            if name.endswith('Ms') and isinstance(value, (int, float)):
+                stages.setdefault(name[:-2].lower(), []).append(value)
+
+    return {
+        'phases': phases,
+        'stages_median_ms': {name: round(statistics.median(values), 3) for name, values in stages.items()},
+        'failed_batches': failed,
+        'history_recorded': recorded,
+        'history_missing': len(events) - recorded,
+        'history_errors': len(pipeline.lambda_client.errors),
+        'aws_calls': {'s3': pipeline.s3.calls, 'dynamodb': pipeline.dynamodb.calls,
+                      'lambda': pipeline.lambda_client.calls}
+    }
+
+
+def compare(results, baseline_path):
+    """
+    Print throughput and p95 changes of every phase against a previous results file
+    """
+    with open(baseline_path) as f:
+        baseline = {phase['phase']: phase for phase in json.load(f)['phases']}
+
+    print()
+    print(f"Compared with {baseline_path}:")
+    for phase in results['phases']:
+        before = baseline.get(phase['phase'])
+        if not before or not before.get('calls_per_sec'):
+            continue
+        throughput = (phase['calls_per_sec'] - before['calls_per_sec']) / before['calls_per_sec'] * 100
+        p95 = phase['latency_ms'].get('p95', 0) - before['latency_ms'].get('p95', 0)
+        print(f"  {phase['phase']:<8} throughput {throughput:+7.1f}%   p95 {p95:+9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay synthetic uploads through the local ImageHub pipeline')
+    parser.add_argument('--events', type=int, default=1000, help='Uploads to replay')
+    parser.add_argument('--users', type=int, default=20, help='Distinct users the uploads are spread over')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients / Lambda invocations')
+    parser.add_argument('--batch', type=int, default=10, help='Records per image_processor event')
+    parser.add_argument('--sizes', default='640x480,1024x768', help='Source sizes, comma separated')
+    parser.add_argument('--formats', default='jpeg,webp', help='Output formats, comma separated')
+    parser.add_argument('--target', default='800x600', help='Output bounding box')
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--watermark', default='ImageHub', help="Watermark text, 'none' to disable")
+    parser.add_argument('--page-size', type=int, default=50, help='get_image_history page size')
+    parser.add_argument('--duplicates', action='store_true', help='Reuse identical bytes (exercises the dedup cache)')
+    parser.add_argument('--s3-latency', type=float, default=0.0, help='Simulated latency per S3 call (ms)')
+    parser.add_argument('--dynamodb-latency', type=float, default=0.0, help='Simulated latency per DynamoDB call (ms)')
+    parser.add_argument('--unprocessed-rate', type=float, default=0.0,
+                        help='Fraction of batch writes returned as UnprocessedItems (throttling)')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--compare', help='Previous JSON results to compare against')
+    args = parser.parse_args()
+
+    args.sizes = [parse_size(size) for size in args.sizes.split(',')]
+    args.target = parse_size(args.target)
+    args.watermark = None if args.watermark.lower() == 'none' else args.watermark
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'compare')}
+    }
+    results['config']['sizes'] = [f"{width}x{height}" for width, height in args.sizes]
+    results['config']['target'] = f"{args.target[0]}x{args.target[1]}"
+    results.update(replay(args))
+
+    print(f"{'phase':<8} {'calls':>7} {'calls/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for phase in results['phases']:
+        latency = phase['latency_ms']
+        print(f"{phase['phase']:<8} {phase['calls']:>7} {phase['calls_per_sec']:>9} {latency.get('p50', 0):>9.2f} "
+              f"{latency.get('p95', 0):>9.2f} {latency.get('p99', 0):>9.2f} {latency.get('max', 0):>9.2f}")
+    print()
+    print('image_processor stage medians: ' + ', '.join(f"{name} {value:.2f} ms"
+                                                         for name, value in results['stages_median_ms'].items()))
+    print(f"Failed batches: {results['failed_batches']}, history recorded {results['history_recorded']}/"
+          f"{args.events} ({results['history_errors']} save errors)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""
+Local stand-ins for the AWS services used by the ImageHub Lambdas, and a
+pipeline that runs all four handlers against them (see pipeline.py)
+"""
+
+from .fake_dynamodb import FakeDynamoDBClient
+from .fake_lambda import FakeLambdaClient
+from .fake_s3 import FakeS3Client
+from .pipeline import EmulatorError, Pipeline
+
+__all__ = ['FakeDynamoDBClient', 'FakeLambdaClient', 'FakeS3Client', 'EmulatorError', 'Pipeline']
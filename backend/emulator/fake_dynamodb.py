@@ -0,0 +1,238 @@
+"""
+In-memory stand-in for the low-level boto3 DynamoDB client
+Items are kept as AttributeValue dicts, exactly as the handlers send them, and
+key conditions support the expressions the handlers build (= on the partition
+key; =, <, <=, >, >=, BETWEEN and begins_with on the sort key). put_item
+condition expressions support attribute_exists/attribute_not_exists and
+comparisons joined by AND/OR, without parentheses
+"""
+
+import copy
+import random
+import re
+import threading
+import time
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+# Key schema of the tables used by ImageHub: {table: (partition key, sort key or None)}
+DEFAULT_TABLES = {
+    'ImageHistory': ('userId', 'timestamp'),
+    'imagehub-dedup-cache': ('digest', None),
+    'imagehub-job-status': ('uploadKey', None)
+}
+
+_SORT_CONDITION = re.compile(
+    r'^(?P<name>#?\w+)\s*(?:(?P<op><=|>=|=|<|>)\s*(?P<value>:\w+)'
+    r'|BETWEEN\s+(?P<low>:\w+)\s+AND\s+(?P<high>:\w+))$',
+    re.IGNORECASE
+)
+_BEGINS_WITH = re.compile(r'^begins_with\s*\(\s*(?P<name>#?\w+)\s*,\s*(?P<value>:\w+)\s*\)$', re.IGNORECASE)
+_ATTRIBUTE_CHECK = re.compile(r'^(?P<function>attribute_exists|attribute_not_exists)\s*\(\s*(?P<name>#?\w+)\s*\)$',
+                              re.IGNORECASE)
+_COMPARISON = re.compile(r'^(?P<name>#?\w+)\s*(?P<op><>|<=|>=|=|<|>)\s*(?P<value>:\w+)$')
+_OPERATORS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b
+}
+
+
+def _client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': 400}}, operation)
+
+
+def _scalar(value):
+    """
+    Comparable Python value of a key AttributeValue (S, N or B)
+    """
+    if 'N' in value:
+        return Decimal(value['N'])
+    if 'S' in value:
+        return value['S']
+    return value['B']
+
+
+def _condition_holds(expression, names, values, item):
+    """
+    Evaluate a condition expression against item (None when there is no item)
+    """
+    item = item or {}
+
+    def term_holds(term):
+        match = _ATTRIBUTE_CHECK.match(term)
+        if match:
+            exists = names.get(match.group('name'), match.group('name')) in item
+            return exists if match.group('function').lower() == 'attribute_exists' else not exists
+        match = _COMPARISON.match(term)
+        if not match:
+            raise _client_error('ValidationException', f"Condition not supported: {term}", 'PutItem')
+        name = names.get(match.group('name'), match.group('name'))
+        if name not in item:
+            return False
+        return _OPERATORS[match.group('op')](_scalar(item[name]), _scalar(values[match.group('value')]))
+
+    return any(all(term_holds(term.strip()) for term in re.split(r'\s+AND\s+', clause, flags=re.IGNORECASE))
+               for clause in re.split(r'\s+OR\s+', expression.strip(), flags=re.IGNORECASE))
+
+
+class FakeDynamoDBClient:
+    """
+    Thread-safe in-memory DynamoDB client
+    tables maps table names to (partition key, sort key); unprocessed_rate makes
+    batch_write_item return that fraction of the requests as UnprocessedItems,
+    like a throttled table
+    """
+
+    def __init__(self, tables=None, latency=0.0, unprocessed_rate=0.0, seed=None):
+        self.key_schema = dict(DEFAULT_TABLES if tables is None else tables)
+        self.tables = {name: {} for name in self.key_schema}
+        self.latency = latency
+        self.unprocessed_rate = unprocessed_rate
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _table(self, name, operation):
+        if name not in self.tables:
+            raise _client_error('ResourceNotFoundException', f"Requested resource not found: {name}", operation)
+        return self.tables[name]
+
+    def _key(self, table_name, item, operation):
+        partition, sort = self.key_schema[table_name]
+        try:
+            return (_scalar(item[partition]), _scalar(item[sort]) if sort else None)
+        except KeyError:
+            raise _client_error('ValidationException', 'The provided key element does not match the schema', operation)
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self._count('put_item')
+        table = self._table(TableName, 'PutItem')
+        key = self._key(TableName, Item, 'PutItem')
+        with self._lock:
+            if ConditionExpression and not _condition_holds(ConditionExpression, ExpressionAttributeNames or {},
+                                                            ExpressionAttributeValues or {}, table.get(key)):
+                raise _client_error('ConditionalCheckFailedException', 'The conditional request failed', 'PutItem')
+            table[key] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        self._count('get_item')
+        table = self._table(TableName, 'GetItem')
+        with self._lock:
+            item = table.get(self._key(TableName, Key, 'GetItem'))
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        self._count('delete_item')
+        table = self._table(TableName, 'DeleteItem')
+        key = self._key(TableName, Key, 'DeleteItem')
+        with self._lock:
+            if ConditionExpression and not _condition_holds(ConditionExpression, ExpressionAttributeNames or {},
+                                                            ExpressionAttributeValues or {}, table.get(key)):
+                raise _client_error('ConditionalCheckFailedException', 'The conditional request failed', 'DeleteItem')
+            table.pop(key, None)
+        return {}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self._count('batch_write_item')
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            table = self._table(table_name, 'BatchWriteItem')
+            if len(requests) > 25:
+                raise _client_error('ValidationException', 'Too many items requested for the BatchWriteItem call',
+                                    'BatchWriteItem')
+            for request in requests:
+                if self.unprocessed_rate and self._random.random() < self.unprocessed_rate:
+                    unprocessed.setdefault(table_name, []).append(request)
+                    continue
+                if 'PutRequest' in request:
+                    item = request['PutRequest']['Item']
+                    with self._lock:
+                        table[self._key(table_name, item, 'BatchWriteItem')] = copy.deepcopy(item)
+                else:
+                    with self._lock:
+                        table.pop(self._key(table_name, request['DeleteRequest']['Key'], 'BatchWriteItem'), None)
+        return {'UnprocessedItems': unprocessed}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, ProjectionExpression=None, **kwargs):
+        self._count('query')
+        table = self._table(TableName, 'Query')
+        names = ExpressionAttributeNames or {}
+        partition, sort = self.key_schema[TableName]
+
+        # The partition condition comes first; the rest (which may contain BETWEEN ... AND) is the sort condition
+        conditions = [part.strip() for part in re.split(r'\s+AND\s+', KeyConditionExpression, maxsplit=1,
+                                                        flags=re.IGNORECASE)]
+        partition_match = re.match(r'^(#?\w+)\s*=\s*(:\w+)$', conditions[0])
+        if not partition_match or names.get(partition_match.group(1), partition_match.group(1)) != partition:
+            raise _client_error('ValidationException', 'Query condition missed key schema element', 'Query')
+        partition_value = _scalar(ExpressionAttributeValues[partition_match.group(2)])
+        matches_sort = self._sort_condition(conditions[1] if len(conditions) > 1 else None, names, sort,
+                                            ExpressionAttributeValues)
+
+        with self._lock:
+            keys = sorted(key for key in table if key[0] == partition_value and matches_sort(key[1]))
+        if not ScanIndexForward:
+            keys.reverse()
+        if ExclusiveStartKey:
+            start = self._key(TableName, ExclusiveStartKey, 'Query')
+            keys = [key for key in keys if (key[1] > start[1] if ScanIndexForward else key[1] < start[1])]
+
+        page = keys[:Limit] if Limit else keys
+        with self._lock:
+            items = [copy.deepcopy(table[key]) for key in page if key in table]
+
+        response = {'Items': items, 'Count': len(items), 'ScannedCount': len(items)}
+        if Limit and len(keys) > Limit:
+            last = items[-1]
+            response['LastEvaluatedKey'] = {name: last[name] for name in (partition, sort) if name}
+        if ProjectionExpression:
+            fields = [names.get(field.strip(), field.strip()) for field in ProjectionExpression.split(',')]
+            response['Items'] = [{field: item[field] for field in fields if field in item} for item in items]
+        return response
+
+    @staticmethod
+    def _sort_condition(condition, names, sort, values):
+        """
+        Predicate on the sort key value for a key condition (None matches everything)
+        """
+        if condition is None:
+            return lambda value: True
+
+        match = _BEGINS_WITH.match(condition)
+        if match:
+            if names.get(match.group('name'), match.group('name')) != sort:
+                raise _client_error('ValidationException', 'Query key condition not supported', 'Query')
+            prefix = _scalar(values[match.group('value')])
+            return lambda value: value.startswith(prefix)
+
+        match = _SORT_CONDITION.match(condition)
+        if not match or names.get(match.group('name'), match.group('name')) != sort:
+            raise _client_error('ValidationException', 'Query key condition not supported', 'Query')
+        if match.group('low'):
+            low, high = _scalar(values[match.group('low')]), _scalar(values[match.group('high')])
+            return lambda value: low <= value <= high
+
+        operand = _scalar(values[match.group('value')])
+        return {
+            '=': lambda value: value == operand,
+            '<': lambda value: value < operand,
+            '<=': lambda value: value <= operand,
+            '>': lambda value: value > operand,
+            '>=': lambda value: value >= operand
+        }[match.group('op')]
@@ -0,0 +1,71 @@
+"""
+In-process stand-in for the boto3 Lambda client
+invoke() calls registered handler functions directly: RequestResponse runs
+inline, Event invocations run on a thread pool like Lambda's async queue
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from botocore.exceptions import ClientError
+
+
+class FakeLambdaClient:
+    """
+    functions maps function names to handler(event, context)
+    Errors raised by async invocations are collected in self.errors
+    """
+
+    def __init__(self, functions=None, max_workers=4):
+        self.functions = dict(functions or {})
+        self.calls = {}
+        self.errors = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def register(self, name, function):
+        self.functions[name] = function
+
+    def _run(self, name, event):
+        try:
+            return self.functions[name](event, None)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((name, str(e)))
+            raise
+
+    def invoke(self, FunctionName, Payload=b'{}', InvocationType='RequestResponse', **kwargs):
+        with self._lock:
+            self.calls[InvocationType] = self.calls.get(InvocationType, 0) + 1
+        if FunctionName not in self.functions:
+            raise ClientError({'Error': {'Code': 'ResourceNotFoundException', 'Message': f"Function not found: {FunctionName}"},
+                               'ResponseMetadata': {'HTTPStatusCode': 404}}, 'Invoke')
+
+        event = json.loads(Payload)
+        if InvocationType == 'Event':
+            future = self._executor.submit(self._run, FunctionName, event)
+            with self._lock:
+                self._pending.append(future)
+            return {'StatusCode': 202}
+
+        result = self._run(FunctionName, event)
+        return {'StatusCode': 200, 'Payload': BytesIO(json.dumps(result).encode('utf-8'))}
+
+    def drain(self):
+        """
+        Wait for every async invocation submitted so far
+        """
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            for future in pending:
+                future.exception()
+
+    def close(self):
+        self.drain()
+        self._executor.shutdown()
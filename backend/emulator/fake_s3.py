@@ -0,0 +1,174 @@
+"""
+In-memory stand-in for the boto3 S3 client
+Implements the subset of the client API used by the Lambda handlers so they
+can run offline (benchmarks, local pipeline runs)
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from io import BytesIO
+from urllib.parse import quote
+
+from botocore.exceptions import ClientError
+
+
+def _client_error(code, message, operation):
+    status = {'NoSuchKey': 404, '404': 404, 'NoSuchUpload': 404, 'PreconditionFailed': 412}.get(code, 400)
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+
+class FakeS3Client:
+    """
+    Thread-safe in-memory S3 client
+    Objects are stored as {(bucket, key): {'Body': bytes, 'ETag': str, ...extra args}}
+    latency (seconds) is added to every call to approximate network round trips
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+        self.calls = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, bucket, key, operation):
+        with self._lock:
+            stored = self.objects.get((bucket, key))
+        if stored is None:
+            raise _client_error('NoSuchKey', f"{bucket}/{key}", operation)
+        return stored
+
+    def _store(self, bucket, key, body, extra):
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self._lock:
+            self.objects[(bucket, key)] = dict(extra, Body=body, ETag=etag)
+        return etag
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._count('get_object')
+        stored = self._get(Bucket, Key, 'GetObject')
+        return {
+            'Body': BytesIO(stored['Body']),
+            'ContentLength': len(stored['Body']),
+            'ContentType': stored.get('ContentType', 'binary/octet-stream'),
+            'ETag': stored['ETag'],
+            'Metadata': stored.get('Metadata', {})
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._count('head_object')
+        try:
+            stored = self._get(Bucket, Key, 'HeadObject')
+        except ClientError:
+            # HEAD responses carry no error body, boto3 reports the status code
+            raise _client_error('404', 'Not Found', 'HeadObject')
+        return {
+            'ContentLength': len(stored['Body']),
+            'ContentType': stored.get('ContentType', 'binary/octet-stream'),
+            'ETag': stored['ETag'],
+            'Metadata': stored.get('Metadata', {})
+        }
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self._count('put_object')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        return {'ETag': self._store(Bucket, Key, bytes(Body), kwargs)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._count('delete_object')
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource, CopySourceIfMatch=None, MetadataDirective='COPY', **kwargs):
+        self._count('copy_object')
+        source = self._get(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        if CopySourceIfMatch and CopySourceIfMatch != source['ETag']:
+            raise _client_error('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold', 'CopyObject')
+
+        extra = kwargs if MetadataDirective == 'REPLACE' else {k: v for k, v in source.items() if k not in ('Body', 'ETag')}
+        etag = self._store(Bucket, Key, source['Body'], extra)
+        return {'CopyObjectResult': {'ETag': etag}}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self._count('upload_fileobj')
+        self._store(Bucket, Key, Fileobj.read(), ExtraArgs or {})
+
+    def download_fileobj(self, Bucket, Key, Fileobj, ExtraArgs=None, Callback=None, Config=None):
+        self._count('download_fileobj')
+        Fileobj.write(self._get(Bucket, Key, 'GetObject')['Body'])
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, StartAfter=None, **kwargs):
+        self._count('list_objects_v2')
+        after = ContinuationToken or StartAfter
+        with self._lock:
+            contents = sorted(
+                ({'Key': key, 'Size': len(stored['Body']), 'ETag': stored['ETag']}
+                 for (bucket, key), stored in self.objects.items()
+                 if bucket == Bucket and key.startswith(Prefix) and (not after or key > after)),
+                key=lambda entry: entry['Key']
+            )
+
+        page = contents[:MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'IsTruncated': len(contents) > MaxKeys,
+            'Contents': page
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]['Key']
+        return response
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._count('create_multipart_upload')
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'extra': kwargs, 'parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._count('upload_part')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        with self._lock:
+            upload = self._uploads.get(UploadId)
+            if upload is None:
+                raise _client_error('NoSuchUpload', UploadId, 'UploadPart')
+            upload['parts'][PartNumber] = bytes(Body)
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._count('complete_multipart_upload')
+        with self._lock:
+            upload = self._uploads.pop(UploadId, None)
+        if upload is None:
+            raise _client_error('NoSuchUpload', UploadId, 'CompleteMultipartUpload')
+
+        body = b''.join(upload['parts'][part['PartNumber']] for part in MultipartUpload['Parts'])
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': self._store(Bucket, Key, body, upload['extra'])}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._count('abort_multipart_upload')
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, HttpMethod=None):
+        self._count('generate_presigned_url')
+        Params = Params or {}
+        url = f"https://{Params.get('Bucket')}.s3.local/{quote(Params.get('Key', ''))}?X-Amz-Expires={ExpiresIn}"
+        if 'UploadId' in Params:
+            url += f"&uploadId={Params['UploadId']}&partNumber={Params['PartNumber']}"
+        return url
@@ -0,0 +1,247 @@
+"""
+Local end-to-end ImageHub pipeline
+Loads the Lambda handlers in-process and wires them to in-memory S3,
+DynamoDB and Lambda fakes:
+
+    get_presigned_url -> PUT to the source bucket -> image_processor
+        -> save_image_history (async invoke) -> get_image_history
+    image_processor -> completion record -> get_processing_status
+    GET /img/{key} -> image_processor.transform_handler (variants cached in S3)
+
+Usage:
+    with Pipeline() as pipeline:
+        upload = pipeline.upload(image_bytes, 'photo.jpg', user_id='user-1', width=400, height=300)
+        pipeline.process([upload['key']])
+        pipeline.drain()
+        items = pipeline.history('user-1')
+"""
+
+import importlib.util
+import json
+import os
+import sys
+from urllib.parse import quote, quote_plus
+
+from .fake_dynamodb import FakeDynamoDBClient
+from .fake_lambda import FakeLambdaClient
+from .fake_s3 import FakeS3Client
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAMBDAS_DIR = os.path.join(BACKEND_DIR, 'lambdas')
+
+HISTORY_FUNCTION = 'save-image-history'
+
+# Environment the handlers are loaded with (overridable per Pipeline)
+DEFAULT_ENV = {
+    'SOURCE_BUCKET': 'imagehub-source-images',
+    'PROCESSED_BUCKET': 'imagehub-processed-images',
+    'S3_BUCKET_NAME': 'imagehub-processed-images',
+    'DYNAMODB_TABLE_NAME': 'ImageHistory',
+    'STATUS_TABLE': 'imagehub-job-status',
+    'TRANSFORM_LEASE_TABLE': 'imagehub-transform-leases',
+    'SERVER_SIDE_HISTORY': 'true',
+    'HISTORY_FUNCTION_NAME': HISTORY_FUNCTION,
+    'DEDUP_CACHE': 'memory',
+    'URL_MODE': 'presigned',
+    'AWS_DEFAULT_REGION': 'us-east-1'
+}
+
+
+class EmulatorError(Exception):
+    """
+    A handler returned an error response
+    """
+
+
+def load_handler(name, alias):
+    """
+    Import lambdas/{name}/handler.py as a fresh module called alias
+    Every function has a handler.py, so they can't share the module name
+    """
+    for path in (LAMBDAS_DIR, os.path.join(LAMBDAS_DIR, name)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(alias, os.path.join(LAMBDAS_DIR, name, 'handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _body(response, expected=(200,)):
+    body = json.loads(response['body']) if response.get('body') else {}
+    if response['statusCode'] not in expected:
+        raise EmulatorError(f"HTTP {response['statusCode']}: {body}")
+    return body
+
+
+class Pipeline:
+    """
+    The handlers running against shared in-memory fakes
+    s3_latency/dynamodb_latency (seconds) are added to every fake call;
+    unprocessed_rate throttles DynamoDB batch writes (see FakeDynamoDBClient)
+    Per-image metrics from image_processor are collected in self.metrics
+    """
+
+    def __init__(self, env=None, s3_latency=0.0, dynamodb_latency=0.0, unprocessed_rate=0.0, history_workers=4):
+        self.env = dict(DEFAULT_ENV, **(env or {}))
+        self.s3 = FakeS3Client(latency=s3_latency)
+        self.dynamodb = FakeDynamoDBClient(
+            tables={self.env['DYNAMODB_TABLE_NAME']: ('userId', 'timestamp'),
+                    self.env['STATUS_TABLE']: ('uploadKey', None),
+                    self.env['TRANSFORM_LEASE_TABLE']: ('variantKey', None)},
+            latency=dynamodb_latency,
+            unprocessed_rate=unprocessed_rate
+        )
+        self.lambda_client = FakeLambdaClient(max_workers=history_workers)
+        self.metrics = []
+
+        saved_env = {name: os.environ.get(name) for name in self.env}
+        os.environ.update(self.env)
+        try:
+            self.presigned_url = load_handler('get_presigned_url', 'emulator_get_presigned_url')
+            self.image_processor = load_handler('image_processor', 'emulator_image_processor')
+            self.save_history = load_handler('save_image_history', 'emulator_save_image_history')
+            self.get_history = load_handler('get_image_history', 'emulator_get_image_history')
+            self.processing_status = load_handler('get_processing_status', 'emulator_get_processing_status')
+        finally:
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        # Handlers create their clients through common.aws, so they pick up the fakes
+        from common import aws
+        self._aws = aws
+        self._replaced = {service: aws.set_client(service, fake)
+                          for service, fake in (('s3', self.s3), ('dynamodb', self.dynamodb),
+                                                ('lambda', self.lambda_client))}
+        self.lambda_client.register(HISTORY_FUNCTION, self.save_history.lambda_handler)
+
+        import instrumentation
+        import job_status
+        import transform
+        self._instrumentation = instrumentation
+        instrumentation.set_sink(self.metrics.append)
+        # job_status and transform may have been imported before the environment was set
+        job_status.STATUS_TABLE = self.env['STATUS_TABLE']
+        transform.LEASE_TABLE = self.env['TRANSFORM_LEASE_TABLE']
+
+    @property
+    def source_bucket(self):
+        return self.env['SOURCE_BUCKET']
+
+    @property
+    def processed_bucket(self):
+        return self.env['PROCESSED_BUCKET']
+
+    def request_upload(self, filename, content_type='image/jpeg', user_id=None, **options):
+        """
+        Call get_presigned_url; options are request body fields (width, height, format, ...)
+        Returns the response body
+        """
+        body = dict(options, filename=filename, contentType=content_type)
+        if user_id:
+            body['userId'] = user_id
+        return _body(self.presigned_url.handler({'body': json.dumps(body)}, None))
+
+    def request_uploads(self, files, user_id=None, **options):
+        """
+        Call get_presigned_url in batch mode; files are request body fields per
+        file (filename, contentType, size, ...), options are shared by all files
+        Returns the uploads of the response body
+        """
+        body = dict(options, files=files)
+        if user_id:
+            body['userId'] = user_id
+        return _body(self.presigned_url.handler({'body': json.dumps(body)}, None))['uploads']
+
+    def put(self, upload, data):
+        """
+        PUT data as a client would with the presigned URL: the signed headers
+        become the object's content type and user metadata
+        Multipart uploads PUT each part then complete through get_presigned_url
+        """
+        if upload.get('multipart'):
+            multipart = upload['multipart']
+            parts = []
+            for part in multipart['parts']:
+                start = (part['partNumber'] - 1) * multipart['partSize']
+                response = self.s3.upload_part(Bucket=self.source_bucket, Key=upload['key'], UploadId=multipart['uploadId'],
+                                               PartNumber=part['partNumber'], Body=data[start:start + multipart['partSize']])
+                parts.append({'partNumber': part['partNumber'], 'etag': response['ETag']})
+            body = {'action': 'complete', 'key': upload['key'], 'uploadId': multipart['uploadId'], 'parts': parts}
+            _body(self.presigned_url.handler({'body': json.dumps(body)}, None))
+            return
+
+        headers = upload['uploadHeaders']
+        metadata = {name[len('x-amz-meta-'):]: value for name, value in headers.items()
+                    if name.startswith('x-amz-meta-')}
+        self.s3.put_object(Bucket=self.source_bucket, Key=upload['key'], Body=data,
+                           ContentType=headers.get('Content-Type'), Metadata=metadata)
+
+    def upload(self, data, filename, content_type='image/jpeg', user_id=None, **options):
+        """
+        Request a presigned URL and upload data with it; returns the presign response body
+        """
+        upload = self.request_upload(filename, content_type, user_id, **options)
+        self.put(upload, data)
+        return upload
+
+    def process(self, keys):
+        """
+        Deliver one S3 notification with a record per key to image_processor
+        Returns the handler response
+        """
+        # S3 notifications carry URL-encoded keys
+        records = [{'eventSource': 'aws:s3',
+                    's3': {'bucket': {'name': self.source_bucket}, 'object': {'key': quote_plus(key, safe='/')}}}
+                   for key in keys]
+        return self.image_processor.handler({'Records': records}, None)
+
+    def drain(self):
+        """
+        Wait for the async save_image_history invocations
+        """
+        self.lambda_client.drain()
+
+    def status(self, key, wait=0):
+        """
+        Call get_processing_status for an upload key; returns (status code, body)
+        """
+        response = self.processing_status.handler({'queryStringParameters': {'key': key, 'wait': str(wait)}}, None)
+        return response['statusCode'], _body(response, expected=(200, 202))
+
+    def transform(self, key, headers=None, **params):
+        """
+        GET /img/{key} from the transform endpoint; params are the query string (w, h, fmt, q)
+        Returns the handler response (images are base64 encoded, see isBase64Encoded)
+        """
+        event = {'rawPath': '/img/' + quote(key), 'headers': headers or {},
+                 'queryStringParameters': {name: str(value) for name, value in params.items()}}
+        return self.image_processor.transform_handler(event, None)
+
+    def history(self, user_id, **params):
+        """
+        Every history item of user_id, following nextToken across pages
+        """
+        items = []
+        params = dict(params, userId=user_id)
+        while True:
+            body = _body(self.get_history.lambda_handler({'queryStringParameters': params}, None))
+            items.extend(body['items'])
+            if not body.get('nextToken'):
+                return items
+            params['nextToken'] = body['nextToken']
+
+    def close(self):
+        self.lambda_client.close()
+        self._instrumentation.set_sink(None)
+        for service, previous in self._replaced.items():
+            self._aws.set_client(service, previous)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
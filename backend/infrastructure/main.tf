@@ -77,6 +77,11 @@ resource "aws_s3_bucket_lifecycle_configuration" "source_lifecycle" {
     expiration {
       days = 7
     }
+
+    # Multipart uploads the client never completed (parts are billed until aborted)
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
   }
 }
 
@@ -123,6 +128,52 @@ resource "aws_s3_bucket_cors_configuration" "source_cors" {
   }
 }
 
+# DynamoDB table for processing completion records (written by image_processor,
+# long-polled by get_processing_status)
+resource "aws_dynamodb_table" "job_status" {
+  name         = "${var.project_name}-job-status-${var.environment}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "uploadKey"
+
+  attribute {
+    name = "uploadKey"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "ttl"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "ImageHub Job Status"
+    Environment = var.environment
+  }
+}
+
+# DynamoDB table for on-demand transform leases (one renderer per missing variant)
+resource "aws_dynamodb_table" "transform_leases" {
+  name         = "${var.project_name}-transform-leases-${var.environment}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "variantKey"
+
+  attribute {
+    name = "variantKey"
+    type = "S"
+  }
+
+  # Abandoned leases are ignored once expired; TTL only cleans them up
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "ImageHub Transform Leases"
+    Environment = var.environment
+  }
+}
+
 # IAM Role for Image Processor Lambda
 resource "aws_iam_role" "image_processor_role" {
   name = "${var.project_name}-image-processor-role-${var.environment}"
@@ -164,11 +215,21 @@ resource "aws_iam_role_policy" "image_processor_policy" {
       {
         Effect = "Allow"
         Action = [
+          "s3:GetObject",
           "s3:PutObject",
-          "s3:PutObjectAcl"
+          "s3:PutObjectAcl",
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload"
         ]
         Resource = "${aws_s3_bucket.processed_images.arn}/*"
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:PutItem"
+        ]
+        Resource = aws_dynamodb_table.job_status.arn
+      },
       {
         Effect = "Allow"
         Action = [
@@ -233,6 +294,126 @@ resource "aws_iam_role_policy" "presigned_url_policy" {
   })
 }
 
+# IAM Role for Processing Status Lambda
+resource "aws_iam_role" "processing_status_role" {
+  name = "${var.project_name}-processing-status-role-${var.environment}"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+
+  tags = {
+    Name        = "ImageHub Processing Status Role"
+    Environment = var.environment
+  }
+}
+
+# IAM Policy for Processing Status Lambda
+resource "aws_iam_role_policy" "processing_status_policy" {
+  name = "${var.project_name}-processing-status-policy"
+  role = aws_iam_role.processing_status_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:GetItem"
+        ]
+        Resource = aws_dynamodb_table.job_status.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      }
+    ]
+  })
+}
+
+# IAM Role for Image Transform Lambda
+resource "aws_iam_role" "image_transform_role" {
+  name = "${var.project_name}-image-transform-role-${var.environment}"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+
+  tags = {
+    Name        = "ImageHub Image Transform Role"
+    Environment = var.environment
+  }
+}
+
+# IAM Policy for Image Transform Lambda
+resource "aws_iam_role_policy" "image_transform_policy" {
+  name = "${var.project_name}-image-transform-policy"
+  role = aws_iam_role.image_transform_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:AbortMultipartUpload"
+        ]
+        Resource = "${aws_s3_bucket.processed_images.arn}/*"
+      },
+      {
+        # GetObject on a missing key returns 404 instead of 403
+        Effect = "Allow"
+        Action = [
+          "s3:ListBucket"
+        ]
+        Resource = aws_s3_bucket.processed_images.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:PutItem",
+          "dynamodb:DeleteItem"
+        ]
+        Resource = aws_dynamodb_table.transform_leases.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      }
+    ]
+  })
+}
+
 # Lambda Function: Image Processor
 # Note: You need to create a deployment package first
 resource "aws_lambda_function" "image_processor" {
@@ -251,6 +432,13 @@ resource "aws_lambda_function" "image_processor" {
       DEFAULT_WIDTH    = "800"
       DEFAULT_HEIGHT   = "600"
       DEFAULT_QUALITY  = "85"
+      MAX_WORKERS      = "4"
+      # Worker processes from the vCPUs the memory size buys (none at 512MB)
+      ENCODE_PROCESSES = "auto"
+      DEFAULT_PROFILE  = "balanced"
+      DEDUP_CACHE      = "memory"
+      METRICS_MODE     = "emf"
+      STATUS_TABLE     = aws_dynamodb_table.job_status.name
     }
   }
 
@@ -273,9 +461,12 @@ resource "aws_lambda_function" "presigned_url" {
 
   environment {
     variables = {
-      SOURCE_BUCKET  = aws_s3_bucket.source_images.bucket
-      URL_EXPIRATION = "300"
-      MAX_FILE_SIZE  = "10485760"
+      SOURCE_BUCKET       = aws_s3_bucket.source_images.bucket
+      URL_EXPIRATION      = "300"
+      MAX_FILE_SIZE       = "10485760"
+      MAX_BATCH_FILES     = "200"
+      MULTIPART_THRESHOLD = "8388608"
+      MULTIPART_PART_SIZE = "5242880"
     }
   }
 
@@ -285,6 +476,92 @@ resource "aws_lambda_function" "presigned_url" {
   }
 }
 
+# Lambda Function: Processing Status (long-poll)
+resource "aws_lambda_function" "processing_status" {
+  filename         = "${path.module}/../deployment/get_processing_status.zip"
+  function_name    = "${var.project_name}-processing-status-${var.environment}"
+  role            = aws_iam_role.processing_status_role.arn
+  handler         = "handler.handler"
+  source_code_hash = filebase64sha256("${path.module}/../deployment/get_processing_status.zip")
+  runtime         = "python3.11"
+  timeout         = 28  # Below the 29s API Gateway integration timeout
+  memory_size     = 128
+
+  environment {
+    variables = {
+      STATUS_TABLE     = aws_dynamodb_table.job_status.name
+      MAX_WAIT_SECONDS = "20"
+    }
+  }
+
+  tags = {
+    Name        = "ImageHub Processing Status"
+    Environment = var.environment
+  }
+}
+
+# Lambda Function: Image Transform (on-demand resize, same package as the Image Processor)
+resource "aws_lambda_function" "image_transform" {
+  filename         = "${path.module}/../deployment/image_processor.zip"
+  function_name    = "${var.project_name}-image-transform-${var.environment}"
+  role            = aws_iam_role.image_transform_role.arn
+  handler         = "handler.transform_handler"
+  source_code_hash = filebase64sha256("${path.module}/../deployment/image_processor.zip")
+  runtime         = "python3.11"
+  timeout         = 30  # CloudFront waits 30s for the origin
+  memory_size     = 1024
+
+  environment {
+    variables = {
+      PROCESSED_BUCKET        = aws_s3_bucket.processed_images.bucket
+      DEFAULT_QUALITY         = "85"
+      # Variant keys already identify the output, the rendition dedup cache isn't used
+      DEDUP_CACHE             = "none"
+      TRANSFORM_LEASE_TABLE   = aws_dynamodb_table.transform_leases.name
+      TRANSFORM_LEASE_SECONDS = "25"
+      TRANSFORM_CACHE_SECONDS = "300"
+    }
+  }
+
+  tags = {
+    Name        = "ImageHub Image Transform"
+    Environment = var.environment
+  }
+}
+
+# Function URL used as the CloudFront origin for /img/*
+# (returns binary bodies without API Gateway binary media type setup)
+# IAM auth: only CloudFront, signing through the origin access control, may call it
+resource "aws_lambda_function_url" "image_transform" {
+  function_name      = aws_lambda_function.image_transform.function_name
+  authorization_type = "AWS_IAM"
+}
+
+resource "aws_cloudfront_origin_access_control" "image_transform" {
+  name                              = "${var.project_name}-image-transform-${var.environment}"
+  description                       = "Signs CloudFront requests to the image transform function URL"
+  origin_access_control_origin_type = "lambda"
+  signing_behavior                  = "always"
+  signing_protocol                  = "sigv4"
+}
+
+resource "aws_lambda_permission" "allow_function_url_transform" {
+  statement_id           = "AllowCloudFrontInvokeFunctionUrl"
+  action                 = "lambda:InvokeFunctionUrl"
+  function_name          = aws_lambda_function.image_transform.function_name
+  principal              = "cloudfront.amazonaws.com"
+  source_arn             = aws_cloudfront_distribution.processed_images_cdn.arn
+  function_url_auth_type = "AWS_IAM"
+}
+
+resource "aws_lambda_permission" "allow_cloudfront_transform" {
+  statement_id  = "AllowCloudFrontInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.image_transform.function_name
+  principal     = "cloudfront.amazonaws.com"
+  source_arn    = aws_cloudfront_distribution.processed_images_cdn.arn
+}
+
 # S3 Bucket Notification to trigger Lambda
 resource "aws_s3_bucket_notification" "source_bucket_notification" {
   bucket = aws_s3_bucket.source_images.id
@@ -391,6 +668,79 @@ resource "aws_api_gateway_integration_response" "upload_options_integration_resp
   }
 }
 
+# API Gateway Resource: /status
+resource "aws_api_gateway_resource" "status" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_rest_api.api.root_resource_id
+  path_part   = "status"
+}
+
+# API Gateway Method: GET /status
+resource "aws_api_gateway_method" "status_get" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.status.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
+
+# API Gateway Method: OPTIONS /status (for CORS)
+resource "aws_api_gateway_method" "status_options" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.status.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+# API Gateway Integration: GET /status
+resource "aws_api_gateway_integration" "status_get_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.status.id
+  http_method             = aws_api_gateway_method.status_get.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.processing_status.invoke_arn
+}
+
+# API Gateway Integration: OPTIONS /status
+resource "aws_api_gateway_integration" "status_options_integration" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.status.id
+  http_method = aws_api_gateway_method.status_options.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+# API Gateway Method Response: OPTIONS /status
+resource "aws_api_gateway_method_response" "status_options_response" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.status.id
+  http_method = aws_api_gateway_method.status_options.http_method
+  status_code = "200"
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true
+    "method.response.header.Access-Control-Allow-Methods" = true
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+# API Gateway Integration Response: OPTIONS /status
+resource "aws_api_gateway_integration_response" "status_options_integration_response" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.status.id
+  http_method = aws_api_gateway_method.status_options.http_method
+  status_code = aws_api_gateway_method_response.status_options_response.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'"
+    "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'"
+  }
+}
+
 # API Gateway Deployment
 resource "aws_api_gateway_deployment" "api_deployment" {
   rest_api_id = aws_api_gateway_rest_api.api.id
@@ -400,6 +750,9 @@ resource "aws_api_gateway_deployment" "api_deployment" {
       aws_api_gateway_resource.upload.id,
       aws_api_gateway_method.upload_post.id,
       aws_api_gateway_integration.upload_post_integration.id,
+      aws_api_gateway_resource.status.id,
+      aws_api_gateway_method.status_get.id,
+      aws_api_gateway_integration.status_get_integration.id,
     ]))
   }
 
@@ -409,7 +762,9 @@ resource "aws_api_gateway_deployment" "api_deployment" {
 
   depends_on = [
     aws_api_gateway_integration.upload_post_integration,
-    aws_api_gateway_integration.upload_options_integration
+    aws_api_gateway_integration.upload_options_integration,
+    aws_api_gateway_integration.status_get_integration,
+    aws_api_gateway_integration.status_options_integration
   ]
 }
 
@@ -434,6 +789,15 @@ resource "aws_lambda_permission" "allow_api_gateway" {
   source_arn    = "${aws_api_gateway_rest_api.api.execution_arn}/*/*"
 }
 
+# Lambda permission for API Gateway: Processing Status
+resource "aws_lambda_permission" "allow_api_gateway_status" {
+  statement_id  = "AllowAPIGatewayInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.processing_status.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "${aws_api_gateway_rest_api.api.execution_arn}/*/*"
+}
+
 # CloudFront Distribution for Processed Images
 resource "aws_cloudfront_distribution" "processed_images_cdn" {
   enabled             = true
@@ -446,6 +810,19 @@ resource "aws_cloudfront_distribution" "processed_images_cdn" {
     origin_id   = "S3-${aws_s3_bucket.processed_images.bucket}"
   }
 
+  origin {
+    domain_name              = split("/", aws_lambda_function_url.image_transform.function_url)[2]
+    origin_id                = "Transform-${aws_lambda_function.image_transform.function_name}"
+    origin_access_control_id = aws_cloudfront_origin_access_control.image_transform.id
+
+    custom_origin_config {
+      http_port              = 80
+      https_port             = 443
+      origin_protocol_policy = "https-only"
+      origin_ssl_protocols   = ["TLSv1.2"]
+    }
+  }
+
   default_cache_behavior {
     allowed_methods        = ["GET", "HEAD"]
     cached_methods         = ["GET", "HEAD"]
@@ -464,6 +841,30 @@ resource "aws_cloudfront_distribution" "processed_images_cdn" {
     max_ttl     = 31536000
   }
 
+  # On-demand transforms: /img/{processed key}?w=&h=&fmt=&q=
+  # Only the transform parameters are part of the cache key. The URL stays the
+  # same when the processed image is replaced, so responses expire after
+  # TRANSFORM_CACHE_SECONDS and are revalidated with their ETag (304)
+  ordered_cache_behavior {
+    path_pattern           = "/img/*"
+    allowed_methods        = ["GET", "HEAD"]
+    cached_methods         = ["GET", "HEAD"]
+    target_origin_id       = "Transform-${aws_lambda_function.image_transform.function_name}"
+    viewer_protocol_policy = "redirect-to-https"
+
+    forwarded_values {
+      query_string            = true
+      query_string_cache_keys = ["w", "h", "fmt", "q"]
+      cookies {
+        forward = "none"
+      }
+    }
+
+    min_ttl     = 0
+    default_ttl = 300
+    max_ttl     = 300
+  }
+
   restrictions {
     geo_restriction {
       restriction_type = "none"
@@ -496,6 +897,16 @@ output "api_gateway_url" {
   value       = "${aws_api_gateway_stage.api_stage.invoke_url}/upload"
 }
 
+output "status_url" {
+  description = "Processing status (long-poll) endpoint URL"
+  value       = "${aws_api_gateway_stage.api_stage.invoke_url}/status"
+}
+
+output "transform_url" {
+  description = "On-demand transform endpoint (append a processed key and ?w=&h=&fmt=&q=)"
+  value       = "https://${aws_cloudfront_distribution.processed_images_cdn.domain_name}/img/"
+}
+
 output "cloudfront_domain" {
   description = "CloudFront distribution domain"
   value       = aws_cloudfront_distribution.processed_images_cdn.domain_name
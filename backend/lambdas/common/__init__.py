@@ -0,0 +1,14 @@
+"""
+Shared runtime helpers for the ImageHub Lambda functions
+scripts/build_lambdas.sh copies this package into every deployment zip
+
+Nothing here imports boto3 at module level: AWS clients are created on first
+use, so code paths that never touch AWS (validation errors, CORS preflight)
+don't pay for them during a cold start
+"""
+
+from common.aws import client, lazy_client
+from common.dynamodb import from_item, to_item
+from common.responses import cors_headers, json_response
+
+__all__ = ['client', 'lazy_client', 'from_item', 'to_item', 'cors_headers', 'json_response']
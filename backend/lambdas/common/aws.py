@@ -0,0 +1,87 @@
+"""
+Lazily constructed, shared AWS clients
+All clients come from one boto3 Session, so the service models loaded for the
+first client are reused by the next one, and share one tuned botocore Config
+"""
+
+import os
+import threading
+
+# Keep the pool at least as large as the image_processor worker pool
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '32'))
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '30'))
+
+CLIENT_CONFIG = {
+    'max_pool_connections': MAX_POOL_CONNECTIONS,
+    'tcp_keepalive': True,
+    'retries': {'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS},
+    'connect_timeout': CONNECT_TIMEOUT,
+    'read_timeout': READ_TIMEOUT
+}
+
+_session = None
+_clients = {}
+# boto3 sessions are not thread-safe while creating clients
+_lock = threading.Lock()
+
+
+def client(service_name, **config):
+    """
+    Shared client for service_name, created on first call
+    Keyword arguments override CLIENT_CONFIG (botocore.config.Config options)
+    """
+    cache_key = (service_name, repr(sorted(config.items())))
+    existing = _clients.get(cache_key)
+    if existing is not None:
+        return existing
+
+    with _lock:
+        existing = _clients.get(cache_key)
+        if existing is None:
+            global _session
+            import boto3
+            from botocore.config import Config
+
+            if _session is None:
+                _session = boto3.session.Session()
+            existing = _session.client(service_name, config=Config(**dict(CLIENT_CONFIG, **config)))
+            _clients[cache_key] = existing
+    return existing
+
+
+def set_client(service_name, instance, **config):
+    """
+    Replace the shared client for service_name, e.g. with an in-memory fake
+    (see emulator/); every lazy_client() for the service resolves to it
+    None removes the override. Returns the client it replaced, if any
+    """
+    cache_key = (service_name, repr(sorted(config.items())))
+    with _lock:
+        previous = _clients.pop(cache_key, None)
+        if instance is not None:
+            _clients[cache_key] = instance
+    return previous
+
+
+class LazyClient:
+    """
+    Stand-in for a boto3 client that is only created when first used
+    Lets handlers keep a module-level client (which tests can replace)
+    without paying for it at import time
+    """
+
+    def __init__(self, service_name, **config):
+        self._service_name = service_name
+        self._config = config
+
+    def __getattr__(self, name):
+        return getattr(client(self._service_name, **self._config), name)
+
+    def __repr__(self):
+        return f"LazyClient({self._service_name!r})"
+
+
+def lazy_client(service_name, **config):
+    return LazyClient(service_name, **config)
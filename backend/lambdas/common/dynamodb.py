@@ -0,0 +1,63 @@
+"""
+Conversion between Python values and DynamoDB AttributeValues
+Replaces the boto3 resource layer so handlers can use the low-level client
+Numbers come back as Decimal, matching what the resource layer returned
+"""
+
+from decimal import Decimal
+
+
+def to_attribute(value):
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, dict):
+        return {'M': {key: to_attribute(item) for key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [to_attribute(item) for item in value]}
+    # Floats must be converted to Decimal by the caller, like the resource layer requires
+    raise TypeError(f"Unsupported type for DynamoDB: {type(value).__name__}")
+
+
+def from_attribute(attribute):
+    (kind, value), = attribute.items()
+    if kind == 'S':
+        return value
+    if kind == 'N':
+        return Decimal(value)
+    if kind == 'BOOL':
+        return value
+    if kind == 'NULL':
+        return None
+    if kind == 'M':
+        return {key: from_attribute(item) for key, item in value.items()}
+    if kind == 'L':
+        return [from_attribute(item) for item in value]
+    if kind == 'B':
+        return value
+    if kind in ('SS', 'BS'):
+        return set(value)
+    if kind == 'NS':
+        return {Decimal(item) for item in value}
+    raise TypeError(f"Unsupported DynamoDB type: {kind}")
+
+
+def to_item(values):
+    """
+    Python dict -> DynamoDB item
+    """
+    return {key: to_attribute(value) for key, value in values.items()}
+
+
+def from_item(item):
+    """
+    DynamoDB item -> Python dict
+    """
+    return {key: from_attribute(value) for key, value in item.items()}
@@ -0,0 +1,147 @@
+"""
+Processing manifest shared by get_presigned_url and image_processor
+The manifest describes what to do with an upload (size, quality, format,
+watermark, extra renditions) and travels with the object as S3 user metadata,
+or as a JSON sidecar when it is too large for the 2KB metadata limit
+"""
+
+import json
+import re
+
+MANIFEST_VERSION = 1
+SUPPORTED_VERSIONS = (1,)
+
+# S3 user metadata keys (x-amz-meta-*)
+METADATA_KEY = 'manifest'
+SIDECAR_METADATA_KEY = 'manifest-key'
+# Manifests larger than this go to a sidecar object (all user metadata shares 2KB)
+MAX_METADATA_SIZE = 1536
+SIDECAR_PREFIX = 'manifests/'
+
+FORMATS = ('jpeg', 'png', 'webp', 'auto')
+# Speed/quality trade-offs, see image_processor/profiles.py
+PROFILES = ('fast', 'balanced', 'best')
+MAX_DIMENSION = 4000
+MAX_WATERMARK_LENGTH = 200
+MAX_RENDITIONS = 10
+RENDITION_NAME = re.compile(r'^[A-Za-z0-9-]{1,32}$')
+# outputName becomes one segment of processed/{outputName}[_{name}].{format}
+MAX_OUTPUT_NAME_LENGTH = 200
+
+
+def _check_size(errors, value, name, prefix=''):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1 or value > MAX_DIMENSION:
+        errors.append(f'{prefix}{name} must be between 1 and {MAX_DIMENSION}')
+
+
+def _check_quality(errors, value, prefix=''):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1 or value > 100:
+        errors.append(f'{prefix}quality must be between 1 and 100')
+
+
+def _check_format(errors, value, prefix=''):
+    if value not in FORMATS:
+        errors.append(f'{prefix}format must be one of: {", ".join(FORMATS)}')
+
+
+def _check_output_name(errors, value):
+    if (not isinstance(value, str) or not 0 < len(value) <= MAX_OUTPUT_NAME_LENGTH or value in ('.', '..')
+            or any(char in '/\\' or ord(char) < 32 or ord(char) == 127 for char in value)):
+        errors.append(f'outputName (the file name without extension) must be 1 to {MAX_OUTPUT_NAME_LENGTH} '
+                      'characters without slashes or control characters')
+
+
+def validate(manifest):
+    """
+    Validate manifest fields
+    Returns a list of error messages (empty when valid)
+    """
+    errors = []
+    _check_output_name(errors, manifest.get('outputName'))
+    _check_size(errors, manifest.get('width'), 'width')
+    _check_size(errors, manifest.get('height'), 'height')
+    _check_quality(errors, manifest.get('quality'))
+    _check_format(errors, manifest.get('format'))
+
+    if manifest.get('profile') is not None and manifest['profile'] not in PROFILES:
+        errors.append(f'profile must be one of: {", ".join(PROFILES)}')
+
+    watermark = manifest.get('watermark')
+    if watermark is not None and (not isinstance(watermark, str) or len(watermark) > MAX_WATERMARK_LENGTH):
+        errors.append(f'watermark must be a string of at most {MAX_WATERMARK_LENGTH} characters')
+
+    renditions = manifest.get('renditions')
+    if renditions is not None:
+        if not isinstance(renditions, list) or len(renditions) > MAX_RENDITIONS:
+            errors.append(f'renditions must be a list of at most {MAX_RENDITIONS} entries')
+        else:
+            names = set()
+            for index, rendition in enumerate(renditions):
+                prefix = f'renditions[{index}].'
+                if not isinstance(rendition, dict):
+                    errors.append(f'{prefix[:-1]} must be an object')
+                    continue
+                name = rendition.get('name')
+                if not isinstance(name, str) or not RENDITION_NAME.match(name) or name in names:
+                    errors.append(f'{prefix}name must be unique, 1-32 letters, digits or dashes')
+                names.add(name)
+                _check_size(errors, rendition.get('width'), 'width', prefix)
+                _check_size(errors, rendition.get('height'), 'height', prefix)
+                if 'format' in rendition:
+                    _check_format(errors, rendition['format'], prefix)
+                if 'quality' in rendition:
+                    _check_quality(errors, rendition['quality'], prefix)
+
+    return errors
+
+
+def build(body, output_name):
+    """
+    Build a manifest from an upload request body (defaults applied)
+    output_name is the base name of the processed objects
+    """
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'outputName': output_name,
+        'width': body.get('width', 800),
+        'height': body.get('height', 600),
+        'quality': body.get('quality', 85),
+        'format': body.get('format', 'jpeg'),
+        'watermark': body.get('watermark') or None
+    }
+    if body.get('profile') is not None:
+        manifest['profile'] = body['profile']
+    if body.get('renditions') is not None:
+        manifest['renditions'] = body['renditions']
+    return manifest
+
+
+def dumps(manifest):
+    """
+    Serialize a manifest as compact ASCII JSON (S3 metadata must be ASCII)
+    """
+    return json.dumps(manifest, separators=(',', ':'), ensure_ascii=True)
+
+
+def loads(value):
+    """
+    Parse and validate a serialized manifest
+    Raises ValueError for malformed, invalid or unsupported manifests
+    """
+    manifest = json.loads(value)
+    if not isinstance(manifest, dict):
+        raise ValueError('Manifest must be a JSON object')
+    if manifest.get('version') not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported manifest version: {manifest.get('version')}")
+    errors = validate(manifest)
+    if errors:
+        raise ValueError(f"Invalid manifest: {'; '.join(errors)}")
+    return manifest
+
+
+def sidecar_key(object_key):
+    """
+    Key of the sidecar holding the manifest of object_key (outside uploads/,
+    so writing it doesn't trigger processing)
+    """
+    return f"{SIDECAR_PREFIX}{object_key}.json"
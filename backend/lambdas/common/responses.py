@@ -0,0 +1,45 @@
+"""
+API Gateway proxy responses with CORS headers
+"""
+
+import json
+from decimal import Decimal
+
+ALLOWED_HEADERS = 'Content-Type,Authorization'
+
+
+def _json_default(obj):
+    # DynamoDB numbers are Decimal
+    if isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def cors_headers(methods, content_type='application/json'):
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': ALLOWED_HEADERS,
+        'Access-Control-Allow-Methods': methods
+    }
+    if content_type:
+        headers['Content-Type'] = content_type
+    return headers
+
+
+def json_response(status_code, body, methods='GET,OPTIONS', headers=None, multi_value_headers=None):
+    """
+    Build an API Gateway proxy response with a compact JSON body
+    Decimal values are serialized as int/float
+    """
+    response_headers = cors_headers(methods)
+    if headers:
+        response_headers.update(headers)
+
+    response = {
+        'statusCode': status_code,
+        'headers': response_headers,
+        'body': json.dumps(body, default=_json_default, separators=(',', ':'))
+    }
+    if multi_value_headers:
+        response['multiValueHeaders'] = multi_value_headers
+    return response
@@ -1,125 +1,272 @@
+import base64
+import binascii
 import json
-import boto3
 import os
-from boto3.dynamodb.conditions import Key
-from decimal import Decimal
+from datetime import datetime, timezone
 
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
+from common import from_item, json_response, lazy_client, to_item
+from url_signer import URL_MODE, SigningCache, cloudfront_url, cookie_headers, presign_with, signed_cookies
+
+# Client chỉ được tạo khi dùng lần đầu, DynamoDB dùng client cấp thấp (không qua resource)
+dynamodb_client = lazy_client('dynamodb')
+s3 = lazy_client('s3')
 table_name = os.environ.get('DYNAMODB_TABLE_NAME', 'ImageHistory')
 bucket_name = os.environ.get('S3_BUCKET_NAME')
-table = dynamodb.Table(table_name)
+# Cache URL đã ký, giữ lại giữa các lần gọi khi container còn warm
+signing_cache = SigningCache(presign_with(s3))
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = int(os.environ.get('MAX_LIMIT', '100'))  # Giới hạn số item mỗi trang
+# Các thuộc tính được phép chọn qua ?fields=; userId và timestamp luôn được trả về
+# vì chúng là khóa của bảng và cần để tạo nextToken
+PROJECTABLE_FIELDS = ('originalKey', 'processedKey', 'metadata', 'placeholder', 'cloudfront-url', 'ttl')
+KEY_FIELDS = ('userId', 'timestamp')
+ALLOWED_ORIGIN = os.environ.get('ALLOWED_ORIGIN')  # Origin của frontend, cần cho URL_MODE=cookie
+
+ALLOWED_METHODS = 'GET,OPTIONS'
+
+
+def object_url(key):
+    """
+    URL để client tải object: CloudFront ở mode cloudfront/cookie,
+    presigned URL (đã memoize) ở mode presigned
+    """
+    if URL_MODE in ('cloudfront', 'cookie'):
+        return cloudfront_url(key)
+    if not bucket_name:
+        return None
+    return signing_cache.get(bucket_name, key)
+
+
+def build_srcset(item):
+    """
+    Tạo srcset ("url 400w, url 800w") từ các rendition có chiều rộng đã lưu
+    Chỉ dùng các rendition cùng định dạng với ảnh chính để trình duyệt chọn theo kích thước
+    Trả về None nếu chưa đủ thông tin (ảnh cũ hoặc fields không có metadata/processedKey)
+    """
+    metadata = item.get('metadata') or {}
+    processed_key = item.get('processedKey')
+    if not processed_key:
+        return None
+    output_format = processed_key.rsplit('.', 1)[-1]
+    
+    sources = {}
+    if metadata.get('outputWidth'):
+        sources[int(metadata['outputWidth'])] = processed_key
+    for rendition in metadata.get('renditions') or []:
+        if rendition.get('width') and rendition.get('format') == output_format and rendition.get('key'):
+            sources.setdefault(int(rendition['width']), rendition['key'])
+    if not sources:
+        return None
+    
+    urls = [(object_url(key), width) for width, key in sorted(sources.items())]
+    if not all(url for url, _ in urls):
+        return None
+    return ', '.join(f"{url} {width}w" for url, width in urls)
+
+
+def encode_token(last_evaluated_key):
+    """
+    Mã hóa LastEvaluatedKey thành nextToken (base64 url-safe, client không cần đọc)
+    """
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token, user_id):
+    """
+    Giải mã nextToken thành ExclusiveStartKey
+    Token phải thuộc về chính userId đang query
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise ValueError('nextToken is invalid')
+    
+    if not isinstance(key, dict) or set(key) != set(KEY_FIELDS) or not all(isinstance(v, str) for v in key.values()):
+        raise ValueError('nextToken is invalid')
+    if key['userId'] != user_id:
+        raise ValueError('nextToken does not belong to this userId')
+    return key
 
-class DecimalEncoder(json.JSONEncoder):
-    """Convert Decimal to int/float"""
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return int(obj) if obj % 1 == 0 else float(obj)
-        return super(DecimalEncoder, self).default(obj)
+
+def parse_timestamp(value, name, end_of_day=False):
+    """
+    Chuẩn hóa thời gian ISO 8601 về dạng timestamp được lưu (UTC, không có múi giờ)
+    Với end_of_day, giá trị chỉ có ngày (YYYY-MM-DD) được tính đến hết ngày đó
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an ISO 8601 timestamp')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_of_day and len(value) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return parsed.isoformat()
+
+
+def parse_fields(value):
+    """
+    Parse ?fields=a,b thành ProjectionExpression và ExpressionAttributeNames
+    Trả về None nếu không chọn field (lấy toàn bộ item)
+    """
+    if not value:
+        return None
+    
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in PROJECTABLE_FIELDS + KEY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(PROJECTABLE_FIELDS)}")
+    
+    selected = list(KEY_FIELDS) + [field for field in PROJECTABLE_FIELDS if field in fields]
+    # Dùng placeholder cho mọi tên vì timestamp/ttl là reserved word và cloudfront-url có dấu '-'
+    names = {f'#f{index}': field for index, field in enumerate(selected)}
+    return {
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names
+    }
+
+
+def build_query(user_id, params):
+    """
+    Tạo tham số cho dynamodb_client.query từ query string
+    Hỗ trợ limit, nextToken, fields, from và to (lọc theo sort key timestamp)
+    """
+    try:
+        limit = int(params.get('limit', DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    
+    key_condition = '#pk = :userId'
+    names = {'#pk': 'userId'}
+    values = {':userId': {'S': user_id}}
+    
+    start = parse_timestamp(params['from'], 'from') if params.get('from') else None
+    end = parse_timestamp(params['to'], 'to', end_of_day=True) if params.get('to') else None
+    if start and end and start > end:
+        raise ValueError('from must not be after to')
+    if start or end:
+        names['#sk'] = 'timestamp'
+    if start and end:
+        key_condition += ' AND #sk BETWEEN :from AND :to'
+    elif start:
+        key_condition += ' AND #sk >= :from'
+    elif end:
+        key_condition += ' AND #sk <= :to'
+    if start:
+        values[':from'] = {'S': start}
+    if end:
+        values[':to'] = {'S': end}
+    
+    query = {
+        'TableName': table_name,
+        'KeyConditionExpression': key_condition,
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+        'ScanIndexForward': False,  # Sắp xếp giảm dần theo timestamp (mới nhất trước)
+        'Limit': min(limit, MAX_LIMIT)
+    }
+    
+    if params.get('nextToken'):
+        query['ExclusiveStartKey'] = to_item(decode_token(params['nextToken'], user_id))
+    
+    projection = parse_fields(params.get('fields'))
+    if projection:
+        query['ProjectionExpression'] = projection['ProjectionExpression']
+        names.update(projection['ExpressionAttributeNames'])
+    
+    return query
 
 def lambda_handler(event, context):
     """
     Lambda để lấy lịch sử ảnh của user
-    Query: ?userId=xxx&limit=50
+    Query: ?userId=xxx&limit=50&nextToken=...&fields=processedKey,metadata&from=...&to=...
+    Item có placeholder (ảnh xem trước dạng data URI) và srcset khi image_processor đã lưu
     """
     try:
         # Lấy userId từ query parameters
         user_id = None
-        limit = 50
+        params = {}
         
         if event.get('queryStringParameters'):
-            user_id = event['queryStringParameters'].get('userId')
-            limit = int(event['queryStringParameters'].get('limit', 50))
+            params = event['queryStringParameters']
+            user_id = params.get('userId')
         elif event.get('userId'):
             user_id = event['userId']
+            params = event
             
         if not user_id:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'GET,OPTIONS'
-                },
-                'body': json.dumps({
-                    'error': 'userId is required'
-                })
-            }
+            return json_response(400, {
+                'error': 'userId is required'
+            }, ALLOWED_METHODS)
         
-        print(f"Fetching history for user: {user_id}, limit: {limit}")
+        try:
+            query = build_query(user_id, params)
+        except ValueError as e:
+            return json_response(400, {
+                'error': str(e)
+            }, ALLOWED_METHODS)
+        
+        print(f"Fetching history for user: {user_id}, limit: {query['Limit']}")
         
         # Query DynamoDB
-        response = table.query(
-            KeyConditionExpression=Key('userId').eq(user_id),
-            ScanIndexForward=False,  # Sắp xếp giảm dần theo timestamp (mới nhất trước)
-            Limit=limit
-        )
+        response = dynamodb_client.query(**query)
         
-        items = response.get('Items', [])
-        print(f"Found {len(items)} items")
+        items = [from_item(item) for item in response.get('Items', [])]
+        last_key = response.get('LastEvaluatedKey')
+        next_token = encode_token(from_item(last_key) if last_key else None)
+        print(f"Found {len(items)} items, more: {next_token is not None}")
         
-        # Generate presigned URLs
+        # Generate URLs (mỗi key chỉ được ký một lần mỗi window)
         for item in items:
-            # Presigned URL cho processed image
-            if item.get('processedKey') and bucket_name:
+            for key_field, url_field in (('processedKey', 'processedUrl'), ('originalKey', 'originalUrl')):
+                if not item.get(key_field):
+                    continue
                 try:
-                    item['processedUrl'] = s3.generate_presigned_url(
-                        'get_object',
-                        Params={
-                            'Bucket': bucket_name,
-                            'Key': item['processedKey']
-                        },
-                        ExpiresIn=3600  # 1 giờ
-                    )
+                    item[url_field] = object_url(item[key_field])
                 except Exception as e:
-                    print(f"Error generating presigned URL for {item['processedKey']}: {str(e)}")
-                    item['processedUrl'] = None
-            
-            # Presigned URL cho original image (optional)
-            if item.get('originalKey') and bucket_name and item['originalKey']:
-                try:
-                    item['originalUrl'] = s3.generate_presigned_url(
-                        'get_object',
-                        Params={
-                            'Bucket': bucket_name,
-                            'Key': item['originalKey']
-                        },
-                        ExpiresIn=3600
-                    )
-                except Exception as e:
-                    print(f"Error generating presigned URL for original: {str(e)}")
-                    item['originalUrl'] = None
+                    print(f"Error generating URL for {item[key_field]}: {str(e)}")
+                    item[url_field] = None
+            # srcset cho ImageHistory: trình duyệt chỉ tải kích thước cần hiển thị
+            try:
+                srcset = build_srcset(item)
+            except Exception as e:
+                print(f"Error building srcset for {item.get('processedKey')}: {str(e)}")
+                srcset = None
+            if srcset:
+                item['srcset'] = srcset
+        
+        print(f"Signing cache: {signing_cache.hits} hits, {signing_cache.misses} misses")
+        
+        headers = {}
+        multi_value_headers = {}
+        if URL_MODE == 'cookie':
+            # Một bộ cookie cho cả distribution thay vì ký từng URL
+            cookies, expires = signed_cookies()
+            multi_value_headers['Set-Cookie'] = cookie_headers(cookies, expires)
+            # Trình duyệt không gửi credentials khi Allow-Origin là '*'
+            if ALLOWED_ORIGIN:
+                headers['Access-Control-Allow-Origin'] = ALLOWED_ORIGIN
+                headers['Access-Control-Allow-Credentials'] = 'true'
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'GET,OPTIONS'
-            },
-            'body': json.dumps({
-                'count': len(items),
-                'items': items,
-                'userId': user_id
-            }, cls=DecimalEncoder)
-        }
+        return json_response(200, {
+            'count': len(items),
+            'items': items,
+            'userId': user_id,
+            'nextToken': next_token
+        }, ALLOWED_METHODS, headers=headers, multi_value_headers=multi_value_headers)
         
     except Exception as e:
         print(f"Error fetching image history: {str(e)}")
         import traceback
         traceback.print_exc()
         
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'GET,OPTIONS'
-            },
-            'body': json.dumps({
-                'error': f'Failed to fetch image history: {str(e)}'
-            })
-        }
+        return json_response(500, {
+            'error': f'Failed to fetch image history: {str(e)}'
+        }, ALLOWED_METHODS)
@@ -0,0 +1,146 @@
+"""
+URL generation for image history items
+Presigned S3 URLs are memoized per (bucket, key, expiry window) across warm
+invocations, so a URL is signed once per window instead of once per request
+
+URL_MODE selects what the history API returns for each object:
+'presigned' (default, S3 SigV4 URLs), 'cloudfront' (plain CloudFront URLs)
+or 'cookie' (CloudFront URLs plus one set of CloudFront signed cookies)
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import quote
+
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:  # only needed for URL_MODE=cookie
+    serialization = None
+
+URL_MODE = os.environ.get('URL_MODE', 'presigned').lower()
+URL_EXPIRATION = int(os.environ.get('URL_EXPIRATION', '3600'))  # Thời gian tối thiểu URL còn hiệu lực (giây)
+SIGNING_WINDOW = int(os.environ.get('SIGNING_WINDOW', '300'))  # URL được ký lại sau mỗi window (giây)
+SIGNING_CACHE_SIZE = int(os.environ.get('SIGNING_CACHE_SIZE', '4096'))
+CLOUDFRONT_URL = os.environ.get('CLOUDFRONT_URL', '').rstrip('/')
+CLOUDFRONT_KEY_PAIR_ID = os.environ.get('CLOUDFRONT_KEY_PAIR_ID')
+CLOUDFRONT_PRIVATE_KEY = os.environ.get('CLOUDFRONT_PRIVATE_KEY')  # PEM
+COOKIE_DOMAIN = os.environ.get('COOKIE_DOMAIN')
+
+
+class SigningCache:
+    """
+    LRU of signed URLs keyed by (bucket, key, window)
+    A URL signed during window w is valid for URL_EXPIRATION + SIGNING_WINDOW
+    seconds, so whenever it is handed out it still has at least URL_EXPIRATION left
+    """
+
+    def __init__(self, sign, expiration=URL_EXPIRATION, window=SIGNING_WINDOW, max_entries=SIGNING_CACHE_SIZE):
+        self.sign = sign
+        self.expiration = expiration
+        self.window = window
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bucket, key, now=None):
+        window = int((time.time() if now is None else now) // self.window)
+        cache_key = (bucket, key, window)
+
+        with self._lock:
+            url = self._entries.get(cache_key)
+            if url is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return url
+
+        url = self.sign(bucket, key, self.expiration + self.window)
+
+        with self._lock:
+            self.misses += 1
+            self._entries[cache_key] = url
+            # Entry của window cũ sẽ bị đẩy ra dần theo LRU
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return url
+
+
+def presign_with(s3_client):
+    """
+    Signing function for SigningCache backed by an S3 client
+    """
+    def sign(bucket, key, expires_in):
+        return s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': bucket, 'Key': key},
+            ExpiresIn=expires_in
+        )
+    return sign
+
+
+def cloudfront_url(key):
+    return f"{CLOUDFRONT_URL}/{quote(key)}"
+
+
+def _cloudfront_b64(data):
+    # Base64 biến thể của CloudFront: + -> -, = -> _, / -> ~
+    return base64.b64encode(data).decode('ascii').replace('+', '-').replace('=', '_').replace('/', '~')
+
+
+_private_key = None
+
+
+def signed_cookies(resource=None, now=None):
+    """
+    CloudFront signed cookies (custom policy) covering every object under resource
+    Expiry is aligned to SIGNING_WINDOW like presigned URLs, and the cookies are
+    signed once per window
+    Returns (cookies, expires_epoch)
+    """
+    now = time.time() if now is None else now
+    return _signed_cookies_for_window(resource or f"{CLOUDFRONT_URL}/*", int(now // SIGNING_WINDOW))
+
+
+@lru_cache(maxsize=8)
+def _signed_cookies_for_window(resource, window):
+    global _private_key
+
+    if serialization is None:
+        raise RuntimeError('URL_MODE=cookie requires the cryptography package')
+    if not (CLOUDFRONT_URL and CLOUDFRONT_KEY_PAIR_ID and CLOUDFRONT_PRIVATE_KEY):
+        raise RuntimeError('URL_MODE=cookie requires CLOUDFRONT_URL, CLOUDFRONT_KEY_PAIR_ID and CLOUDFRONT_PRIVATE_KEY')
+
+    if _private_key is None:
+        _private_key = serialization.load_pem_private_key(CLOUDFRONT_PRIVATE_KEY.encode('utf-8'), password=None)
+
+    expires = (window + 1) * SIGNING_WINDOW + URL_EXPIRATION
+    policy = json.dumps({
+        'Statement': [{
+            'Resource': resource,
+            'Condition': {'DateLessThan': {'AWS:EpochTime': expires}}
+        }]
+    }, separators=(',', ':')).encode('utf-8')
+    signature = _private_key.sign(policy, padding.PKCS1v15(), hashes.SHA1())
+
+    return {
+        'CloudFront-Policy': _cloudfront_b64(policy),
+        'CloudFront-Signature': _cloudfront_b64(signature),
+        'CloudFront-Key-Pair-Id': CLOUDFRONT_KEY_PAIR_ID
+    }, expires
+
+
+def cookie_headers(cookies, expires):
+    """
+    Set-Cookie values for API Gateway multiValueHeaders
+    """
+    attributes = f"; Expires={time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(expires))}; Path=/; Secure; HttpOnly; SameSite=None"
+    if COOKIE_DOMAIN:
+        attributes += f"; Domain={COOKIE_DOMAIN}"
+    return [f"{name}={value}{attributes}" for name, value in cookies.items()]
@@ -2,47 +2,95 @@
 Lambda Function: Get Presigned URL
 Trigger: API Gateway (HTTP POST)
 Purpose: Generate presigned URL for secure S3 upload from frontend
+A batch of files can be signed in one request; files above MULTIPART_THRESHOLD
+get presigned part URLs for a parallel multipart upload, finished with a
+{"action": "complete"} request
 """
 
-import boto3
 import json
+import math
 import os
 import time
-from urllib.parse import quote_plus
+import uuid
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+from common import cors_headers, json_response, lazy_client, manifest
 
 # Environment variables
 SOURCE_BUCKET = os.environ.get('SOURCE_BUCKET', 'imagehub-source-images')
 URL_EXPIRATION = int(os.environ.get('URL_EXPIRATION', '300'))  # 5 minutes
 MAX_FILE_SIZE = int(os.environ.get('MAX_FILE_SIZE', '10485760'))  # 10MB
+# When enabled the upload carries the user id so image_processor records history itself
+SERVER_SIDE_HISTORY = os.environ.get('SERVER_SIDE_HISTORY', 'false').lower() == 'true'
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', '200'))  # Files signed per batch request
+# Files of at least this size (bytes, sent as 'size') are uploaded in parts
+MULTIPART_THRESHOLD = int(os.environ.get('MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))  # 8MB
+MULTIPART_PART_SIZE = int(os.environ.get('MULTIPART_PART_SIZE', str(5 * 1024 * 1024)))  # 5MB, the S3 minimum
+SIGNING_WORKERS = int(os.environ.get('SIGNING_WORKERS', '8'))  # Batch files signed concurrently
+MAX_PARTS = 10000  # S3 limit per multipart upload
+
+ALLOWED_METHODS = 'POST,OPTIONS'
+
+s3_client = lazy_client('s3')
+
+
+def sanitize_filename(filename):
+    return filename.replace(' ', '_')
 
-s3_client = boto3.client('s3')
+
+def get_output_name(filename):
+    """
+    Base name of the processed objects: the sanitized filename without extension
+    """
+    return sanitize_filename(filename).rsplit('.', 1)[0]
 
 
-def generate_object_key(filename, width, height, quality, output_format, watermark):
+def generate_object_key(filename):
     """
-    Generate S3 object key with metadata embedded
-    Format: uploads/{timestamp}_{width}x{height}_{quality}_{format}_{watermark}_{filename}
+    Generate the S3 object key for an upload
+    Format: uploads/{timestamp}_{token}_{filename}
+    Processing options travel in the manifest (see manifest_metadata), not in the key
     """
     timestamp = int(time.time())
-    watermark_encoded = quote_plus(watermark) if watermark else 'none'
+    token = uuid.uuid4().hex[:8]  # Keeps same-second uploads of one filename apart
     
-    # Sanitize filename
-    safe_filename = filename.replace(' ', '_') 
-    
-    key = f"uploads/{timestamp}_{width}x{height}_{quality}_{output_format}_{watermark_encoded}_{safe_filename}"
+    return f"uploads/{timestamp}_{token}_{sanitize_filename(filename)}"
+
+
+def manifest_metadata(object_key, job_manifest):
+    """
+    S3 user metadata carrying the manifest for object_key
+    Manifests above MAX_METADATA_SIZE are written to a sidecar object and the
+    metadata only points to it
+    """
+    encoded = manifest.dumps(job_manifest)
+    if len(encoded) <= manifest.MAX_METADATA_SIZE:
+        return {manifest.METADATA_KEY: encoded}
     
-    return key
+    sidecar_key = manifest.sidecar_key(object_key)
+    s3_client.put_object(
+        Bucket=SOURCE_BUCKET,
+        Key=sidecar_key,
+        Body=encoded.encode('utf-8'),
+        ContentType='application/json'
+    )
+    return {manifest.SIDECAR_METADATA_KEY: sidecar_key}
 
 
-def validate_request(body):
+def validate_request(body, prefix=''):
     """
     Validate request parameters
+    prefix is prepended to the messages (files[i]. for batch requests)
     """
     errors = []
     
     # Required fields
-    if not body.get('filename'):
+    filename = body.get('filename')
+    if not filename:
         errors.append('filename is required')
+    elif not isinstance(filename, str):
+        errors.append('filename must be a string')
     
     if not body.get('contentType'):
         errors.append('contentType is required')
@@ -52,33 +100,210 @@ def validate_request(body):
     if body.get('contentType') not in allowed_types:
         errors.append(f'contentType must be one of: {", ".join(allowed_types)}')
     
-    # Validate dimensions
-    width = body.get('width', 800)
-    height = body.get('height', 600)
+    # Validate file size (optional, decides between a single PUT and a multipart upload)
+    size = body.get('size')
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or not 0 < size <= MAX_FILE_SIZE):
+        errors.append(f'size must be between 1 and {MAX_FILE_SIZE} bytes')
+    
+    # Validate processing options (same rules image_processor applies to the manifest)
+    # (a missing filename is reported above, its output name is not checked)
+    output_name = get_output_name(filename) if filename and isinstance(filename, str) else 'upload'
+    errors.extend(manifest.validate(manifest.build(body, output_name)))
+    
+    # Validate user id (sent as S3 object metadata, which must be ASCII)
+    user_id = body.get('userId')
+    if user_id is not None and (not isinstance(user_id, str) or not 0 < len(user_id) <= 128 or not user_id.isascii()):
+        errors.append('userId must be an ASCII string of at most 128 characters')
+    
+    return [f'{prefix}{error}' for error in errors]
+
+
+def batch_files(body):
+    """
+    Requests of a batch: fields outside 'files' are defaults for every file
+    """
+    defaults = {name: value for name, value in body.items() if name != 'files'}
+    return [dict(defaults, **entry) if isinstance(entry, dict) else entry for entry in body['files']]
+
+
+def validate_batch(files):
+    """
+    Validate every file of a batch request
+    """
+    if not isinstance(files, list) or not 0 < len(files) <= MAX_BATCH_FILES:
+        return [f'files must be a list of 1 to {MAX_BATCH_FILES} files']
+    
+    errors = []
+    for index, entry in enumerate(files):
+        if not isinstance(entry, dict):
+            errors.append(f'files[{index}] must be an object')
+            continue
+        errors.extend(validate_request(entry, prefix=f'files[{index}].'))
+    return errors
+
+
+def create_multipart(params, size):
+    """
+    Start a multipart upload for params (Bucket, Key, ContentType, Metadata) and
+    presign one URL per MULTIPART_PART_SIZE part; the client PUTs the parts in
+    parallel and completes the upload with their ETags
+    """
+    part_size = max(MULTIPART_PART_SIZE, math.ceil(size / MAX_PARTS))
+    upload_id = s3_client.create_multipart_upload(**params)['UploadId']
+    
+    parts = []
+    for part_number in range(1, math.ceil(size / part_size) + 1):
+        url = s3_client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': params['Bucket'], 'Key': params['Key'], 'UploadId': upload_id, 'PartNumber': part_number},
+            ExpiresIn=URL_EXPIRATION,
+            HttpMethod='PUT'
+        )
+        parts.append({'partNumber': part_number, 'url': url})
+    
+    return {'uploadId': upload_id, 'partSize': part_size, 'parts': parts}
+
+
+def sign_upload(body):
+    """
+    Create the upload of one validated request: a presigned PUT URL with the
+    headers to send, or a multipart upload when size reaches MULTIPART_THRESHOLD
+    Returns the response body for the file
+    """
+    # Extract parameters
+    filename = body['filename']
+    content_type = body['contentType']
+    user_id = body.get('userId')
+    size = body.get('size')
+    
+    # Generate S3 object key
+    object_key = generate_object_key(filename)
+    
+    print(f"Generated object key: {object_key}")
+    
+    # Processing manifest, sent as object metadata or as a sidecar when too large
+    output_name = get_output_name(filename)
+    job_manifest = manifest.build(body, output_name)
+    object_metadata = manifest_metadata(object_key, job_manifest)
+    output_format = job_manifest['format']
     
-    if not isinstance(width, int) or width < 1 or width > 4000:
-        errors.append('width must be between 1 and 4000')
+    # Headers the client must send with the PUT (they are part of the signature)
+    params = {
+        'Bucket': SOURCE_BUCKET,
+        'Key': object_key,
+        'ContentType': content_type,
+    }
+    upload_headers = {'Content-Type': content_type}
+    
+    history_recorded = SERVER_SIDE_HISTORY and bool(user_id)
+    if history_recorded:
+        object_metadata['user-id'] = user_id
+    
+    params['Metadata'] = object_metadata
+    
+    upload = {
+        'key': object_key,
+        # Unknown until processing when the format is 'auto'
+        'processedKey': f"processed/{output_name}.{output_format}" if output_format != 'auto' else None,
+        'expiresIn': URL_EXPIRATION,
+        'historyRecorded': history_recorded
+    }
+    
+    if size is not None and size >= MULTIPART_THRESHOLD:
+        # Content type and metadata are set when the upload is created, parts carry no headers
+        upload['uploadUrl'] = None
+        upload['uploadHeaders'] = {}
+        upload['multipart'] = create_multipart(params, size)
+        return upload
+    
+    for name, value in object_metadata.items():
+        upload_headers[f'x-amz-meta-{name}'] = value
+    
+    # Generate presigned URL
+    upload['uploadUrl'] = s3_client.generate_presigned_url(
+        'put_object',
+        Params=params,
+        ExpiresIn=URL_EXPIRATION,
+        HttpMethod='PUT'
+    )
+    upload['uploadHeaders'] = upload_headers
+    
+    #  print(f"Generated presigned URL for: {object_key}")
+    
+    return upload
+
+
+def validate_completion(body):
+    """
+    Validate a multipart completion request: key, uploadId and parts
+    ([{"partNumber": 1, "etag": "..."}], the ETag headers of the part uploads)
+    """
+    errors = []
     
-    if not isinstance(height, int) or height < 1 or height > 4000:
-        errors.append('height must be between 1 and 4000')
+    key = body.get('key')
+    if not isinstance(key, str) or not key.startswith('uploads/'):
+        errors.append('key must be an upload key (uploads/...)')
     
-    # Validate quality
-    quality = body.get('quality', 85)
-    if not isinstance(quality, int) or quality < 1 or quality > 100:
-        errors.append('quality must be between 1 and 100')
+    if not isinstance(body.get('uploadId'), str) or not body.get('uploadId'):
+        errors.append('uploadId is required')
     
-    # Validate format
-    allowed_formats = ['jpeg', 'png', 'webp']
-    output_format = body.get('format', 'jpeg')
-    if output_format not in allowed_formats:
-        errors.append(f'format must be one of: {", ".join(allowed_formats)}')
+    parts = body.get('parts')
+    if not isinstance(parts, list) or not 0 < len(parts) <= MAX_PARTS:
+        errors.append(f'parts must be a list of 1 to {MAX_PARTS} parts')
+    else:
+        for index, part in enumerate(parts):
+            number = part.get('partNumber') if isinstance(part, dict) else None
+            if not isinstance(number, int) or isinstance(number, bool) or not 0 < number <= MAX_PARTS:
+                errors.append(f'parts[{index}].partNumber must be between 1 and {MAX_PARTS}')
+            if not isinstance(part, dict) or not isinstance(part.get('etag'), str) or not part.get('etag'):
+                errors.append(f'parts[{index}].etag is required')
     
     return errors
 
 
+def complete_upload(body):
+    """
+    Complete a multipart upload; the object (and its processing) appears only now
+    """
+    errors = validate_completion(body)
+    if errors:
+        return json_response(400, {
+            'message': 'Validation failed',
+            'errors': errors
+        }, ALLOWED_METHODS)
+    
+    parts = sorted(body['parts'], key=lambda part: part['partNumber'])
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=SOURCE_BUCKET,
+            Key=body['key'],
+            UploadId=body['uploadId'],
+            MultipartUpload={'Parts': [{'PartNumber': part['partNumber'], 'ETag': part['etag']} for part in parts]}
+        )
+    except ClientError as e:
+        # Unknown upload id, missing or mismatched parts: the client has to fix the request
+        code = e.response.get('Error', {}).get('Code')
+        if code in ('NoSuchUpload', 'InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'):
+            return json_response(400, {
+                'message': 'Upload could not be completed',
+                'errors': [f'{code}: {e.response["Error"].get("Message", "")}']
+            }, ALLOWED_METHODS)
+        raise
+    
+    print(f"Completed multipart upload: {body['key']} ({len(parts)} parts)")
+    
+    return json_response(200, {
+        'key': body['key'],
+        'completed': True
+    }, ALLOWED_METHODS)
+
+
 def handler(event, context):
     """
     Main Lambda handler function
+    Body: one file ({filename, contentType, size, ...options}), a batch
+    ({files: [...], ...options shared by the files}) or a multipart completion
+    ({action: "complete", key, uploadId, parts})
     """
     try:
         # Parse request body
@@ -86,96 +311,50 @@ def handler(event, context):
         
         print(f"Request body: {body}")
         
-        # Validate request
-        errors = validate_request(body)
-        if errors:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
-                },
-                'body': json.dumps({
-                    'message': 'Validation failed',
-                    'errors': errors
-                })
-            }
+        if body.get('action') == 'complete':
+            return complete_upload(body)
         
-        # Extract parameters
-        filename = body['filename']
-        content_type = body['contentType']
-        width = body.get('width', 800)
-        height = body.get('height', 600)
-        quality = body.get('quality', 85)
-        output_format = body.get('format', 'jpeg')
-        watermark = body.get('watermark', '')
+        if 'files' in body:
+            files = batch_files(body) if isinstance(body['files'], list) else body['files']
+            errors = validate_batch(files)
+        else:
+            files = None
+            errors = validate_request(body)
         
-        # Generate S3 object key with metadata
-        object_key = generate_object_key(
-            filename, width, height, quality, output_format, watermark
-        )
-        
-        print(f"Generated object key: {object_key}")
+        # Validate request
+        if errors:
+            return json_response(400, {
+                'message': 'Validation failed',
+                'errors': errors
+            }, ALLOWED_METHODS)
         
-        # Generate presigned URL
-        presigned_url = s3_client.generate_presigned_url(
-            'put_object',
-            Params={
-                'Bucket': SOURCE_BUCKET,
-                'Key': object_key,
-                'ContentType': content_type,
-            },
-            ExpiresIn=URL_EXPIRATION,
-            HttpMethod='PUT'
-        )
+        if files is None:
+            return json_response(200, sign_upload(body), ALLOWED_METHODS)
         
-        #  print(f"Generated presigned URL for: {object_key}")
+        # Files needing a sidecar or a multipart upload make S3 calls, sign them concurrently
+        with ThreadPoolExecutor(max_workers=SIGNING_WORKERS) as executor:
+            uploads = list(executor.map(sign_upload, files))
+        print(f"Signed {len(uploads)} uploads, {sum(1 for upload in uploads if 'multipart' in upload)} multipart")
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS'
-            },
-            'body': json.dumps({
-                'uploadUrl': presigned_url,
-                'key': object_key,
-                'expiresIn': URL_EXPIRATION
-            })
-        }
+        return json_response(200, {
+            'uploads': uploads,
+            'expiresIn': URL_EXPIRATION
+        }, ALLOWED_METHODS)
         
     except json.JSONDecodeError:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Invalid JSON in request body'
-            })
-        }
+        return json_response(400, {
+            'message': 'Invalid JSON in request body'
+        }, ALLOWED_METHODS)
         
     except Exception as e:
         print(f"Error generating presigned URL: {str(e)}")
         import traceback
         traceback.print_exc()
         
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Error generating upload URL',
-                'error': str(e)
-            })
-        }
+        return json_response(500, {
+            'message': 'Error generating upload URL',
+            'error': str(e)
+        }, ALLOWED_METHODS)
 
 
 def options_handler(event, context):
@@ -184,10 +363,6 @@ def options_handler(event, context):
     """
     return {
         'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS'
-        },
+        'headers': cors_headers(ALLOWED_METHODS, content_type=None),
         'body': ''
     }
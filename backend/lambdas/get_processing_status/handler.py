@@ -0,0 +1,125 @@
+"""
+Lambda Function: Get Processing Status
+Trigger: API Gateway (HTTP GET)
+Purpose: Long-poll the completion record image_processor writes for an upload,
+so clients learn about the result (or the failure) as soon as it exists
+"""
+
+import math
+import os
+import time
+
+from common import from_item, json_response, lazy_client
+
+# Environment variables
+STATUS_TABLE = os.environ.get('STATUS_TABLE', 'imagehub-job-status')
+# API Gateway times out after 29 seconds; stay well below it
+MAX_WAIT_SECONDS = float(os.environ.get('MAX_WAIT_SECONDS', '20'))
+POLL_INTERVAL = float(os.environ.get('POLL_INTERVAL', '0.1'))  # First re-read delay, doubles up to POLL_INTERVAL_MAX
+POLL_INTERVAL_MAX = float(os.environ.get('POLL_INTERVAL_MAX', '1.0'))
+# Time kept in reserve to build the response before the Lambda deadline
+RESPONSE_RESERVE_MS = 1000
+MAX_KEY_LENGTH = 1024  # S3 key limit
+
+ALLOWED_METHODS = 'GET,OPTIONS'
+
+dynamodb_client = lazy_client('dynamodb')
+
+
+def parse_request(params):
+    """
+    Validate query parameters: key (the upload key returned by get_presigned_url)
+    and wait (seconds to hold the request open, default MAX_WAIT_SECONDS)
+    Returns (key, wait)
+    """
+    key = params.get('key')
+    if not key or not key.startswith('uploads/') or len(key) > MAX_KEY_LENGTH:
+        raise ValueError('key must be an upload key (uploads/...)')
+
+    try:
+        wait = float(params.get('wait', MAX_WAIT_SECONDS))
+    except (TypeError, ValueError):
+        raise ValueError('wait must be a number of seconds')
+    # nan would pass the comparison and never reach the deadline
+    if not math.isfinite(wait) or wait < 0:
+        raise ValueError('wait must be a non-negative number of seconds')
+
+    return key, min(wait, MAX_WAIT_SECONDS)
+
+
+def get_status(key):
+    """
+    Completion record of key, or None while the upload is still being processed
+    Strongly consistent so a record written just before is always seen
+    """
+    response = dynamodb_client.get_item(
+        TableName=STATUS_TABLE,
+        Key={'uploadKey': {'S': key}},
+        ConsistentRead=True
+    )
+    item = response.get('Item')
+    return from_item(item) if item else None
+
+
+def wait_for_status(key, wait, context=None):
+    """
+    Re-read the record with exponential backoff until it exists or wait seconds
+    (bounded by the Lambda's remaining time) have passed
+    Returns the record, or None on timeout
+    """
+    deadline = time.monotonic() + wait
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        remaining = (context.get_remaining_time_in_millis() - RESPONSE_RESERVE_MS) / 1000
+        deadline = min(deadline, time.monotonic() + max(remaining, 0))
+
+    interval = POLL_INTERVAL
+    while True:
+        record = get_status(key)
+        if record is not None:
+            return record
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, POLL_INTERVAL_MAX)
+
+
+def handler(event, context):
+    """
+    Main Lambda handler function
+    Query: ?key=uploads/...&wait=20
+    200 with the record ('status' is 'done' or 'failed'), 202 when still pending
+    """
+    try:
+        params = event.get('queryStringParameters') or {}
+
+        try:
+            key, wait = parse_request(params)
+        except ValueError as e:
+            return json_response(400, {
+                'message': 'Validation failed',
+                'errors': [str(e)]
+            }, ALLOWED_METHODS)
+
+        record = wait_for_status(key, wait, context)
+
+        if record is None:
+            return json_response(202, {
+                'key': key,
+                'status': 'pending'
+            }, ALLOWED_METHODS)
+
+        record.pop('ttl', None)
+        print(f"Status for {key}: {record['status']}")
+        return json_response(200, record, ALLOWED_METHODS)
+
+    except Exception as e:
+        print(f"Error getting processing status: {str(e)}")
+        import traceback
+        traceback.print_exc()
+
+        return json_response(500, {
+            'message': 'Error getting processing status',
+            'error': str(e)
+        }, ALLOWED_METHODS)
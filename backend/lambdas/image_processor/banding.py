@@ -0,0 +1,254 @@
+"""
+Bounded-memory decoding for the Image Processor
+A source whose decoded pixels would not fit in MAX_DECODE_BYTES is not decoded in
+one piece: non-interlaced 8-bit PNGs are inflated a band of rows at a time and each
+band is box-reduced into the output, so memory stays around the reduced image plus
+one band. Sources that can't be decoded that way fail with ImageTooLargeError
+instead of running the Lambda out of memory
+"""
+
+import math
+import os
+import struct
+import threading
+import zlib
+from io import BytesIO
+from PIL import Image
+
+import color
+
+# Largest decoded image held in memory at once (512MB Lambda, MAX_WORKERS images in flight)
+MAX_DECODE_BYTES = int(os.environ.get('MAX_DECODE_BYTES', str(128 * 1024 * 1024)))
+# Sources above this many pixels are rejected outright, however they would be decoded
+MAX_SOURCE_PIXELS = int(os.environ.get('MAX_SOURCE_PIXELS', str(250 * 1000 * 1000)))
+# Decoded size of one band of rows
+BAND_BYTES = int(os.environ.get('BAND_BYTES', str(8 * 1024 * 1024)))
+
+# Image.MAX_IMAGE_PIXELS is process-wide: open_source raises it only while opening a source
+_open_lock = threading.Lock()
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Samples per pixel of each PNG colour type (grey, RGB, palette, grey+alpha, RGBA)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# Chunks a band needs besides the pixel data
+PNG_BAND_CHUNKS = (b'PLTE', b'tRNS')
+
+
+class ImageTooLargeError(ValueError):
+    """The source can't be decoded within the memory limits"""
+
+
+def pixel_size(mode):
+    """
+    Bytes per pixel Pillow uses to store an image of mode (RGB is padded to 4)
+    """
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def decoded_bytes(size, mode):
+    """
+    Memory needed to hold a decoded image of size and mode
+    """
+    return size[0] * size[1] * pixel_size(mode)
+
+
+def check_source(image):
+    """
+    Reject sources above MAX_SOURCE_PIXELS before anything is decoded
+    """
+    pixels = image.size[0] * image.size[1]
+    if pixels > MAX_SOURCE_PIXELS:
+        raise ImageTooLargeError(
+            f"Image is {image.size[0]}x{image.size[1]} ({pixels} pixels), the limit is {MAX_SOURCE_PIXELS} pixels"
+        )
+
+
+def open_source(fp):
+    """
+    Open an upload (header only) with MAX_SOURCE_PIXELS as the size limit
+    Pillow's decompression bomb check would refuse sources the banded path
+    handles, so its limit is lifted for this open only and restored for every
+    other Pillow caller in the process
+    """
+    with _open_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+        try:
+            image = Image.open(fp)
+        except Image.DecompressionBombError as e:
+            # More than twice the limit, refused before check_source could run
+            raise ImageTooLargeError(str(e))
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+    check_source(image)
+    return image
+
+
+def fits_in_memory(size, mode):
+    """
+    Whether an image of size and mode can be decoded at once
+    """
+    return decoded_bytes(size, mode) <= MAX_DECODE_BYTES
+
+
+def _read_chunk(fp):
+    header = fp.read(8)
+    if len(header) < 8:
+        raise ValueError('PNG image is truncated')
+    length, chunk_type = struct.unpack('>I4s', header)
+    data = fp.read(length)
+    if len(data) < length:
+        raise ValueError('PNG image is truncated')
+    fp.read(4)  # CRC, the chunks are re-checksummed when a band is rebuilt
+    return chunk_type, data
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def read_png_header(fp):
+    """
+    Parse the chunks of a PNG up to its first IDAT
+    Returns (ihdr, chunks, idat) where ihdr is a dict of the IHDR fields, chunks
+    the PLTE/tRNS chunks a band needs and idat the payload of the first IDAT chunk
+    """
+    fp.seek(0)
+    if fp.read(8) != PNG_SIGNATURE:
+        raise ValueError('Not a PNG image')
+
+    ihdr = None
+    chunks = []
+    while True:
+        chunk_type, data = _read_chunk(fp)
+        if chunk_type == b'IHDR':
+            width, height, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', data[:13])
+            ihdr = {'width': width, 'height': height, 'depth': depth, 'color_type': color_type, 'interlace': interlace}
+        elif chunk_type in PNG_BAND_CHUNKS:
+            chunks.append((chunk_type, data))
+        elif chunk_type == b'IDAT':
+            break
+        elif chunk_type == b'IEND':
+            raise ValueError('PNG image has no pixel data')
+    if ihdr is None:
+        raise ValueError('PNG image has no header')
+    return ihdr, chunks, data
+
+
+def can_decode_in_bands(image):
+    """
+    Whether image can be decoded band by band: non-interlaced PNG with 8-bit
+    samples, whose unfiltered rows are exactly what Pillow stores
+    """
+    if image.format != 'PNG' or image.info.get('interlace') or getattr(image, 'fp', None) is None:
+        return False
+    position = image.fp.tell()
+    try:
+        ihdr, _, _ = read_png_header(image.fp)
+    except ValueError:
+        return False
+    finally:
+        image.fp.seek(position)
+    return ihdr['depth'] == 8 and ihdr['color_type'] in PNG_CHANNELS
+
+
+def iter_png_bands(fp, band_rows):
+    """
+    Decode a non-interlaced 8-bit PNG band_rows rows at a time
+    The zlib stream is inflated only as far as each band needs; the band's filtered
+    rows, preceded by the previous band's last row (PNG filters reference the row
+    above), are wrapped in a small uncompressed PNG that Pillow unfilters
+    Yields (top, band) with band an Image of up to band_rows rows
+    """
+    ihdr, chunks, data = read_png_header(fp)
+    width, height = ihdr['width'], ihdr['height']
+    row_bytes = 1 + width * PNG_CHANNELS[ihdr['color_type']]  # Filter type byte + samples
+
+    def idat_payloads():
+        yield data
+        while True:
+            chunk_type, payload = _read_chunk(fp)
+            if chunk_type != b'IDAT':
+                return
+            yield payload
+
+    payloads = idat_payloads()
+    inflater = zlib.decompressobj()
+    pending = bytearray()
+    previous = None
+    top = 0
+    while top < height:
+        rows = min(band_rows, height - top)
+        needed = rows * row_bytes
+        while len(pending) < needed:
+            # max_length bounds the output of highly compressed data to one band
+            if inflater.unconsumed_tail:
+                pending += inflater.decompress(inflater.unconsumed_tail, needed - len(pending))
+                continue
+            payload = next(payloads, None)
+            if payload is None:
+                raise ValueError('PNG image data is truncated')
+            pending += inflater.decompress(payload, needed - len(pending))
+        raw = bytes(pending[:needed])
+        del pending[:needed]
+
+        band_height = rows
+        if previous is not None:
+            # Filter type 0 (None): the row is stored as is
+            raw = b'\x00' + previous + raw
+            band_height += 1
+        header = struct.pack('>IIBBBBB', width, band_height, 8, ihdr['color_type'], 0, 0, 0)
+        band_png = PNG_SIGNATURE + _png_chunk(b'IHDR', header)
+        for chunk_type, payload in chunks:
+            band_png += _png_chunk(chunk_type, payload)
+        band_png += _png_chunk(b'IDAT', zlib.compress(raw, 0)) + _png_chunk(b'IEND', b'')
+        del raw
+
+        band = Image.open(BytesIO(band_png))
+        band.load()
+        if previous is not None:
+            band = band.crop((0, 1, width, band_height))
+        previous = band.crop((0, rows - 1, width, rows)).tobytes()
+
+        yield top, band
+        top += rows
+
+
+def load_banded(image, request):
+    """
+    Decode image in bands into a reduced copy at least request sized when memory
+    allows; the integer reduce factor grows until the copy fits MAX_DECODE_BYTES
+    Band heights are multiples of the factor so the result matches image.reduce()
+    Returns the reduced image in a working mode with the source's info (ICC, EXIF)
+    """
+    if not can_decode_in_bands(image):
+        raise ImageTooLargeError(
+            f"Image is {image.size[0]}x{image.size[1]} {image.format} {image.mode}, "
+            f"{decoded_bytes(image.size, image.mode)} bytes decoded (limit {MAX_DECODE_BYTES}) "
+            "and only non-interlaced 8-bit PNGs can be decoded in bands"
+        )
+
+    width, height = image.size
+    working_pixel_size = 1 if image.mode == 'L' else 4
+    quality_factor = min(width // max(request[0], 1), height // max(request[1], 1))
+    memory_factor = math.ceil(math.sqrt(width * height * working_pixel_size / MAX_DECODE_BYTES))
+    factor = max(quality_factor, memory_factor, 1)
+    band_rows = max(factor, BAND_BYTES // (width * working_pixel_size) // factor * factor)
+    print(f"Decoding {width}x{height} {image.format} in bands of {band_rows} rows, reduced by {factor}")
+
+    reduced = None
+    for top, band in iter_png_bands(image.fp, band_rows):
+        band = color.normalize_mode(band)
+        if factor > 1:
+            band = band.reduce(factor)
+        if reduced is None:
+            reduced = Image.new(band.mode, (math.ceil(width / factor), math.ceil(height / factor)))
+        reduced.paste(band, (0, top // factor))
+
+    # Transparency was applied per band by normalize_mode
+    reduced.info.update((key, value) for key, value in image.info.items() if key != 'transparency')
+    return reduced
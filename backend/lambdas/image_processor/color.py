@@ -0,0 +1,136 @@
+"""
+Colour pipeline for the Image Processor
+Decoded images are normalized once to one of RGB, RGBA, L or LA, so resizing,
+watermarking and encoding never see palette, CMYK or 16-bit data, and alpha is
+flattened onto white in a single pass at the output size
+Pixels tagged with a non-sRGB ICC profile (Display P3, Adobe RGB, CMYK) are
+converted to sRGB, so outputs look the same in every format without a profile
+"""
+
+from functools import lru_cache
+from io import BytesIO
+from PIL import Image
+
+try:
+    from PIL import ImageCms
+except ImportError:  # Pillow built without littlecms: profiles are dropped unconverted
+    ImageCms = None
+
+WORKING_MODES = ('RGB', 'RGBA', 'L', 'LA')
+ALPHA_MODES = ('RGBA', 'LA')
+
+# Modes converted straight to RGB (no alpha)
+_RGB_MODES = ('CMYK', 'YCbCr', 'LAB', 'HSV', 'RGBX')
+# Premultiplied modes
+_UNPREMULTIPLIED = {'RGBa': 'RGBA', 'La': 'LA'}
+
+WHITE = 255
+
+# Modes that ICC profiles are converted from, and the sRGB mode they become
+_ICC_MODES = {'RGB': 'RGB', 'RGBA': 'RGBA', 'CMYK': 'RGB'}
+
+
+def normalize_mode(image):
+    """
+    Convert a decoded image to a working mode (RGB, RGBA, L or LA)
+    Palette images keep their transparency as RGBA, 1-bit becomes L and 16/32-bit
+    greyscale is scaled to 8 bits instead of clipped
+    Returns image itself when it is already in a working mode
+    """
+    mode = image.mode
+    if mode in WORKING_MODES:
+        return image
+
+    if mode == 'P':
+        return image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    if mode == 'PA':
+        return image.convert('RGBA')
+    if mode in _UNPREMULTIPLIED:
+        return image.convert(_UNPREMULTIPLIED[mode])
+    if mode == 'I' or mode.startswith('I;16'):
+        # 16-bit samples (PNG, TIFF): keep the top 8 bits
+        if mode != 'I':
+            image = image.convert('I')
+        return image.point(lambda value: value / 256).convert('L')
+    if mode in ('1', 'F'):
+        return image.convert('L')
+    if mode in _RGB_MODES:
+        if mode == 'CMYK' and needs_srgb_conversion(image):
+            # A naive CMYK -> RGB conversion ignores the profile and is far off
+            return to_srgb(image)
+        return image.convert('RGB')
+
+    return image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def flatten(image, mode=None):
+    """
+    Composite image onto white and drop its alpha channel
+    The result is L for greyscale input and RGB otherwise, unless mode is given
+    The alpha channel is used as the paste mask directly, so the only allocation
+    is the output image
+    """
+    image = normalize_mode(image)
+    if image.mode not in ALPHA_MODES:
+        return image if mode is None or image.mode == mode else image.convert(mode)
+
+    if mode is None:
+        mode = 'L' if image.mode == 'LA' else 'RGB'
+    if mode == 'RGB' and image.mode == 'LA':
+        image = image.convert('RGBA')
+
+    background = Image.new(mode, image.size, WHITE if mode == 'L' else (WHITE,) * 3)
+    background.paste(image, mask=image)
+    return background
+
+
+@lru_cache(maxsize=16)
+def _source_profile(profile):
+    """
+    Parsed ICC profile, or None when it already describes sRGB
+    """
+    source = ImageCms.ImageCmsProfile(BytesIO(profile))
+    if 'srgb' in ImageCms.getProfileDescription(source).lower():
+        return None
+    return source
+
+
+@lru_cache(maxsize=16)
+def _srgb_transform(profile, mode):
+    return ImageCms.buildTransform(
+        _source_profile(profile),
+        ImageCms.createProfile('sRGB'),
+        mode,
+        _ICC_MODES[mode],
+        renderingIntent=ImageCms.Intent.PERCEPTUAL
+    )
+
+
+def needs_srgb_conversion(image):
+    """
+    Whether image carries an ICC profile other than sRGB that can be converted
+    """
+    profile = image.info.get('icc_profile')
+    if not profile or ImageCms is None or image.mode not in _ICC_MODES:
+        return False
+    try:
+        return _source_profile(profile) is not None
+    except (OSError, ImageCms.PyCMSError) as e:
+        print(f"Ignoring unreadable ICC profile: {str(e)}")
+        return False
+
+
+def to_srgb(image):
+    """
+    Convert image to sRGB if its ICC profile needs it and drop the profile
+    Untagged and sRGB images keep their pixels
+    """
+    if needs_srgb_conversion(image):
+        transform = _srgb_transform(image.info['icc_profile'], image.mode)
+        image = ImageCms.applyTransform(image, transform)
+    image.info.pop('icc_profile', None)
+    return image
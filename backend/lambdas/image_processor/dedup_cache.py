@@ -0,0 +1,197 @@
+"""
+Content-addressed rendition cache for the Image Processor
+Maps a digest of (source bytes, processing parameters) to the processed object
+that already holds that rendition, so identical uploads are copied server-side
+instead of being decoded and encoded again
+"""
+
+import hashlib
+import json
+import threading
+from botocore.exceptions import ClientError
+from collections import OrderedDict
+
+# Bump when the processing pipeline changes output bytes, to invalidate old entries
+PIPELINE_VERSION = 3
+
+
+def rendition_digest(source_digest, rendition, watermark, encoding=None):
+    """
+    Digest identifying one rendition of one source
+    encoding holds encoder settings for adaptive/auto renditions
+    """
+    params = {
+        'version': PIPELINE_VERSION,
+        'source': source_digest,
+        'width': rendition['width'],
+        'height': rendition['height'],
+        'quality': rendition['quality'],
+        'format': rendition['format'].lower(),
+        'watermark': watermark
+    }
+    if encoding is not None:
+        params['encoding'] = encoding
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class MemoryCacheIndex:
+    """
+    In-memory LRU index, kept across warm invocations of the same container
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+            return entry
+
+    def put(self, digest, entry):
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+
+class S3CacheIndex:
+    """
+    Index shared between containers, stored as small JSON objects under a bucket prefix
+    """
+
+    def __init__(self, s3_client, bucket, prefix='cache-index/'):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, digest):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{digest}.json")
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def put(self, digest, entry):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{digest}.json",
+            Body=json.dumps(entry).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+    def discard(self, digest):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=f"{self.prefix}{digest}.json")
+
+
+class DynamoDBCacheIndex:
+    """
+    Index shared between containers, stored in a DynamoDB table keyed by 'digest'
+    """
+
+    def __init__(self, dynamodb_client, table_name):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+
+    def get(self, digest):
+        response = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={'digest': {'S': digest}},
+            ConsistentRead=False
+        )
+        item = response.get('Item')
+        if not item:
+            return None
+        entry = {'key': item['key']['S'], 'etag': item['etag']['S']}
+        for name in ('width', 'height'):
+            if name in item:
+                entry[name] = int(item[name]['N'])
+        return entry
+
+    def put(self, digest, entry):
+        item = {
+            'digest': {'S': digest},
+            'key': {'S': entry['key']},
+            'etag': {'S': entry['etag']}
+        }
+        for name in ('width', 'height'):
+            if entry.get(name):
+                item[name] = {'N': str(entry[name])}
+        self.dynamodb_client.put_item(TableName=self.table_name, Item=item)
+
+    def discard(self, digest):
+        self.dynamodb_client.delete_item(TableName=self.table_name, Key={'digest': {'S': digest}})
+
+
+class RenditionCache:
+    """
+    In-memory LRU in front of an optional shared backend, with hit/miss counters
+    Entries are {'key': processed_key, 'etag': etag, 'width': ..., 'height': ...};
+    the ETag lets the caller detect that the object was overwritten since it was
+    cached, the pixel size is optional
+    """
+
+    def __init__(self, memory, backend=None):
+        self.memory = memory
+        self.backend = backend
+        self._counts = {'hits': 0, 'misses': 0, 'stale': 0}
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        entry = self.memory.get(digest)
+        if entry is None and self.backend is not None:
+            entry = self.backend.get(digest)
+            if entry is not None:
+                self.memory.put(digest, entry)
+        return entry
+
+    def put(self, digest, entry):
+        self.memory.put(digest, entry)
+        if self.backend is not None:
+            self.backend.put(digest, entry)
+
+    def discard(self, digest):
+        self.memory.discard(digest)
+        if self.backend is not None:
+            self.backend.discard(digest)
+
+    def record(self, outcome):
+        """
+        Count a lookup outcome: 'hits', 'misses' or 'stale'
+        """
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def create_cache(kind, s3_client=None, bucket=None, dynamodb_client=None, table_name=None, max_entries=1024):
+    """
+    Build a rendition cache from configuration
+    kind: 'none', 'memory', 's3' or 'dynamodb'
+    """
+    kind = (kind or 'none').lower()
+    if kind == 'none':
+        return None
+
+    memory = MemoryCacheIndex(max_entries)
+    if kind == 'memory':
+        return RenditionCache(memory)
+    if kind == 's3':
+        return RenditionCache(memory, S3CacheIndex(s3_client, bucket))
+    if kind == 'dynamodb':
+        return RenditionCache(memory, DynamoDBCacheIndex(dynamodb_client, table_name))
+
+    raise ValueError(f"Unknown dedup cache backend: {kind}")
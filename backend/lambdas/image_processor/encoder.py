@@ -0,0 +1,266 @@
+"""
+Adaptive encoding for the Image Processor
+Instead of always saving with the quality from the object key, searches for the
+lowest quality that still meets a perceptual target (SSIM on a downscaled luma
+proxy) and/or fits a byte budget, and can pick the output format from the
+image content when the requested format is 'auto'
+
+ENCODE_MODE: 'fixed' (default, quality from the key) or 'adaptive'
+The quality from the object key is the upper bound of the search
+"""
+
+import os
+from PIL import Image
+
+import color
+
+try:
+    import numpy as np
+except ImportError:  # perceptual target disabled, byte budget still works
+    np = None
+
+ENCODE_MODE = os.environ.get('ENCODE_MODE', 'fixed').lower()
+TARGET_BYTES = int(os.environ.get('TARGET_BYTES', '0'))  # 0 disables the byte budget
+TARGET_SSIM = float(os.environ.get('TARGET_SSIM', '0.985'))  # 0 disables the perceptual target
+MIN_QUALITY = int(os.environ.get('MIN_QUALITY', '40'))
+# Candidate formats for 'auto', lossy ones in order of preference
+AUTO_FORMATS = [f.strip() for f in os.environ.get('AUTO_FORMATS', 'webp,jpeg,png').split(',') if f.strip()]
+SSIM_PROXY_SIZE = 256  # Longest side of the proxy SSIM is computed on
+PALETTE_COLORS = 256  # Images with at most this many colours are treated as graphics
+
+LOSSY_FORMATS = ('jpeg', 'webp')
+
+
+def settings():
+    """
+    Encoding settings that change output bytes, for the dedup cache digest
+    """
+    return {
+        'mode': ENCODE_MODE,
+        'target_bytes': TARGET_BYTES,
+        'target_ssim': TARGET_SSIM if np is not None else 0,
+        'min_quality': MIN_QUALITY,
+        'auto_formats': AUTO_FORMATS
+    }
+
+
+def normalize_format(output_format):
+    output_format = output_format.lower()
+    return 'jpeg' if output_format == 'jpg' else output_format
+
+
+def _luma(image):
+    """
+    Luma channel with transparency flattened onto white (as JPEG output would be)
+    """
+    return color.flatten(image, 'L')
+
+
+def proxy_size(size):
+    scale = min(1.0, SSIM_PROXY_SIZE / max(size))
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def luma_proxy(image, size):
+    """
+    Downscaled luma of image used to compare encodes
+    """
+    if image.format == 'JPEG':
+        # Decode the candidate at reduced scale, it is only compared at proxy size
+        image.draft('L', size)
+    luma = _luma(image)
+    if luma.size != size:
+        luma = luma.resize(size, Image.Resampling.BILINEAR)
+    return np.asarray(luma, dtype=np.float64)
+
+
+def _box_mean(values, window):
+    # Mean over every window x window block using a summed-area table
+    table = np.pad(values.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    total = (table[window:, window:] - table[:-window, window:]
+             - table[window:, :-window] + table[:-window, :-window])
+    return total / (window * window)
+
+
+def ssim(reference, candidate, window=8):
+    """
+    Mean structural similarity of two equally sized luma arrays (Wang et al. 2004)
+    using a uniform window
+    """
+    window = min(window, *reference.shape)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+
+    mu_x, mu_y = _box_mean(reference, window), _box_mean(candidate, window)
+    var_x = _box_mean(reference * reference, window) - mu_x * mu_x
+    var_y = _box_mean(candidate * candidate, window) - mu_y * mu_y
+    cov = _box_mean(reference * candidate, window) - mu_x * mu_y
+
+    score = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(score.mean())
+
+
+def has_transparency(image):
+    if image.mode in ('RGBA', 'LA', 'PA'):
+        return image.getchannel('A').getextrema()[0] < 255
+    return image.mode == 'P' and 'transparency' in image.info
+
+
+def palette_image(image):
+    """
+    Exact palette version of an image with few colours, or None
+    Used for graphics (screenshots, logos) where PNG-8 is lossless and small
+    """
+    if image.mode not in ('RGB', 'L'):
+        return None
+    colors = image.getcolors(PALETTE_COLORS)
+    if colors is None:
+        return None
+    if image.mode == 'L':
+        image = image.convert('RGB')
+        colors = image.getcolors(PALETTE_COLORS)
+
+    palette = Image.new('P', (1, 1))
+    flat = [channel for _, color in colors for channel in color]
+    palette.putpalette(flat + flat[:3] * (256 - len(colors)))
+    # Every colour is in the palette, so nearest-colour mapping is exact
+    return image.quantize(palette=palette, dither=Image.Dither.NONE)
+
+
+def candidate_formats(image, requested):
+    """
+    Formats to try for a rendition: the requested one, or for 'auto' a choice
+    based on content (graphics -> PNG, transparency -> WebP, photos -> lossy formats)
+    """
+    if normalize_format(requested) != 'auto':
+        return [requested]
+
+    lossy = [f for f in AUTO_FORMATS if f in LOSSY_FORMATS]
+    if 'png' in AUTO_FORMATS and image.mode in ('RGB', 'L') and image.getcolors(PALETTE_COLORS) is not None:
+        # Lossy formats are only tried when the lossless PNG misses the byte budget
+        return ['png'] + (lossy if TARGET_BYTES else [])
+    if has_transparency(image):
+        alpha_capable = [f for f in AUTO_FORMATS if f in ('webp', 'png')]
+        return alpha_capable[:1] or ['png']
+    return lossy or ['jpeg']
+
+
+class _Trials:
+    """
+    Encodes of one image at several qualities, keeping only the buffers still needed
+    """
+
+    def __init__(self, image, output_format, encode, reference):
+        self.image = image
+        self.output_format = output_format
+        self.encode = encode
+        self.reference = reference
+        self.results = {}
+
+    def __call__(self, quality):
+        if quality not in self.results:
+            output = self.encode(self.image, self.output_format, quality)
+            size = output.seek(0, os.SEEK_END)
+            output.seek(0)
+            score = None
+            if self.reference is not None:
+                score = ssim(self.reference, luma_proxy(Image.open(output), self.reference.shape[::-1]))
+                output.seek(0)
+            self.results[quality] = (output, size, score)
+        return self.results[quality]
+
+    def take(self, quality):
+        """
+        Return the encode at quality and close every other buffer
+        """
+        chosen = self(quality)
+        for other, (output, _, _) in self.results.items():
+            if other != quality:
+                output.close()
+        self.results = {quality: chosen}
+        return chosen
+
+
+def search_quality(image, output_format, max_quality, encode, reference=None):
+    """
+    Binary search the quality of a lossy format
+    Lowest quality with SSIM >= TARGET_SSIM (max_quality if none), then lowered
+    further if needed to fit TARGET_BYTES
+    Returns (output, quality, size, attempts)
+    """
+    trials = _Trials(image, output_format, encode, reference)
+    low = min(MIN_QUALITY, max_quality)
+    quality = max_quality
+
+    if reference is not None and TARGET_SSIM:
+        # Lowest quality whose SSIM meets the target (SSIM grows with quality)
+        lo, hi = low, max_quality
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if trials(mid)[2] >= TARGET_SSIM:
+                quality, hi = mid, mid - 1
+            else:
+                lo = mid + 1
+
+    if TARGET_BYTES and trials(quality)[1] > TARGET_BYTES:
+        # Highest quality under the budget; the minimum quality if nothing fits
+        fitting, lo, hi = low, low, quality - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if trials(mid)[1] <= TARGET_BYTES:
+                fitting, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+        quality = fitting
+
+    attempts = len(trials.results)
+    output, size, _ = trials.take(quality)
+    return output, quality, size, attempts
+
+
+def encode_adaptive(image, requested_format, max_quality, encode):
+    """
+    Encode image for a rendition in adaptive mode
+    encode(image, format, quality) must return a rewound file object
+    Lossy candidates are encoded at the lowest quality whose SSIM meets
+    TARGET_SSIM (max_quality when none does), lowered further to fit
+    TARGET_BYTES; of the candidates, one within the budget is kept over one
+    above it, then the smaller (PNG ends the search once it fits)
+    Returns (output, format, quality, attempts)
+    """
+    reference = None
+    if np is not None and TARGET_SSIM:
+        reference = luma_proxy(image, proxy_size(image.size))
+
+    best = None
+    attempts = 0
+    for output_format in candidate_formats(image, requested_format):
+        if output_format == 'png':
+            source = palette_image(image) or image
+            output = encode(source, 'png', None)
+            size = output.seek(0, os.SEEK_END)
+            output.seek(0)
+            quality, tries = None, 1
+        else:
+            output, quality, size, tries = search_quality(image, output_format, max_quality, encode, reference)
+        attempts += tries
+
+        # Within the budget beats over it; the smaller output wins otherwise
+        fits = not TARGET_BYTES or size <= TARGET_BYTES
+        if best is None or (fits and not best[4]) or (fits == best[4] and size < best[3]):
+            if best is not None:
+                best[0].close()
+            best = (output, output_format, quality, size, fits)
+        else:
+            output.close()
+        if fits and output_format == 'png':
+            break
+
+    output, output_format, quality, _, _ = best
+    return output, output_format, quality, attempts
+
+
+def choose_format(image, requested_format):
+    """
+    Format for a rendition in fixed mode ('auto' picks the first content-based candidate)
+    """
+    return candidate_formats(image, requested_format)[0]
@@ -2,27 +2,99 @@
 Lambda Function: Image Processor
 Trigger: S3 Event (ObjectCreated) from source-images bucket
 Purpose: Resize, add watermark, convert format, and upload to processed-images bucket
+transform_handler serves on-demand variants of processed images (see transform)
 """
 
-import boto3
+import hashlib
 import json
+import math
 import os
+import shutil
+import time
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
 from PIL import Image, ImageDraw, ImageFont
 from urllib.parse import unquote_plus
 
+import banding
+import color
+import encoder
+import instrumentation
+import job_status
+import orientation
+import placeholder
+import process_pool
+import profiles
+import transform
+from common import json_response, lazy_client, manifest
+from dedup_cache import create_cache, rendition_digest
+from instrumentation import NULL_METRICS
+
 # Environment variables
 PROCESSED_BUCKET = os.environ.get('PROCESSED_BUCKET', 'imagehub-processed-images')
 DEFAULT_WIDTH = int(os.environ.get('DEFAULT_WIDTH', '800'))
 DEFAULT_HEIGHT = int(os.environ.get('DEFAULT_HEIGHT', '600'))
 DEFAULT_QUALITY = int(os.environ.get('DEFAULT_QUALITY', '85'))
+# Progressive JPEGs render a full-size preview after the first scan
+PROGRESSIVE_JPEG = os.environ.get('PROGRESSIVE_JPEG', 'true').lower() == 'true'
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '4'))  # Records processed concurrently
+
+# Extra renditions produced from the same decode, e.g. "thumbnail:200x200,medium:800x600"
+RENDITION_SIZES = os.environ.get('RENDITION_SIZES', '')
+# Formats for each extra rendition, e.g. "webp,jpeg" (defaults to the requested format)
+RENDITION_FORMATS = [f.strip() for f in os.environ.get('RENDITION_FORMATS', '').split(',') if f.strip()]
+
+# Sources are decoded at reduced resolution down to this multiple of the largest output
+REDUCING_GAP = float(os.environ.get('REDUCING_GAP', '2.0'))
+
+# Buffers stay in memory up to this size, then spill to /tmp
+SPOOL_MAX_SIZE = int(os.environ.get('SPOOL_MAX_SIZE', str(8 * 1024 * 1024)))  # 8MB
+# Uploads above this size use multipart upload
+MULTIPART_THRESHOLD = int(os.environ.get('MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))  # 8MB
+COPY_CHUNK_SIZE = 1024 * 1024
+
+CONTENT_TYPES = {
+    'jpeg': 'image/jpeg',
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp'
+}
+
+# Adaptive encoding (ENCODE_MODE, TARGET_BYTES, TARGET_SSIM, ...) is configured in encoder.py
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', '6'))  # zlib level for PNG in adaptive mode
+
+WATERMARK_FONT = os.environ.get('WATERMARK_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf')
+WATERMARK_CACHE_SIZE = int(os.environ.get('WATERMARK_CACHE_SIZE', '64'))  # Rendered text tiles kept in memory
+
+# Content-addressed dedup cache: none, memory, s3 or dynamodb
+DEDUP_CACHE = os.environ.get('DEDUP_CACHE', 'memory')
+DEDUP_CACHE_SIZE = int(os.environ.get('DEDUP_CACHE_SIZE', '1024'))  # In-memory LRU entries
+DEDUP_TABLE = os.environ.get('DEDUP_TABLE', '')
+
+# save_image_history function invoked asynchronously with the history of each batch
+HISTORY_FUNCTION_NAME = os.environ.get('HISTORY_FUNCTION_NAME', '')
+HISTORY_BATCH_SIZE = 100  # Entries per invocation, keeps payloads well under the 256KB async limit
+
+# Clients are created on first use (see common.aws)
+s3_client = lazy_client('s3')
+lambda_client = lazy_client('lambda') if HISTORY_FUNCTION_NAME else None
 
-s3_client = boto3.client('s3')
+rendition_cache = create_cache(
+    DEDUP_CACHE,
+    s3_client=s3_client,
+    bucket=PROCESSED_BUCKET,
+    dynamodb_client=lazy_client('dynamodb') if DEDUP_CACHE == 'dynamodb' else None,
+    table_name=DEDUP_TABLE,
+    max_entries=DEDUP_CACHE_SIZE
+)
 
 
 def get_image_metadata(key):
     """
-    Parse image metadata from S3 object key
+    Parse image metadata from S3 object key (uploads made before manifests)
     Expected format: uploads/{timestamp}_{width}x{height}_{quality}_{format}_{watermark}_{filename}
     Example: uploads/1699889234_800x600_85_jpeg_ImageHub_photo.jpg
     """
@@ -53,150 +125,1009 @@ def get_image_metadata(key):
     }
 
 
-def add_watermark(image, text, opacity=128):
+def load_manifest(source_bucket, object_metadata):
     """
-    Add watermark text to image
+    Read the processing manifest of an upload from its S3 user metadata, or from
+    the sidecar object the metadata points to
+    Returns the validated manifest, or None for uploads without one
     """
-    # Create a new image for the watermark with transparency
-    watermark = Image.new('RGBA', image.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(watermark)
+    if manifest.METADATA_KEY in object_metadata:
+        return manifest.loads(object_metadata[manifest.METADATA_KEY])
+    
+    sidecar_key = object_metadata.get(manifest.SIDECAR_METADATA_KEY)
+    if sidecar_key:
+        response = s3_client.get_object(Bucket=source_bucket, Key=sidecar_key)
+        return manifest.loads(response['Body'].read())
     
+    return None
+
+
+def get_job_metadata(source_bucket, source_key, object_metadata):
+    """
+    Processing metadata for an upload: from its manifest when it has one,
+    otherwise parsed from the object key (uploads from before manifests)
+    Returns (metadata, output_name); output_name is None for key-parsed uploads
+    """
+    job_manifest = load_manifest(source_bucket, object_metadata)
+    if job_manifest is None:
+        return get_image_metadata(source_key), None
+    
+    metadata = {name: job_manifest[name] for name in ('width', 'height', 'quality', 'format', 'watermark')}
+    if job_manifest.get('profile') is not None:
+        metadata['profile'] = job_manifest['profile']
+    if job_manifest.get('renditions') is not None:
+        metadata['renditions'] = job_manifest['renditions']
+    return metadata, job_manifest['outputName']
+
+
+@lru_cache(maxsize=32)
+def load_font(font_size):
+    """
+    Load the watermark font once per size and keep it across warm invocations
+    """
     # Try to use a better font, fallback to default if not available
     try:
-        font_size = int(image.size[0] * 0.05)  # 5% of image width
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
-    except:
-        font = ImageFont.load_default()
+        return ImageFont.truetype(WATERMARK_FONT, font_size)
+    except (OSError, ValueError):
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=WATERMARK_CACHE_SIZE)
+def render_watermark_tile(text, font_size, opacity):
+    """
+    Render watermark text into a tile just large enough for the glyphs
+    Returns (tile, text_size, offset): the RGBA tile, the size used for layout
+    and where the tile sits relative to the text origin
+    Tiles are cached and shared, callers must not modify them
+    """
+    font = load_font(font_size)
     
-    # Calculate text position (bottom right corner with padding)
-    text_bbox = draw.textbbox((0, 0), text, font=font)
+    # Calculate text size the same way the full-size canvas did
+    text_bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font)
     text_width = text_bbox[2] - text_bbox[0]
     text_height = text_bbox[3] - text_bbox[1]
     
+    # Draw watermark with semi-transparent white color
+    tile = Image.new('RGBA', (max(text_width, 1), max(text_height, 1)), (0, 0, 0, 0))
+    ImageDraw.Draw(tile).text((-text_bbox[0], -text_bbox[1]), text, font=font, fill=(255, 255, 255, opacity))
+    
+    return tile, (text_width, text_height), (text_bbox[0], text_bbox[1])
+
+
+def add_watermark(image, text, opacity=128):
+    """
+    Add watermark text to image
+    Only the text bounding box is composited; the rendered text tile and the
+    font are cached across images. Returns a new RGB image
+    """
+    font_size = int(image.size[0] * 0.05)  # 5% of image width
+    tile, (text_width, text_height), (offset_x, offset_y) = render_watermark_tile(text, font_size, opacity)
+    
+    # Calculate text position (bottom right corner with padding)
     padding = 20
     position = (
-        image.size[0] - text_width - padding,
-        image.size[1] - text_height - padding
+        image.size[0] - text_width - padding + offset_x,
+        image.size[1] - text_height - padding + offset_y
     )
     
-    # Draw watermark with semi-transparent white color
-    draw.text(position, text, font=font, fill=(255, 255, 255, opacity))
+    # Flattening first is equivalent to compositing first ("over" is associative)
+    watermarked = color.flatten(image, 'RGB')
+    if watermarked is image:
+        watermarked = image.copy()
     
-    # Composite watermark onto original image
-    if image.mode != 'RGBA':
-        image = image.convert('RGBA')
+    watermarked.paste(tile, position, mask=tile)
     
-    watermarked = Image.alpha_composite(image, watermark)
+    return watermarked
+
+
+def parse_rendition_sizes(spec):
+    """
+    Parse a rendition size list
+    Format: {name}:{width}x{height},{name}:{width}x{height}
+    Example: thumbnail:200x200,medium:800x600,full:1600x1200
+    """
+    sizes = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, dimensions = entry.split(':')
+        width, height = map(int, dimensions.lower().split('x'))
+        sizes.append((name.strip(), width, height))
+    return sizes
+
+
+def get_renditions(metadata):
+    """
+    Build the list of outputs for an upload
+    The first rendition is always the one requested in the object key, followed by
+    one rendition per configured size and format (RENDITION_SIZES x RENDITION_FORMATS),
+    or by the renditions listed in the upload's manifest
+    Every rendition carries the upload's processing profile (see profiles)
+    """
+    profile = metadata.get('profile') or profiles.DEFAULT_PROFILE
+    profiles.get_profile(profile)  # Unknown names fail the upload as invalid
+    renditions = [{
+        'name': None,
+        'width': metadata['width'],
+        'height': metadata['height'],
+        'format': metadata['format'],
+        'quality': metadata['quality'],
+        'profile': profile
+    }]
     
-    # Convert back to RGB if needed
-    if watermarked.mode == 'RGBA':
-        background = Image.new('RGB', watermarked.size, (255, 255, 255))
-        background.paste(watermarked, mask=watermarked.split()[3])
-        return background
+    if metadata.get('renditions') is not None:
+        for rendition in metadata['renditions']:
+            renditions.append({
+                'name': rendition['name'],
+                'width': rendition['width'],
+                'height': rendition['height'],
+                'format': rendition.get('format', metadata['format']),
+                'quality': rendition.get('quality', metadata['quality']),
+                'profile': profile
+            })
+        return renditions
     
-    return watermarked
+    formats = RENDITION_FORMATS or [metadata['format']]
+    for name, width, height in parse_rendition_sizes(RENDITION_SIZES):
+        for output_format in formats:
+            renditions.append({
+                'name': name,
+                'width': width,
+                'height': height,
+                'format': output_format,
+                'quality': metadata['quality'],
+                'profile': profile
+            })
+    
+    return renditions
 
 
-def process_image(image_bytes, metadata):
+def fit_size(source_size, box):
     """
-    Process image: resize, add watermark, convert format
+    Compute the size that fits source_size inside box while keeping the aspect ratio
+    Never upscales. Matches the rounding used by Image.thumbnail
     """
-    # Open image
-    image = Image.open(BytesIO(image_bytes))
+    source_width, source_height = source_size
+    width, height = min(box[0], source_width), min(box[1], source_height)
     
-    # Convert RGBA to RGB if output format is JPEG
-    if metadata['format'].lower() in ['jpeg', 'jpg'] and image.mode == 'RGBA':
-        background = Image.new('RGB', image.size, (255, 255, 255))
-        background.paste(image, mask=image.split()[3] if len(image.split()) == 4 else None)
-        image = background
+    if (width, height) == (source_width, source_height):
+        return source_size
     
-    # Resize image while maintaining aspect ratio
-    image.thumbnail((metadata['width'], metadata['height']), Image.Resampling.LANCZOS)
+    aspect = source_width / source_height
+    if width / height >= aspect:
+        width = max(min(math.floor(height * aspect), math.ceil(height * aspect),
+                        key=lambda n: abs(aspect - n / height)), 1)
+    else:
+        height = max(min(math.floor(width / aspect), math.ceil(width / aspect),
+                         key=lambda n: 0 if n == 0 else abs(aspect - width / n)), 1)
     
-    # Add watermark if specified
-    if metadata['watermark']:
-        image = add_watermark(image, metadata['watermark'])
+    return (width, height)
+
+
+def new_spool():
+    """
+    Temporary buffer that stays in memory up to SPOOL_MAX_SIZE and then spills to /tmp
+    """
+    return SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+
+def encode_image(image, output_format, quality, output=None, png_compress_level=None, exif=None, profile=None):
+    """
+    Encode image in the requested format into output (a new BytesIO by default)
+    JPEG is progressive when PROGRESSIVE_JPEG is on
+    PNG uses optimize=True unless png_compress_level is given (much faster)
+    exif (bytes) is embedded when given, otherwise outputs carry no metadata
+    profile (a profiles name) sets the encoder effort and overrides the above
+    Returns output rewound to the start
+    """
+    settings = profiles.get_profile(profile)
+    if png_compress_level is None:
+        png_compress_level = settings['png_compress_level']
     
-    # Save to bytes
-    output = BytesIO()
-    save_format = metadata['format'].upper()
+    save_format = output_format.upper()
     if save_format == 'JPG':
         save_format = 'JPEG'
     
+    # JPEG has no alpha channel: flatten transparency onto white
+    if save_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = color.flatten(image)
+    
     save_kwargs = {'format': save_format}
     if save_format == 'JPEG':
-        save_kwargs['quality'] = metadata['quality']
-        save_kwargs['optimize'] = True
+        save_kwargs['quality'] = quality
+        save_kwargs['optimize'] = settings['jpeg_optimize']
+        save_kwargs['progressive'] = PROGRESSIVE_JPEG if settings['progressive'] is None else settings['progressive']
     elif save_format == 'PNG':
-        save_kwargs['optimize'] = True
+        if png_compress_level is None:
+            save_kwargs['optimize'] = True
+        else:
+            save_kwargs['compress_level'] = png_compress_level
     elif save_format == 'WEBP':
-        save_kwargs['quality'] = metadata['quality']
+        save_kwargs['quality'] = quality
+        save_kwargs['method'] = settings['webp_method']
+    if exif:
+        save_kwargs['exif'] = exif
     
+    if output is None:
+        output = BytesIO()
     image.save(output, **save_kwargs)
     output.seek(0)
     
-    return output.getvalue()
+    return output
 
 
-def handler(event, context):
+def encode_rendition(image, rendition, metrics=NULL_METRICS, exif=None):
     """
-    Main Lambda handler function
+    Encode one rendition according to ENCODE_MODE
+    Returns (output, output_format); the format differs from the rendition's
+    when it was 'auto'
     """
-    try:
-        # Get the S3 event details
-        record = event['Records'][0]
-        source_bucket = record['s3']['bucket']['name']
-        source_key = unquote_plus(record['s3']['object']['key'])
-        
-        print(f"Processing image: {source_key} from bucket: {source_bucket}")
-        
-        # Download image from S3
-        response = s3_client.get_object(Bucket=source_bucket, Key=source_key)
-        image_bytes = response['Body'].read()
-        
-        # Get processing metadata
-        metadata = get_image_metadata(source_key)
-        print(f"Processing with metadata: {metadata}")
+    profile = rendition.get('profile')
+    if encoder.ENCODE_MODE != 'adaptive':
+        output_format = encoder.choose_format(image, rendition['format'])
+        return encode_image(image, output_format, rendition['quality'], new_spool(), exif=exif, profile=profile), output_format
+    
+    png_compress_level = profiles.get_profile(profile)['png_compress_level']
+    if png_compress_level is None:
+        png_compress_level = PNG_COMPRESS_LEVEL
+    
+    def encode(candidate, output_format, quality):
+        return encode_image(candidate, output_format, quality, new_spool(), png_compress_level=png_compress_level,
+                            exif=exif, profile=profile)
+    
+    output, output_format, quality, attempts = encoder.encode_adaptive(image, rendition['format'], rendition['quality'], encode)
+    metrics.add('EncodeAttempts', attempts)
+    metrics.set('EncodedQuality', quality)
+    return output, output_format
+
+
+def passthrough_format(image, source, rendition, watermark, source_size):
+    """
+    Format of the source when it can be stored as-is for a rendition in adaptive
+    mode: same format and size, no watermark and within the byte budget
+    The source must also be upright, in sRGB and (when stripping) free of metadata
+    Returns None when the rendition must be encoded
+    """
+    if encoder.ENCODE_MODE != 'adaptive' or watermark or not image.format:
+        return None
+    if orientation.get_orientation(image) != 1 or color.needs_srgb_conversion(image):
+        return None
+    if orientation.STRIP_METADATA and orientation.has_metadata(image):
+        return None
+    
+    source_format = encoder.normalize_format(image.format)
+    requested = encoder.normalize_format(rendition['format'])
+    if source_format not in CONTENT_TYPES or requested not in (source_format, 'auto'):
+        return None
+    if fit_size(source_size, (rendition['width'], rendition['height'])) != source_size:
+        return None
+    
+    if encoder.TARGET_BYTES:
+        position = source.tell()
+        fits = source.seek(0, os.SEEK_END) <= encoder.TARGET_BYTES
+        source.seek(position)
+        if not fits:
+            return None
+    
+    return source_format
+
+
+def copy_source(source):
+    """
+    Copy the encoded source into a new spool, restoring the source position
+    """
+    position = source.tell()
+    source.seek(0)
+    output = new_spool()
+    shutil.copyfileobj(source, output, COPY_CHUNK_SIZE)
+    output.seek(0)
+    source.seek(position)
+    return output
+
+
+def draft_size(size, request):
+    """
+    Size Image.draft() decodes a JPEG of size at for request (1/1 to 1/8 DCT scaling)
+    """
+    scale = min(size[0] // max(request[0], 1), size[1] // max(request[1], 1))
+    for denominator in (8, 4, 2):
+        if scale >= denominator:
+            return (math.ceil(size[0] / denominator), math.ceil(size[1] / denominator))
+    return size
+
+
+def load_reduced(image, target_size, reducing_gap=None):
+    """
+    Decode image at the smallest resolution that still allows a high quality
+    downscale to target_size (at least reducing_gap, default REDUCING_GAP, times larger on both axes)
+    JPEG sources are scaled during decode with Image.draft() (DCT scaling, up to 1/8);
+    the remaining integer factor is removed with a cheap box reduce() so that only
+    the final downscale runs the LANCZOS filter
+    The decoded image is converted to a working mode (see color.normalize_mode)
+    before reducing, since palette images can't be filtered
+    Decodes that would exceed banding.MAX_DECODE_BYTES give up the reducing gap
+    (JPEG) or are decoded in bands (PNG, see banding.load_banded); the others
+    raise banding.ImageTooLargeError
+    """
+    banding.check_source(image)
+    reducing_gap = reducing_gap or REDUCING_GAP
+    request = (int(target_size[0] * reducing_gap), int(target_size[1] * reducing_gap))
+    
+    # draft() is only effective before the image data is loaded
+    if image.format == 'JPEG' and image.mode in ('RGB', 'L', 'CMYK'):
+        if not banding.fits_in_memory(draft_size(image.size, request), image.mode):
+            request = target_size
+        image.draft(image.mode, request)
+    
+    if not banding.fits_in_memory(image.size, image.mode):
+        return banding.load_banded(image, request)
+    
+    image.load()
+    image = color.normalize_mode(image)
+    
+    factor = min(image.size[0] // max(request[0], 1), image.size[1] // max(request[1], 1))
+    if factor >= 2:
+        image = image.reduce(factor)
+    
+    return image
+
+
+def render_renditions(image, renditions, watermark=None, source_size=None, metrics=NULL_METRICS, exif=None):
+    """
+    Resize, watermark and encode a decoded image into every rendition
+    Sizes are produced largest first and each one is derived from the smallest
+    already-resized image that still covers it, instead of resampling from full resolution
+    With a process pool (see process_pool) each size is rendered by a worker
+    from the shared decoded image instead
+    source_size is the original size when image was decoded at reduced resolution,
+    so output sizes don't depend on the decode scale
+    Yields (index, rendition, output) as each rendition is encoded, where output is
+    a spooled buffer owned by the caller and rendition carries the pixel size in
+    'output_size'
+    Stage timings are recorded on metrics
+    """
+    source_size = source_size or image.size
+    
+    # Group renditions by their final pixel size so each size is resized once
+    sizes = {}
+    for index, rendition in enumerate(renditions):
+        size = fit_size(source_size, (rendition['width'], rendition['height']))
+        sizes.setdefault(size, []).append((index, rendition))
+    
+    pool = process_pool.get_pool() if len(sizes) > 1 else None
+    if pool is not None:
+        yield from render_in_pool(pool, image, sizes, watermark, metrics, exif)
+        return
+    
+    resized = [image]
+    
+    for size in sorted(sizes, key=lambda s: s[0] * s[1], reverse=True):
+        # Smallest intermediate that is at least as large as the target on both axes
+        covering = [candidate for candidate in resized if candidate.size[0] >= size[0] and candidate.size[1] >= size[1]]
+        base = min(covering or [image], key=lambda candidate: candidate.size[0] * candidate.size[1])
+        with metrics.stage('resize'):
+            current = resize_for(base, size, sizes[size])
+        resized.append(current)
         
-        # Process image
-        processed_image = process_image(image_bytes, metadata)
+        yield from render_size(current, sizes[size], watermark, metrics, exif)
+
+
+def resize_for(image, size, renditions):
+    """
+    Resize image to size with the filter and pre-shrink of the renditions' profile
+    """
+    if image.size == size:
+        return image
+    settings = profiles.get_profile(renditions[0][1].get('profile'))
+    return image.resize(size, settings['resample'], reducing_gap=settings['resize_gap'])
+
+
+def render_size(image, renditions, watermark=None, metrics=NULL_METRICS, exif=None):
+    """
+    Watermark and encode image, already resized, into renditions of its size
+    renditions is a list of (index, rendition)
+    Yields (index, rendition, output) like render_renditions
+    """
+    size = image.size
+    
+    # Watermark a copy so later sizes are derived from clean pixels
+    if watermark:
+        with metrics.stage('watermark'):
+            image = add_watermark(image, watermark)
+    
+    # JPEG renditions of a transparent image share one flattened copy
+    flattened = None
+    
+    for index, rendition in renditions:
+        target = image
+        if color.has_alpha(image) and encoder.normalize_format(rendition['format']) == 'jpeg':
+            if flattened is None:
+                with metrics.stage('flatten'):
+                    flattened = color.flatten(image)
+            target = flattened
+        with metrics.stage('encode'):
+            output, output_format = encode_rendition(target, rendition, metrics, exif)
+        metrics.add('OutputPixels', size[0] * size[1])
+        yield index, dict(rendition, format=output_format, output_size=size), output
+
+
+def render_shared(shared_ref, size, renditions, watermark=None, exif=None):
+    """
+    Worker side of render_in_pool: render one size from the shared decoded image
+    Returns ([(index, rendition, encoded bytes)], metrics snapshot)
+    """
+    image = process_pool.open_shared(shared_ref)
+    metrics = instrumentation.ImageMetrics(None, 'off')
+    with metrics.stage('resize'):
+        image = resize_for(image, size, renditions)
+    
+    results = []
+    for index, rendition, output in render_size(image, renditions, watermark, metrics, exif):
+        with output:
+            results.append((index, rendition, output.read()))
+    return results, metrics.snapshot()
+
+
+def render_in_pool(pool, image, sizes, watermark=None, metrics=NULL_METRICS, exif=None):
+    """
+    Render every size in parallel worker processes
+    The decoded pixels are written once to /tmp and mapped by the workers;
+    only the encoded outputs come back through the pipes
+    Yields (index, rendition, output) as each size finishes
+    """
+    with process_pool.SharedImage(image) as shared:
+        tasks = [(shared.ref, size, renditions, watermark, exif) for size, renditions in sizes.items()]
+        for results, snapshot in pool.imap_unordered(render_shared, tasks):
+            # Stage times are summed across workers, so they can exceed the wall time
+            metrics.merge(snapshot)
+            for index, rendition, data in results:
+                output = new_spool()
+                output.write(data)
+                output.seek(0)
+                yield index, rendition, output
+
+
+def process_renditions(source, metadata, renditions=None, metrics=NULL_METRICS, details=None):
+    """
+    Process image into several renditions from a single decode
+    source is the encoded image as bytes or a seekable file object
+    Yields (index, rendition, output) as each rendition is encoded; the yielded
+    rendition carries the actual output format (see encode_rendition) and size
+    When the image gets decoded, its placeholder is stored in details['placeholder']
+    """
+    if renditions is None:
+        renditions = get_renditions(metadata)
+    
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    
+    with metrics.stage('decode'):
+        # Open image (header only, pixels are decoded by load_reduced)
+        image = banding.open_source(source)
+        # Sizes are computed upright; the rotation is applied after the reduced decode
+        image_orientation = orientation.get_orientation(image)
+        source_size = orientation.oriented_size(image.size, image_orientation)
+    
+    # Sources that already meet the target are stored without re-encoding
+    pending = []
+    for index, rendition in enumerate(renditions):
+        source_format = passthrough_format(image, source, rendition, metadata['watermark'], source_size)
+        if source_format:
+            metrics.add('Passthrough', 1)
+            if rendition['format'] == 'auto':
+                rendition = dict(rendition, format=source_format)
+            yield index, dict(rendition, output_size=source_size), copy_source(source)
+        else:
+            pending.append(index)
+    if not pending:
+        return
+    pending_renditions = [renditions[index] for index in pending]
+    
+    with metrics.stage('decode'):
+        # Decode only as much resolution as the largest rendition needs
+        largest = max(
+            (fit_size(source_size, (rendition['width'], rendition['height'])) for rendition in pending_renditions),
+            key=lambda size: size[0] * size[1]
+        )
+        decode_gap = profiles.get_profile(pending_renditions[0].get('profile'))['decode_gap']
+        image = load_reduced(image, orientation.oriented_size(largest, image_orientation), decode_gap)
         
-        # Generate output key
+        # Orientation, ICC and metadata are handled on the reduced image
+        exif = orientation.output_exif(image)
+        image = orientation.apply_orientation(orientation.strip_metadata(color.to_srgb(image)), image_orientation)
+    
+    if image_orientation != 1:
+        metrics.add('Rotated', 1)
+    metrics.add('SourcePixels', source_size[0] * source_size[1])
+    metrics.add('DecodedPixels', image.size[0] * image.size[1])
+    
+    if details is not None:
+        with metrics.stage('placeholder'):
+            details['placeholder'] = placeholder.make_placeholder(image, source_size)
+    
+    for index, rendition, output in render_renditions(image, pending_renditions, metadata['watermark'], source_size, metrics, exif):
+        yield pending[index], rendition, output
+
+
+def process_image(image_bytes, metadata):
+    """
+    Process image: resize, add watermark, convert format
+    """
+    renditions = get_renditions(metadata)[:1]
+    
+    for _, _, output in process_renditions(image_bytes, metadata, renditions):
+        with output:
+            return output.read()
+
+
+def get_output_key(source_key, rendition, output_name=None):
+    """
+    Build the processed/ key for a rendition
+    The requested rendition keeps processed/{filename}.{format}; named renditions
+    get processed/{filename}_{name}.{format}
+    output_name (from the manifest) replaces the name parsed from source_key
+    """
+    if output_name:
+        base_name = output_name
+    else:
         original_filename = source_key.split('/')[-1]
         # Remove metadata prefix from filename
         clean_filename = '_'.join(original_filename.split('_')[5:]) if '_' in original_filename else original_filename
-        output_key = f"processed/{clean_filename.rsplit('.', 1)[0]}.{metadata['format']}"
-        
-        # Upload processed image to destination bucket
-        content_type_mapping = {
-            'jpeg': 'image/jpeg',
-            'jpg': 'image/jpeg',
-            'png': 'image/png',
-            'webp': 'image/webp'
-        }
-        content_type = content_type_mapping.get(metadata['format'].lower(), 'image/jpeg')
-        
-        s3_client.put_object(
+        base_name = clean_filename.rsplit('.', 1)[0]
+    
+    if rendition['name']:
+        base_name = f"{base_name}_{rendition['name']}"
+    
+    return f"processed/{base_name}.{rendition['format']}"
+
+
+def extract_s3_records(event):
+    """
+    Flatten an incoming event into a list of jobs to process.
+    Supports direct S3 notifications and S3 notifications delivered through SQS.
+    Each job is a dict with 'item_id' (SQS messageId or object key), 'bucket' and 'key'.
+    Jobs with an 'error' entry could not be parsed and are reported as failures.
+    """
+    jobs = []
+    
+    for record in event['Records']:
+        if record.get('eventSource') == 'aws:sqs':
+            message_id = record['messageId']
+            # A malformed message fails alone, the rest of the batch is still processed
+            try:
+                s3_event = json.loads(record['body'])
+                # s3:TestEvent messages have no Records and nothing to process
+                message_jobs = [{
+                    'item_id': message_id,
+                    'bucket': s3_record['s3']['bucket']['name'],
+                    'key': unquote_plus(s3_record['s3']['object']['key'])
+                } for s3_record in s3_event.get('Records', [])]
+            except (TypeError, ValueError, KeyError, AttributeError) as e:
+                jobs.append({'item_id': message_id, 'bucket': None, 'key': None,
+                             'error': f"Invalid SQS body: {type(e).__name__}: {str(e)}"})
+                continue
+            jobs.extend(message_jobs)
+        else:
+            key = unquote_plus(record['s3']['object']['key'])
+            jobs.append({
+                'item_id': key,
+                'bucket': record['s3']['bucket']['name'],
+                'key': key
+            })
+    
+    return jobs
+
+
+def event_item_ids(event):
+    """
+    Item identifiers of every record in an event (SQS messageId or object key),
+    reported as failed when the event can't be handled at all
+    """
+    item_ids = []
+    for record in event.get('Records') or []:
+        try:
+            if record.get('eventSource') == 'aws:sqs':
+                item_id = record['messageId']
+            else:
+                item_id = unquote_plus(record['s3']['object']['key'])
+        except (TypeError, KeyError, AttributeError):
+            continue
+        if item_id not in item_ids:
+            item_ids.append(item_id)
+    return item_ids
+
+
+def download_source(bucket, key):
+    """
+    Stream an S3 object into a spooled buffer in fixed-size chunks
+    Avoids holding the body and a second BytesIO copy of it in memory
+    Returns (source, sha256 hex digest of the bytes, user metadata of the object)
+    """
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    body = response['Body']
+    
+    source = new_spool()
+    digest = hashlib.sha256()
+    while True:
+        chunk = body.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        source.write(chunk)
+    source.seek(0)
+    
+    return source, digest.hexdigest(), response.get('Metadata', {})
+
+
+@lru_cache(maxsize=None)
+def transfer_config():
+    """
+    Multipart settings for large uploads, built on first use to keep boto3 out of import time
+    """
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_THRESHOLD,
+        max_concurrency=4
+    )
+
+
+def upload_output(output, key, content_type):
+    """
+    Upload an encoded rendition to the processed bucket
+    Objects above MULTIPART_THRESHOLD are sent as a multipart upload
+    Returns the ETag of the stored object
+    """
+    size = output.seek(0, os.SEEK_END)
+    output.seek(0)
+    
+    if size < MULTIPART_THRESHOLD:
+        response = s3_client.put_object(
+            Bucket=PROCESSED_BUCKET,
+            Key=key,
+            Body=output,
+            ContentType=content_type,
+            CacheControl='max-age=31536000'  # Cache for 1 year
+        )
+        return response['ETag']
+    
+    s3_client.upload_fileobj(
+        output,
+        PROCESSED_BUCKET,
+        key,
+        ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': 'max-age=31536000'  # Cache for 1 year
+        },
+        Config=transfer_config()
+    )
+    return s3_client.head_object(Bucket=PROCESSED_BUCKET, Key=key)['ETag']
+
+
+def copy_cached_rendition(digest, source_key, rendition, output_name=None):
+    """
+    Copy an already processed rendition with the same digest to its output key
+    The copy is conditional on the cached ETag so an object that was overwritten
+    since it was cached is never served; such entries are dropped
+    For 'auto' renditions the format is taken from the cached object's key
+    Returns (output_key, output_format, output_size) on a cache hit, None otherwise;
+    output_size is None for entries cached without it
+    """
+    entry = rendition_cache.get(digest)
+    if entry is None:
+        rendition_cache.record('misses')
+        return None
+    
+    output_format = rendition['format']
+    if output_format == 'auto':
+        output_format = entry['key'].rsplit('.', 1)[-1]
+    key = get_output_key(source_key, dict(rendition, format=output_format), output_name)
+    content_type = CONTENT_TYPES.get(output_format.lower(), 'image/jpeg')
+    
+    try:
+        s3_client.copy_object(
             Bucket=PROCESSED_BUCKET,
-            Key=output_key,
-            Body=processed_image,
+            Key=key,
+            CopySource={'Bucket': PROCESSED_BUCKET, 'Key': entry['key']},
+            CopySourceIfMatch=entry['etag'],
+            MetadataDirective='REPLACE',
             ContentType=content_type,
             CacheControl='max-age=31536000'  # Cache for 1 year
         )
+    except ClientError as e:
+        print(f"Stale dedup cache entry for {entry['key']}: {str(e)}")
+        rendition_cache.discard(digest)
+        rendition_cache.record('stale')
+        return None
+    
+    rendition_cache.record('hits')
+    output_size = (entry['width'], entry['height']) if entry.get('width') else None
+    return key, output_format, output_size
+
+
+def source_placeholder(source):
+    """
+    Placeholder for a source none of whose renditions were rendered (all copied
+    from the dedup cache or passed through); decodes at the smallest JPEG scale
+    """
+    source.seek(0)
+    image = banding.open_source(source)
+    image_orientation = orientation.get_orientation(image)
+    source_size = orientation.oriented_size(image.size, image_orientation)
+    image = load_reduced(image, placeholder.placeholder_size(image.size))
+    image = orientation.apply_orientation(color.to_srgb(image), image_orientation)
+    return placeholder.make_placeholder(image, source_size)
+
+
+def process_record(source_bucket, source_key):
+    """
+    Download, process and upload a single image
+    The outcome is written as a completion record (see job_status) either way
+    Returns a summary dict for the response body
+    """
+    print(f"Processing image: {source_key} from bucket: {source_bucket}")
+    
+    start = time.perf_counter()
+    metrics = instrumentation.start_image(source_key)
+    try:
+        result = _process_record(source_bucket, source_key, metrics)
+    except Exception as e:
+        metrics.set('error', str(e))
+        job_status.record_status(source_key, error=str(e), timings=record_timings(metrics, start))
+        raise
+    finally:
+        metrics.emit()
+    
+    job_status.record_status(source_key, result=result, timings=record_timings(metrics, start))
+    return result
+
+
+def record_timings(metrics, start):
+    """
+    Stage timings plus the total since start, for the completion record
+    """
+    return dict(metrics.timings(), TotalMs=round((time.perf_counter() - start) * 1000, 3))
+
+
+def encoding_settings(rendition):
+    """
+    Encoder settings that affect a rendition's bytes, None for fixed-mode encodes
+    that strip metadata (the default)
+    """
+    settings = None
+    if encoder.ENCODE_MODE == 'adaptive' or rendition['format'] == 'auto':
+        settings = encoder.settings()
+    if not orientation.STRIP_METADATA:
+        settings = dict(settings or {}, keep_metadata=True)
+    if not PROGRESSIVE_JPEG:
+        settings = dict(settings or {}, progressive=False)
+    if rendition.get('profile', 'balanced') != 'balanced':
+        settings = dict(settings or {}, profile=rendition['profile'])
+    return settings
+
+
+def _process_record(source_bucket, source_key, metrics):
+    """
+    Body of process_record, instrumented with metrics
+    """
+    # Download image from S3, hashing the bytes on the way
+    with metrics.stage('download'):
+        source, source_digest, object_metadata = download_source(source_bucket, source_key)
+    metrics.add('InputBytes', source.seek(0, os.SEEK_END))
+    source.seek(0)
+    
+    with source:
+        # Get processing metadata (the manifest comes with the object)
+        metadata, output_name = get_job_metadata(source_bucket, source_key, object_metadata)
+        print(f"Processing with metadata: {metadata}")
+        renditions = get_renditions(metadata)
+        uploaded = [None] * len(renditions)
+        metrics.add('Renditions', len(renditions))
+        
+        # Renditions already produced from identical bytes and settings are copied
+        pending = []
+        # Adaptive and 'auto' outputs also depend on the encoder settings
+        digests = [rendition_digest(source_digest, rendition, metadata['watermark'], encoding_settings(rendition))
+                   for rendition in renditions]
+        for index, rendition in enumerate(renditions):
+            if rendition_cache is None:
+                cached = None
+            else:
+                with metrics.stage('copy'):
+                    cached = copy_cached_rendition(digests[index], source_key, rendition, output_name)
+            
+            if cached:
+                metrics.add('CacheHits', 1)
+                output_key, output_format, output_size = cached
+                uploaded[index] = {
+                    'name': rendition['name'],
+                    'format': output_format,
+                    'output_key': output_key,
+                    'size': output_size,
+                    'cached': True
+                }
+            else:
+                pending.append(index)
         
-        print(f"Successfully processed and uploaded to: {output_key}")
+        # Process the remaining renditions from a single decode,
+        # uploading each one as soon as it is encoded
+        details = {}
+        if pending:
+            pending_renditions = [renditions[index] for index in pending]
+            for pending_index, rendition, output in process_renditions(source, metadata, pending_renditions, metrics, details):
+                index = pending[pending_index]
+                output_key = get_output_key(source_key, rendition, output_name)
+                content_type = CONTENT_TYPES.get(rendition['format'].lower(), 'image/jpeg')
+                
+                # Upload processed image to destination bucket
+                with output, metrics.stage('upload'):
+                    metrics.add('OutputBytes', output.seek(0, os.SEEK_END))
+                    etag = upload_output(output, output_key, content_type)
+                
+                width, height = rendition['output_size']
+                if rendition_cache is not None:
+                    rendition_cache.put(digests[index], {'key': output_key, 'etag': etag, 'width': width, 'height': height})
+                
+                uploaded[index] = {
+                    'name': rendition['name'],
+                    'format': rendition['format'],
+                    'output_key': output_key,
+                    'size': (width, height),
+                    'cached': False
+                }
         
-        # Return CloudFront/S3 URL
-        processed_url = f"https://{PROCESSED_BUCKET}.s3.amazonaws.com/{output_key}"
+        # The placeholder is a by-product of decoding; decode a tiny version otherwise
+        if 'placeholder' not in details and placeholder.PLACEHOLDER_SIZE > 0:
+            try:
+                with metrics.stage('placeholder'):
+                    details['placeholder'] = source_placeholder(source)
+            except Exception as e:
+                print(f"Error creating placeholder for {source_key}: {str(e)}")
+    
+    output_key = uploaded[0]['output_key']
+    print(f"Successfully processed and uploaded {len(uploaded)} rendition(s) to: {output_key}")
+    
+    # Return CloudFront/S3 URL
+    processed_url = f"https://{PROCESSED_BUCKET}.s3.amazonaws.com/{output_key}"
+    
+    return {
+        'source_key': source_key,
+        'user_id': object_metadata.get('user-id'),
+        'processed_url': processed_url,
+        'output_key': output_key,
+        'renditions': uploaded,
+        'placeholder': details.get('placeholder'),
+        'metadata': metadata
+    }
+
+
+def build_history_entry(result):
+    """
+    Build a save_image_history entry for a processed image
+    """
+    metadata = dict(result['metadata'])
+    metadata['renditions'] = []
+    for rendition in result['renditions']:
+        entry = {'name': rendition['name'], 'format': rendition['format'], 'key': rendition['output_key']}
+        # Pixel sizes let get_image_history build a srcset
+        if rendition.get('size'):
+            entry['width'], entry['height'] = rendition['size']
+        if rendition['name']:
+            metadata['renditions'].append(entry)
+        elif rendition.get('size'):
+            metadata['outputWidth'], metadata['outputHeight'] = rendition['size']
+    
+    entry = {
+        'userId': result['user_id'],
+        'originalKey': result['source_key'],
+        'processedKey': result['output_key'],
+        'metadata': metadata
+    }
+    if result.get('placeholder'):
+        entry['placeholder'] = result['placeholder']
+    return entry
+
+
+def record_history(results):
+    """
+    Send history entries for uploads that carry a user-id to save_image_history
+    The function is invoked asynchronously (InvocationType=Event) with batches of
+    entries, so the processor doesn't wait on DynamoDB and clients don't need a
+    second API call per upload
+    Returns the number of entries sent
+    """
+    entries = [build_history_entry(result) for result in results if result.get('user_id')]
+    
+    for start in range(0, len(entries), HISTORY_BATCH_SIZE):
+        lambda_client.invoke(
+            FunctionName=HISTORY_FUNCTION_NAME,
+            InvocationType='Event',
+            Payload=json.dumps({'items': entries[start:start + HISTORY_BATCH_SIZE]}).encode('utf-8')
+        )
+    
+    return len(entries)
+
+
+def _run_job(job):
+    """
+    Run a single job, capturing any error so one bad image doesn't fail the batch
+    """
+    if job.get('error'):
+        return job, None, job['error']
+    
+    try:
+        return job, process_record(job['bucket'], job['key']), None
+    except Exception as e:
+        print(f"Error processing image {job['key']}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return job, None, str(e)
+
+
+def handler(event, context):
+    """
+    Main Lambda handler function
+    Processes every record in the event on a bounded thread pool so S3 I/O
+    overlaps with Pillow work, and reports per-record failures using the
+    SQS partial batch response format (batchItemFailures)
+    """
+    try:
+        jobs = extract_s3_records(event)
+        
+        results = []
+        errors = []
+        failed_ids = []
+        
+        if jobs:
+            max_workers = max(1, min(MAX_WORKERS, len(jobs)))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for job, result, error in executor.map(_run_job, jobs):
+                    if error is None:
+                        results.append(result)
+                        continue
+                    
+                    errors.append({
+                        'item_id': job['item_id'],
+                        'source_key': job['key'],
+                        'error': error
+                    })
+                    if job['item_id'] not in failed_ids:
+                        failed_ids.append(job['item_id'])
+        
+        print(f"Processed {len(results)} image(s), {len(errors)} failure(s)")
+        
+        # History is best effort: a failure here must not fail processed images
+        if lambda_client is not None and results:
+            try:
+                recorded = record_history(results)
+                print(f"Sent {recorded} history entries to {HISTORY_FUNCTION_NAME}")
+            except Exception as e:
+                print(f"Error recording history: {str(e)}")
+        
+        cache_stats = rendition_cache.stats() if rendition_cache is not None else None
+        if cache_stats:
+            print(f"Dedup cache: {cache_stats}")
+        
+        if not errors:
+            status_code = 200
+            message = 'Image processed successfully'
+        elif not results:
+            status_code = 500
+            message = 'Error processing image'
+        else:
+            status_code = 207
+            message = 'Some images failed to process'
         
         return {
-            'statusCode': 200,
+            'statusCode': status_code,
             'body': json.dumps({
-                'message': 'Image processed successfully',
-                'processed_url': processed_url,
-                'output_key': output_key,
-                'metadata': metadata
-            })
+                'message': message,
+                'results': results,
+                'errors': errors,
+                'cache': cache_stats
+            }),
+            'batchItemFailures': [{'itemIdentifier': item_id} for item_id in failed_ids]
         }
         
     except Exception as e:
@@ -204,10 +1135,113 @@ def handler(event, context):
         import traceback
         traceback.print_exc()
         
+        # Every message is retried rather than the whole batch being treated as one
+        try:
+            item_ids = event_item_ids(event)
+        except Exception:
+            item_ids = []
         return {
             'statusCode': 500,
             'body': json.dumps({
                 'message': 'Error processing image',
                 'error': str(e)
-            })
+            }),
+            'batchItemFailures': [{'itemIdentifier': item_id} for item_id in item_ids]
         }
+
+
+def source_version(source_key):
+    """
+    Version of the processed object source_key that variants are keyed by (its ETag)
+    Raises ClientError 404 when it doesn't exist
+    """
+    response = s3_client.head_object(Bucket=PROCESSED_BUCKET, Key=source_key)
+    return response['ETag'].strip('"')
+
+
+def fetch_variant(key):
+    """
+    Stored transform variant as (body, content type), None when not rendered yet
+    Variants above transform.INLINE_MAX_BYTES are not read (body is None)
+    """
+    try:
+        response = s3_client.get_object(Bucket=PROCESSED_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    
+    content_type = response.get('ContentType', 'image/jpeg')
+    if response.get('ContentLength', 0) > transform.INLINE_MAX_BYTES:
+        response['Body'].close()
+        return None, content_type
+    return response['Body'].read(), content_type
+
+
+def render_variant(source_key, rendition, key):
+    """
+    Render rendition from the processed object source_key and store it at key
+    Returns (body, content type) like fetch_variant
+    """
+    source, _, _ = download_source(PROCESSED_BUCKET, source_key)
+    with source:
+        # The source already carries the upload's watermark
+        for _, rendered, output in process_renditions(source, {'watermark': None}, [rendition]):
+            content_type = CONTENT_TYPES.get(rendered['format'].lower(), 'image/jpeg')
+            with output:
+                size = output.seek(0, os.SEEK_END)
+                upload_output(output, key, content_type)
+                output.seek(0)
+                body = output.read() if size <= transform.INLINE_MAX_BYTES else None
+            print(f"Rendered {key} ({size} bytes)")
+            return body, content_type
+
+
+def transform_handler(event, context):
+    """
+    On-demand transform endpoint (Lambda function URL behind CloudFront)
+    GET /img/processed/photo.jpg?w=400&h=300&fmt=webp&q=80
+    200 with the image, 302 to the stored variant when it is too large to
+    return inline, 304 when If-None-Match matches the current variant,
+    404 when the processed image doesn't exist
+    """
+    try:
+        path = event.get('rawPath') or event.get('path')
+        params = event.get('queryStringParameters') or {}
+        try:
+            source_key, rendition = transform.parse_request(path, params, DEFAULT_QUALITY)
+        except ValueError as e:
+            return json_response(400, {
+                'message': 'Validation failed',
+                'errors': [str(e)]
+            }, transform.ALLOWED_METHODS)
+        
+        key = transform.variant_key(source_key, source_version(source_key), rendition)
+        etag = transform.response_etag(key)
+        if transform.is_not_modified(event.get('headers'), etag):
+            return transform.not_modified_response(etag)
+        
+        variant = fetch_variant(key)
+        status = 'hit'
+        if variant is None:
+            variant, status = transform.single_flight(
+                key, fetch_variant, lambda: render_variant(source_key, rendition, key), context
+            )
+        
+        body, content_type = variant
+        if body is None:
+            return transform.redirect_response(key, etag)
+        return transform.image_response(body, content_type, etag, status)
+    
+    except Exception as e:
+        if isinstance(e, ClientError) and e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return json_response(404, {'message': 'Image not found'}, transform.ALLOWED_METHODS)
+        
+        print(f"Error transforming image: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        
+        return json_response(500, {
+            'message': 'Error transforming image',
+            'error': str(e)
+        }, transform.ALLOWED_METHODS)
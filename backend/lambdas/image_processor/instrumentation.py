@@ -0,0 +1,181 @@
+"""
+Per-image instrumentation for the Image Processor
+Records wall time per pipeline stage, byte and pixel counts and peak RSS, and
+emits one JSON line per image (CloudWatch Embedded Metric Format by default)
+or hands the record to a custom sink
+
+METRICS_MODE is read on every image so it can be switched without a redeploy
+of the code: 'emf' (default), 'json' (plain JSON line) or 'off'
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows, local runs only
+    resource = None
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ImageHub/ImageProcessor')
+
+STAGES = ('download', 'decode', 'placeholder', 'resize', 'watermark', 'flatten', 'encode', 'upload', 'copy')
+
+# Custom sink set with set_sink(), takes precedence over METRICS_MODE
+_sink = None
+
+
+def set_sink(sink):
+    """
+    Route metric records to sink(record) instead of stdout; None restores the default
+    """
+    global _sink
+    _sink = sink
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process in MB (shared by concurrent images)
+    """
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class ImageMetrics:
+    """
+    Metrics for one processed image
+    """
+
+    enabled = True
+
+    def __init__(self, source_key, mode):
+        self.source_key = source_key
+        self.mode = mode
+        self.stages = {}
+        self.counters = {}
+        self.properties = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a block of code; repeated stages (one per rendition) accumulate
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start)
+
+    def add(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.properties[name] = value
+
+    def timings(self):
+        """
+        Milliseconds spent in each stage that ran
+        """
+        return {f"{name.capitalize()}Ms": round(self.stages[name] * 1000, 3) for name in STAGES if name in self.stages}
+
+    def snapshot(self):
+        """
+        Stages, counters and properties recorded so far, for merge()
+        """
+        return {'stages': dict(self.stages), 'counters': dict(self.counters), 'properties': dict(self.properties)}
+
+    def merge(self, snapshot):
+        """
+        Add the metrics recorded elsewhere (a worker process) to this image
+        """
+        for name, value in snapshot['stages'].items():
+            self.stages[name] = self.stages.get(name, 0.0) + value
+        for name, value in snapshot['counters'].items():
+            self.add(name, value)
+        self.properties.update(snapshot['properties'])
+
+    def to_record(self):
+        record = {f"{name.capitalize()}Ms": round(self.stages.get(name, 0.0) * 1000, 3) for name in STAGES}
+        record['TotalMs'] = round((time.perf_counter() - self._start) * 1000, 3)
+        record.update(self.counters)
+        record['PeakRssMb'] = peak_rss_mb()
+        record.update(self.properties)
+        record['sourceKey'] = self.source_key
+        return record
+
+    def emit(self):
+        record = self.to_record()
+
+        if _sink is not None:
+            _sink(record)
+            return
+
+        if self.mode == 'emf':
+            metric_names = [name for name, value in record.items()
+                            if name != 'sourceKey' and isinstance(value, (int, float)) and not isinstance(value, bool)]
+            record['_aws'] = {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [[]],
+                    'Metrics': [{'Name': name, 'Unit': _unit(name)} for name in metric_names]
+                }]
+            }
+
+        print(json.dumps(record))
+
+
+class NullMetrics:
+    """
+    No-op metrics used when instrumentation is switched off
+    """
+
+    enabled = False
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def add(self, name, value):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def timings(self):
+        return {}
+
+    def snapshot(self):
+        return {'stages': {}, 'counters': {}, 'properties': {}}
+
+    def merge(self, snapshot):
+        pass
+
+    def emit(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def _unit(name):
+    if name.endswith('Ms'):
+        return 'Milliseconds'
+    if name.endswith('Bytes'):
+        return 'Bytes'
+    if name.endswith('Mb'):
+        return 'Megabytes'
+    return 'Count'
+
+
+def start_image(source_key):
+    """
+    Start collecting metrics for one image, or return NULL_METRICS when disabled
+    """
+    mode = os.environ.get('METRICS_MODE', 'emf').lower()
+    if mode == 'off' and _sink is None:
+        return NULL_METRICS
+    return ImageMetrics(source_key, mode)
@@ -0,0 +1,74 @@
+"""
+Completion records for the Image Processor
+When an upload finishes (or fails) a record keyed by its upload key is written
+to STATUS_TABLE, with the output keys and stage timings. get_processing_status
+long-polls that record, so clients learn about the result as soon as it exists
+instead of polling the CDN for the processed object
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from common import lazy_client, to_item
+
+STATUS_TABLE = os.environ.get('STATUS_TABLE', '')  # DynamoDB table (partition key: uploadKey), empty disables
+STATUS_TTL = int(os.environ.get('STATUS_TTL', str(24 * 60 * 60)))  # Records are only needed right after upload
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+dynamodb_client = lazy_client('dynamodb')
+
+
+def build_record(source_key, result=None, error=None, timings=None):
+    """
+    Completion record for source_key: the processing result, or the error
+    """
+    now = time.time()
+    record = {
+        'uploadKey': source_key,
+        'status': STATUS_FAILED if error else STATUS_DONE,
+        'completedAt': datetime.utcfromtimestamp(now).isoformat(),
+        'timings': timings or {},
+        'ttl': int(now) + STATUS_TTL
+    }
+
+    if error:
+        record['error'] = error
+        return record
+
+    record['processedKey'] = result['output_key']
+    record['renditions'] = []
+    for rendition in result['renditions']:
+        if not rendition['name']:
+            continue
+        entry = {'name': rendition['name'], 'format': rendition['format'], 'key': rendition['output_key']}
+        if rendition.get('size'):
+            entry['width'], entry['height'] = rendition['size']
+        record['renditions'].append(entry)
+    if result.get('placeholder'):
+        record['placeholder'] = result['placeholder']
+    return record
+
+
+def record_status(source_key, result=None, error=None, timings=None):
+    """
+    Write the completion record of one upload
+    Best effort: a failure is logged and never fails the image
+    Returns True when a record was written
+    """
+    if not STATUS_TABLE:
+        return False
+
+    record = build_record(source_key, result, error, timings)
+    try:
+        # Timings are floats, DynamoDB numbers must be Decimal
+        item = json.loads(json.dumps(record), parse_float=Decimal)
+        dynamodb_client.put_item(TableName=STATUS_TABLE, Item=to_item(item))
+    except Exception as e:
+        print(f"Error writing status for {source_key}: {str(e)}")
+        return False
+    return True
@@ -0,0 +1,85 @@
+"""
+EXIF orientation and metadata handling for the Image Processor
+Cameras store pixels in sensor order and record the rotation in the EXIF
+Orientation tag. The tag is read from the header before decoding and applied to
+the reduced image, so the transpose never runs at full resolution
+Outputs carry no EXIF/XMP by default (STRIP_METADATA)
+"""
+
+import os
+from PIL import Image
+
+# Remove EXIF/XMP/comments from outputs; when off the source EXIF is kept with
+# the orientation reset
+STRIP_METADATA = os.environ.get('STRIP_METADATA', 'true').lower() == 'true'
+
+ORIENTATION_TAG = 0x0112
+TRANSPOSE_METHODS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+# Orientations stored with width and height swapped
+SWAPPED_AXES = (5, 6, 7, 8)
+
+# image.info entries holding metadata blobs
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop')
+
+
+def get_orientation(image):
+    """
+    EXIF orientation of an opened image (1 when absent or invalid)
+    Only reads the header, the pixels are not decoded
+    """
+    # PNG getexif() decodes the whole image to reach an eXIf chunk stored after
+    # the pixel data; only one found in the header is used
+    if image.format == 'PNG' and 'exif' not in image.info:
+        return 1
+    try:
+        value = image.getexif().get(ORIENTATION_TAG, 1)
+    except Exception as e:
+        print(f"Ignoring unreadable EXIF: {str(e)}")
+        return 1
+    return value if value in TRANSPOSE_METHODS else 1
+
+
+def oriented_size(size, orientation):
+    """
+    Size after applying orientation (also converts back, the swap is symmetric)
+    """
+    return (size[1], size[0]) if orientation in SWAPPED_AXES else size
+
+
+def apply_orientation(image, orientation):
+    if orientation in TRANSPOSE_METHODS:
+        return image.transpose(TRANSPOSE_METHODS[orientation])
+    return image
+
+
+def has_metadata(image):
+    return any(image.info.get(key) for key in METADATA_KEYS)
+
+
+def output_exif(image):
+    """
+    EXIF to write into outputs: None when stripping, otherwise the source EXIF
+    with the orientation reset (the pixels are already rotated)
+    """
+    if STRIP_METADATA or not image.info.get('exif'):
+        return None
+    exif = image.getexif()
+    exif[ORIENTATION_TAG] = 1
+    return exif.tobytes()
+
+
+def strip_metadata(image):
+    """
+    Drop metadata blobs so no encoder copies them from image.info
+    """
+    for key in METADATA_KEYS:
+        image.info.pop(key, None)
+    return image
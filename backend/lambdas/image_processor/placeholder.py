@@ -0,0 +1,60 @@
+"""
+Low quality image placeholders (LQIP) for the Image Processor
+A placeholder is a tiny encoded thumbnail stored inline (as a data URI) in the
+history record, so the gallery can paint a blurred preview at the right aspect
+ratio before any rendition is downloaded
+"""
+
+import base64
+import os
+from io import BytesIO
+from PIL import Image
+
+import color
+
+# Longest side of the placeholder in pixels, 0 disables placeholders
+PLACEHOLDER_SIZE = int(os.environ.get('PLACEHOLDER_SIZE', '16'))
+# WebP keeps a 16px placeholder around 50-100 bytes (JPEG headers alone are ~300)
+PLACEHOLDER_FORMAT = os.environ.get('PLACEHOLDER_FORMAT', 'webp').lower()
+PLACEHOLDER_QUALITY = int(os.environ.get('PLACEHOLDER_QUALITY', '40'))
+
+MIME_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+def placeholder_size(size, longest=None):
+    """
+    Placeholder dimensions for an image of size, keeping the aspect ratio
+    """
+    longest = longest or PLACEHOLDER_SIZE
+    scale = longest / max(size)
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+
+def make_placeholder(image, source_size=None):
+    """
+    Encode a placeholder from a decoded, upright image (any resolution)
+    source_size is the original size when image was decoded reduced; it is
+    returned so clients can reserve the layout before loading renditions
+    Returns {'src': data URI, 'width': ..., 'height': ...}, or None when disabled
+    """
+    if PLACEHOLDER_SIZE <= 0:
+        return None
+    source_size = source_size or image.size
+
+    # reducing_gap box-reduces first, so this stays cheap from a large image
+    thumbnail = image.resize(placeholder_size(image.size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    if PLACEHOLDER_FORMAT == 'jpeg':
+        thumbnail = color.flatten(thumbnail)
+
+    output = BytesIO()
+    save_kwargs = {'format': PLACEHOLDER_FORMAT.upper()}
+    if PLACEHOLDER_FORMAT in ('webp', 'jpeg'):
+        save_kwargs['quality'] = PLACEHOLDER_QUALITY
+    thumbnail.save(output, **save_kwargs)
+
+    data = base64.b64encode(output.getvalue()).decode('ascii')
+    return {
+        'src': f"data:{MIME_TYPES[PLACEHOLDER_FORMAT]};base64,{data}",
+        'width': source_size[0],
+        'height': source_size[1]
+    }
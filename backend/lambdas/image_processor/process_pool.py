@@ -0,0 +1,247 @@
+"""
+Warm process pool for the Image Processor
+Lambda gives a function one vCPU per 1769MB of memory; encoding in worker
+processes lets the renditions of an image use all of them. Workers are spawned
+once per container and reused across invocations
+
+Lambda has no /dev/shm, so multiprocessing queues, semaphores and shared_memory
+are unavailable: each worker talks to the pool over its own Pipe, and decoded
+pixels are shared through a file in /tmp that workers map (see SharedImage)
+instead of being pickled with every task
+"""
+
+import importlib.util
+import mmap
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from PIL import Image
+
+# Worker processes: 'auto' (usable vCPUs), or a number (0 or 1 encodes in the calling thread)
+ENCODE_PROCESSES = os.environ.get('ENCODE_PROCESSES', 'auto')
+# Memory per vCPU on Lambda; a 512MB function gets a fraction of one
+LAMBDA_MB_PER_VCPU = 1769
+# Rows of pixels written to the shared file at a time
+SHARED_WRITE_ROWS = 256
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def worker_count():
+    """
+    Number of worker processes for ENCODE_PROCESSES
+    'auto' uses the CPUs available to the process, limited on Lambda to the
+    vCPUs its memory size buys (os.cpu_count() reports the host's)
+    """
+    if ENCODE_PROCESSES != 'auto':
+        return int(ENCODE_PROCESSES)
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    memory = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if memory:
+        cpus = min(cpus, max(1, int(memory) // LAMBDA_MB_PER_VCPU))
+    return cpus
+
+
+def get_pool():
+    """
+    Pool shared by every image of the container, started on first use
+    Returns None when fewer than two workers are configured
+    """
+    global _pool
+    processes = worker_count()
+    if processes < 2:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool.processes != processes:
+            if _pool is not None:
+                _pool.close()
+            _pool = ProcessPool(processes)
+        return _pool
+
+
+def shutdown():
+    """
+    Stop the shared pool (tests and local tools; Lambda keeps it warm)
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+class SharedImage:
+    """
+    Decoded pixels written once to a file in /tmp for workers to map
+    Use as a context manager; ref is the picklable handle passed to tasks
+    """
+
+    def __init__(self, image):
+        width, height = image.size
+        with tempfile.NamedTemporaryFile(prefix='pixels-', suffix='.raw', delete=False) as output:
+            # Written in bands so the raw copy never exists in memory at once
+            for top in range(0, height, SHARED_WRITE_ROWS):
+                output.write(image.crop((0, top, width, min(top + SHARED_WRITE_ROWS, height))).tobytes())
+        self.ref = (output.name, image.mode, image.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        os.remove(self.ref[0])
+
+
+def open_shared(ref):
+    """
+    Image for a SharedImage ref, read from the mapped file
+    """
+    path, mode, size = ref
+    with open(path, 'rb') as source:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        # frombuffer() would keep the mapping alive; one copy per task is bounded by the image
+        return Image.frombytes(mode, size, mapped, 'raw', mode)
+    finally:
+        mapped.close()
+
+
+def _resolve(function_ref):
+    """
+    Function for (module name, module file, qualified name); modules loaded
+    under an alias (the emulator loads handlers that way) are found by file
+    """
+    module_name, module_file, name = function_ref
+    module = sys.modules.get(module_name)
+    if module is None:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            spec = importlib.util.spec_from_file_location(module_name, module_file)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            spec.loader.exec_module(module)
+    return getattr(module, name)
+
+
+def _worker_loop(connection):
+    """
+    Run tasks received on connection until it closes or None is received
+    """
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        function_ref, args = message
+        try:
+            result = (True, _resolve(function_ref)(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            connection.send(result)
+        except Exception as e:
+            # Unpicklable result or exception
+            connection.send((False, RuntimeError(f"{type(e).__name__}: {str(e)}")))
+
+
+class WorkerError(RuntimeError):
+    """A worker process exited while running a task"""
+
+
+class ProcessPool:
+    """
+    Fixed set of spawned worker processes, each connected by a Pipe
+    Tasks are module-level functions and picklable arguments; callers from
+    several threads share the workers
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        # spawn: forking a process with running threads (MAX_WORKERS, boto3) is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        for _ in range(processes):
+            self._idle.put(self._start_worker())
+        # Threads waiting on the pipes, one per worker
+        self._executor = ThreadPoolExecutor(max_workers=processes)
+        print(f"Started {processes} encode worker processes")
+
+    def _start_worker(self):
+        parent_connection, child_connection = self._context.Pipe()
+        process = self._context.Process(target=_worker_loop, args=(child_connection,), daemon=True)
+        process.start()
+        child_connection.close()
+        return process, parent_connection
+
+    def run(self, function, *args):
+        """
+        Run function(*args) in the next idle worker and return its result
+        Exceptions raised by the function are re-raised here
+        """
+        module = sys.modules[function.__module__]
+        function_ref = (function.__module__, module.__file__, function.__qualname__)
+
+        worker = self._idle.get()
+        process, connection = worker
+        try:
+            connection.send((function_ref, args))
+            ok, result = connection.recv()
+        except (EOFError, OSError):
+            # Killed mid-task (out of memory): replace the worker, fail the task
+            process.join(timeout=1)
+            exitcode = process.exitcode
+            connection.close()
+            worker = self._start_worker()
+            raise WorkerError(f"Encode worker exited with code {exitcode}")
+        except BaseException:
+            # Unpicklable arguments, a result that cannot be rebuilt here or an
+            # interrupted wait: the worker may still be busy, so it is replaced
+            process.terminate()
+            process.join(timeout=1)
+            connection.close()
+            worker = self._start_worker()
+            raise
+        finally:
+            # Every worker taken goes back, otherwise run() and close() block forever
+            self._idle.put(worker)
+
+        if not ok:
+            raise result
+        return result
+
+    def imap_unordered(self, function, tasks):
+        """
+        Run function(*task) for every task in parallel, yielding results as they finish
+        Returns only after every task has ended, even when the caller stops early
+        """
+        futures = [self._executor.submit(self.run, function, *task) for task in tasks]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+    def close(self):
+        for _ in range(self.processes):
+            process, connection = self._idle.get()
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._executor.shutdown(wait=False)
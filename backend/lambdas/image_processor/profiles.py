@@ -0,0 +1,68 @@
+"""
+Processing profiles for the Image Processor
+A profile trades CPU for output quality in one name an upload can request
+(manifest field 'profile', names listed in common.manifest.PROFILES):
+
+    fast      box pre-shrink to the target, bilinear filter, no JPEG Huffman
+              optimization, baseline JPEG, zlib level 1 PNG, WebP method 1
+              (bulk imports and backfills)
+    balanced  the defaults: LANCZOS from at least REDUCING_GAP times the target,
+              optimized progressive JPEG, optimized PNG, WebP method 4
+    best      LANCZOS from at least 3 times the target, WebP method 6
+"""
+
+import os
+from PIL import Image
+
+# Profile of uploads that don't request one (and of uploads made before manifests)
+DEFAULT_PROFILE = os.environ.get('DEFAULT_PROFILE', 'balanced')
+
+# decode_gap: load_reduced() keeps at least this multiple of the target (None: REDUCING_GAP)
+# resize_gap: resize() box-reduces down to this multiple first (None: exact filter)
+# progressive: None follows PROGRESSIVE_JPEG
+# png_compress_level: None uses optimize=True (PNG_COMPRESS_LEVEL in adaptive mode)
+PROFILES = {
+    'fast': {
+        'resample': Image.Resampling.BILINEAR,
+        'decode_gap': 1.0,
+        'resize_gap': 1.0,
+        'jpeg_optimize': False,
+        'progressive': False,
+        'png_compress_level': 1,
+        'webp_method': 1
+    },
+    'balanced': {
+        'resample': Image.Resampling.LANCZOS,
+        'decode_gap': None,
+        'resize_gap': None,
+        'jpeg_optimize': True,
+        'progressive': None,
+        'png_compress_level': None,
+        'webp_method': 4
+    },
+    'best': {
+        'resample': Image.Resampling.LANCZOS,
+        'decode_gap': 3.0,
+        'resize_gap': None,
+        'jpeg_optimize': True,
+        'progressive': True,
+        'png_compress_level': None,
+        'webp_method': 6
+    }
+}
+
+
+# A typo would otherwise fail every record that doesn't request a profile
+if DEFAULT_PROFILE not in PROFILES:
+    raise ValueError(f"DEFAULT_PROFILE must be one of: {', '.join(PROFILES)} (got {DEFAULT_PROFILE!r})")
+
+
+def get_profile(name=None):
+    """
+    Settings of profile name (DEFAULT_PROFILE when None)
+    Raises ValueError for unknown names
+    """
+    try:
+        return PROFILES[name or DEFAULT_PROFILE]
+    except (KeyError, TypeError):
+        raise ValueError(f"profile must be one of: {', '.join(PROFILES)} (got {name!r})")
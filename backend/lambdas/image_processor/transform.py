@@ -0,0 +1,265 @@
+"""
+On-demand transforms for the Image Processor
+GET /img/{key}?w=&h=&fmt=&q= renders a processed image at another size or format
+(see handler.transform_handler). Each variant is stored once in the processed
+bucket under transforms/, so later requests, and CloudFront misses from other
+edges, are served from S3 without decoding anything
+
+Uploads expire from the source bucket after a few days, so variants are made from
+the processed object named by the key (no upscaling, watermark already applied)
+Processed keys are rewritten by later uploads of the same name and by backfills,
+so the variant key includes the processed object's ETag. The /img/ URL doesn't,
+so responses are cached briefly and revalidated by an ETag derived from the
+variant key (304 while the source is unchanged)
+
+Concurrent misses for one variant run in different Lambda containers; a lease in
+LEASE_TABLE lets one of them render while the others wait for the stored object
+"""
+
+import base64
+import hashlib
+import os
+import time
+import uuid
+from urllib.parse import unquote
+
+from botocore.exceptions import ClientError
+
+from common import cors_headers, lazy_client, manifest
+
+ALLOWED_METHODS = 'GET,OPTIONS'
+# Path the endpoint is routed on (CloudFront behavior / API route)
+PATH_PREFIX = '/img/'
+# Keys that can be transformed; transforms/ outputs are never a source
+SOURCE_PREFIX = os.environ.get('TRANSFORM_SOURCE_PREFIX', 'processed/')
+VARIANT_PREFIX = 'transforms/'
+MAX_KEY_LENGTH = 900  # Leaves room for the variant suffix within the 1024 byte S3 limit
+
+# Every accepted parameter combination is rendered and stored, so w/h and q are
+# limited to these steps (comma-separated), anything else is a 400
+SIZES = tuple(int(size) for size in os.environ.get(
+    'TRANSFORM_SIZES', '100,150,200,300,400,600,800,1000,1200,1600,2000,2400,3200,4000').split(','))
+QUALITIES = tuple(int(quality) for quality in os.environ.get('TRANSFORM_QUALITIES', '50,60,70,75,80,85,90,95').split(','))
+
+# DynamoDB table (partition key: variantKey) coalescing concurrent misses, empty disables
+LEASE_TABLE = os.environ.get('TRANSFORM_LEASE_TABLE', '')
+# A lease older than this is considered abandoned (renderer timed out or crashed)
+LEASE_SECONDS = int(os.environ.get('TRANSFORM_LEASE_SECONDS', '25'))
+POLL_INTERVAL = 0.05  # First re-read delay while another invocation renders, doubles up to POLL_INTERVAL_MAX
+POLL_INTERVAL_MAX = 0.5
+# Lambda responses are limited to 6MB and base64 adds a third; larger variants are redirected to
+INLINE_MAX_BYTES = int(os.environ.get('TRANSFORM_INLINE_MAX_BYTES', str(4 * 1024 * 1024)))
+# The URL outlives the source version it was rendered from; keep in line with the /img/* behavior TTLs
+CACHE_SECONDS = int(os.environ.get('TRANSFORM_CACHE_SECONDS', '300'))
+CACHE_CONTROL = f'public, max-age={CACHE_SECONDS}, must-revalidate'
+
+# Extensions of processed keys, for requests without fmt
+EXTENSION_FORMATS = {'jpg': 'jpeg', 'jpeg': 'jpeg', 'png': 'png', 'webp': 'webp'}
+
+dynamodb_client = lazy_client('dynamodb')
+
+
+def parse_request(path, params, default_quality):
+    """
+    Validate a transform request: path is /img/{key} (URL-encoded), params the
+    query string (w, h, fmt, q); w and h must be one of SIZES, q one of QUALITIES
+    A missing w or h leaves that side unbounded (outputs are never upscaled)
+    Returns (source_key, rendition); raises ValueError listing every problem
+    """
+    if not path or not path.startswith(PATH_PREFIX):
+        raise ValueError(f'path must start with {PATH_PREFIX}')
+
+    errors = []
+    key = unquote(path[len(PATH_PREFIX):])
+    if not key.startswith(SOURCE_PREFIX) or len(key) > MAX_KEY_LENGTH or '..' in key.split('/'):
+        errors.append(f'key must be a processed image key ({SOURCE_PREFIX}...)')
+
+    sizes = [size for size in SIZES if size <= manifest.MAX_DIMENSION]
+    allowed = {'w': sizes, 'h': sizes, 'q': QUALITIES}
+    values = {}
+    for name, choices in allowed.items():
+        value = params.get(name)
+        if value in (None, ''):
+            continue
+        if not value.isdigit() or int(value) not in choices:
+            errors.append(f'{name} must be one of: {", ".join(map(str, choices))}')
+        else:
+            values[name] = int(value)
+    if not params.get('w') and not params.get('h'):
+        errors.append('w or h is required')
+
+    output_format = params.get('fmt') or EXTENSION_FORMATS.get(key.rsplit('.', 1)[-1].lower(), 'jpeg')
+    if output_format not in manifest.FORMATS:
+        errors.append(f'fmt must be one of: {", ".join(manifest.FORMATS)}')
+
+    if errors:
+        raise ValueError('; '.join(errors))
+
+    rendition = {
+        'name': None,
+        'width': values.get('w', manifest.MAX_DIMENSION),
+        'height': values.get('h', manifest.MAX_DIMENSION),
+        'format': output_format,
+        'quality': values.get('q', default_quality)
+    }
+    return key, rendition
+
+
+def variant_prefix(source_key):
+    """
+    Prefix of every variant of source_key, whatever version it was rendered from
+    """
+    return f"{VARIANT_PREFIX}{source_key}/"
+
+
+def variant_key(source_key, version, rendition):
+    """
+    Processed bucket key of a variant; version (the source's ETag) and every
+    parameter are part of it so a variant is rendered once however often it is
+    requested, and again once the source object is replaced
+    """
+    return (f"{variant_prefix(source_key)}{version}/"
+            f"{rendition['width']}x{rendition['height']}_q{rendition['quality']}.{rendition['format']}")
+
+
+def acquire_lease(key):
+    """
+    Claim the right to render variant key
+    Returns the owner token to release the lease with when this invocation
+    should render it (also when leases are disabled), None while another
+    invocation holds an unexpired lease
+    """
+    owner = uuid.uuid4().hex
+    if not LEASE_TABLE:
+        return owner
+
+    now = int(time.time())
+    try:
+        dynamodb_client.put_item(
+            TableName=LEASE_TABLE,
+            Item={'variantKey': {'S': key}, 'expiresAt': {'N': str(now + LEASE_SECONDS)}, 'owner': {'S': owner}},
+            ConditionExpression='attribute_not_exists(variantKey) OR expiresAt < :now',
+            ExpressionAttributeValues={':now': {'N': str(now)}}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        # The lease only saves work, rendering without it is still correct
+        print(f"Error acquiring lease for {key}: {str(e)}")
+    return owner
+
+
+def release_lease(key, owner):
+    """
+    Delete the lease on key if owner still holds it; a render slower than
+    LEASE_SECONDS may have lost it to another invocation, whose lease stays
+    """
+    if not LEASE_TABLE:
+        return
+    try:
+        dynamodb_client.delete_item(
+            TableName=LEASE_TABLE,
+            Key={'variantKey': {'S': key}},
+            # owner is a reserved word
+            ConditionExpression='#owner = :owner',
+            ExpressionAttributeNames={'#owner': 'owner'},
+            ExpressionAttributeValues={':owner': {'S': owner}}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return
+        # Expires on its own after LEASE_SECONDS
+        print(f"Error releasing lease for {key}: {str(e)}")
+
+
+def single_flight(key, fetch, render, context=None):
+    """
+    Produce the missing variant key once across concurrent invocations
+    fetch(key) returns the stored variant or None, render() makes and stores it
+    The invocation holding the lease renders; the others re-read the variant with
+    exponential backoff and take the lease over when it is released or expires
+    without a result (the renderer failed). Waiting is bounded by half the
+    Lambda's remaining time, after which the variant is rendered regardless
+    Returns (variant, 'miss' when rendered here or 'coalesced')
+    """
+    wait = LEASE_SECONDS
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        wait = min(wait, context.get_remaining_time_in_millis() / 2000)
+    deadline = time.monotonic() + wait
+
+    interval = POLL_INTERVAL
+    waited = False
+    while True:
+        owner = acquire_lease(key)
+        if owner:
+            try:
+                # Stored by the previous holder since the last read
+                variant = fetch(key) if waited else None
+                if variant is not None:
+                    return variant, 'coalesced'
+                return render(), 'miss'
+            finally:
+                release_lease(key, owner)
+
+        if time.monotonic() >= deadline:
+            print(f"Gave up waiting for {key}, rendering it")
+            return render(), 'miss'
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        interval = min(interval * 2, POLL_INTERVAL_MAX)
+        waited = True
+
+        variant = fetch(key)
+        if variant is not None:
+            return variant, 'coalesced'
+
+
+def response_etag(key):
+    """
+    ETag of /img/ responses for variant key (which holds the source ETag and every parameter)
+    """
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def is_not_modified(headers, etag):
+    """
+    True when the request's If-None-Match already names etag
+    """
+    headers = {name.lower(): value for name, value in (headers or {}).items()}
+    tags = headers.get('if-none-match', '')
+    return tags.strip() == '*' or etag in (tag.strip().removeprefix('W/') for tag in tags.split(','))
+
+
+def cache_headers(etag, content_type=None):
+    headers = cors_headers(ALLOWED_METHODS, content_type)
+    headers['Cache-Control'] = CACHE_CONTROL
+    headers['ETag'] = etag
+    return headers
+
+
+def image_response(body, content_type, etag, status='hit'):
+    """
+    Binary proxy response (Lambda function URL or API Gateway with binary media types)
+    """
+    headers = cache_headers(etag, content_type)
+    headers['X-Transform-Cache'] = status
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def redirect_response(key, etag):
+    """
+    Redirect to a variant too large to return inline; relative, so it resolves
+    against the CloudFront distribution that serves the processed bucket
+    (the variant key is versioned, so the target itself can be cached for good)
+    """
+    headers = cache_headers(etag)
+    headers['Location'] = f'/{key}'
+    return {'statusCode': 302, 'headers': headers, 'body': ''}
+
+
+def not_modified_response(etag):
+    return {'statusCode': 304, 'headers': cache_headers(etag), 'body': ''}
@@ -1,17 +1,171 @@
 import json
-import boto3
 import os
-from datetime import datetime
+import random
+import time
+from datetime import datetime, timedelta
 from decimal import Decimal
 
-dynamodb = boto3.resource('dynamodb')
+from common import from_item, json_response, lazy_client, to_item
+
 table_name = os.environ.get('DYNAMODB_TABLE_NAME', 'ImageHistory')
-table = dynamodb.Table(table_name)
+# Dùng client cấp thấp (không qua resource), tự serialize item bằng common.to_item
+dynamodb_client = lazy_client('dynamodb')
+
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', '1000'))  # Số item tối đa mỗi request
+MAX_WRITE_ATTEMPTS = int(os.environ.get('MAX_WRITE_ATTEMPTS', '8'))  # Số lần gửi lại UnprocessedItems
+BACKOFF_BASE = 0.05  # giây
+BACKOFF_CAP = 2.0  # giây
+BATCH_WRITE_SIZE = 25  # Giới hạn của BatchWriteItem
+TTL_SECONDS = 90 * 24 * 60 * 60  # 90 ngày
+MAX_PLACEHOLDER_LENGTH = 4096  # Placeholder (data URI) lưu inline trong item, giữ item nhỏ
+MAX_TIMESTAMP_LENGTH = 64
+
+ALLOWED_METHODS = 'POST,OPTIONS'
+
+
+def convert_to_decimal(obj):
+    """
+    Convert float/int sang Decimal cho DynamoDB
+    Dùng json round-trip (parser viết bằng C) thay vì duyệt đệ quy bằng Python
+    """
+    return json.loads(json.dumps(obj), parse_float=Decimal, parse_int=Decimal)
+
+
+def validate_placeholder(placeholder):
+    """
+    Kiểm tra placeholder do image_processor tạo: {'src': data URI, 'width', 'height'}
+    """
+    if not isinstance(placeholder, dict):
+        raise ValueError('placeholder must be an object')
+    src = placeholder.get('src')
+    if not isinstance(src, str) or not src.startswith('data:image/') or len(src) > MAX_PLACEHOLDER_LENGTH:
+        raise ValueError(f'placeholder.src must be an image data URI of at most {MAX_PLACEHOLDER_LENGTH} characters')
+    if not all(isinstance(placeholder.get(name), int) and placeholder[name] > 0 for name in ('width', 'height')):
+        raise ValueError('placeholder width and height must be positive integers')
+    return {'src': src, 'width': placeholder['width'], 'height': placeholder['height']}
+
+
+def validate_timestamp(timestamp):
+    """
+    Kiểm tra timestamp do client gửi: chuỗi ISO-8601 như timestamp server tạo
+    (timestamp là sort key kiểu S, giá trị khác làm hỏng cả BatchWriteItem)
+    """
+    if not isinstance(timestamp, str) or len(timestamp) > MAX_TIMESTAMP_LENGTH:
+        raise ValueError('timestamp must be an ISO-8601 string')
+    try:
+        datetime.fromisoformat(timestamp)
+    except ValueError:
+        raise ValueError('timestamp must be an ISO-8601 string')
+    return timestamp
+
+
+def build_history_item(entry, timestamp, now):
+    """
+    Tạo item DynamoDB từ một entry lịch sử
+    """
+    user_id = entry.get('userId')
+    processed_key = entry.get('processedKey')
+    
+    if not user_id or not processed_key:
+        raise ValueError('userId and processedKey are required')
+    
+    item = {
+        'userId': user_id,
+        'timestamp': timestamp,
+        'originalKey': entry.get('originalKey') or '',
+        'processedKey': processed_key,
+        'metadata': convert_to_decimal(entry.get('metadata', {})),
+        'ttl': int(now.timestamp()) + TTL_SECONDS
+    }
+    # Ảnh xem trước siêu nhỏ để frontend hiển thị ngay khi chưa tải ảnh
+    if entry.get('placeholder'):
+        item['placeholder'] = convert_to_decimal(validate_placeholder(entry['placeholder']))
+    return item
+
+
+def write_history_items(items):
+    """
+    Ghi nhiều item bằng BatchWriteItem (25 item mỗi lần)
+    UnprocessedItems được gửi lại với exponential backoff + full jitter
+    Trả về danh sách item vẫn chưa ghi được sau MAX_WRITE_ATTEMPTS lần
+    """
+    failed = []
+    
+    for start in range(0, len(items), BATCH_WRITE_SIZE):
+        requests = [{'PutRequest': {'Item': to_item(item)}} for item in items[start:start + BATCH_WRITE_SIZE]]
+        attempt = 0
+        
+        while requests:
+            response = dynamodb_client.batch_write_item(RequestItems={table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not requests:
+                break
+            
+            attempt += 1
+            if attempt >= MAX_WRITE_ATTEMPTS:
+                failed.extend(from_item(request['PutRequest']['Item']) for request in requests)
+                break
+            
+            time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt))))
+    
+    return failed
+
+
+def save_history_batch(entries):
+    """
+    Lưu nhiều entry lịch sử trong một request
+    Entry không có timestamp được gán timestamp hiện tại cộng thêm vài micro giây
+    để các item của cùng một user không trùng khóa; timestamp do client gửi phải
+    là chuỗi ISO-8601, entry sai được trả về trong errors và không được ghi
+    """
+    if not isinstance(entries, list) or not entries:
+        return 400, {'error': 'items must be a non-empty list'}
+    
+    if len(entries) > MAX_BATCH_ITEMS:
+        return 400, {'error': f'at most {MAX_BATCH_ITEMS} items per request'}
+    
+    now = datetime.utcnow()
+    items = {}
+    errors = []
+    
+    for index, entry in enumerate(entries):
+        try:
+            if not isinstance(entry, dict):
+                raise ValueError('item must be an object')
+            if entry.get('timestamp') is not None:
+                timestamp = validate_timestamp(entry['timestamp'])
+            else:
+                timestamp = (now + timedelta(microseconds=index)).isoformat()
+            item = build_history_item(entry, timestamp, now)
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        
+        # BatchWriteItem không chấp nhận khóa trùng trong cùng một request
+        items[(item['userId'], item['timestamp'])] = item
+    
+    # Entry lỗi đã bị loại trước khi ghi; không còn entry hợp lệ thì không ghi gì
+    if not items:
+        return 400, {'error': 'no valid items', 'errors': errors}
+    
+    failed = write_history_items(list(items.values()))
+    
+    print(f"Saved {len(items) - len(failed)} history items, {len(errors)} invalid, {len(failed)} unprocessed")
+    
+    status_code = 200 if not errors and not failed else 207
+    return status_code, {
+        'message': 'Image history saved successfully' if status_code == 200 else 'Some items were not saved',
+        'saved': len(items) - len(failed),
+        'errors': errors,
+        'unprocessed': [{'userId': item['userId'], 'timestamp': item['timestamp']} for item in failed]
+    }
+
 
 def lambda_handler(event, context):
     """
     Lambda để lưu metadata ảnh vào DynamoDB
     Có thể gọi từ API Gateway hoặc từ Lambda khác
+    Body dạng {"items": [...]} sẽ được lưu theo batch
     """
     try:
         # Parse body nếu từ API Gateway
@@ -20,83 +174,46 @@ def lambda_handler(event, context):
         else:
             body = event
         
+        # Batch: nhiều entry trong một request
+        if 'items' in body:
+            status_code, response_body = save_history_batch(body['items'])
+            return json_response(status_code, response_body, ALLOWED_METHODS)
+        
         user_id = body.get('userId')
-        original_key = body.get('originalKey')
         processed_key = body.get('processedKey')
-        metadata = body.get('metadata', {})
         
         if not user_id or not processed_key:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'POST,OPTIONS'
-                },
-                'body': json.dumps({
-                    'error': 'userId and processedKey are required'
-                })
-            }
+            return json_response(400, {
+                'error': 'userId and processedKey are required'
+            }, ALLOWED_METHODS)
         
         # Tạo timestamp
-        timestamp = datetime.utcnow().isoformat()
-        
-        # Convert float/int to Decimal cho DynamoDB
-        def convert_to_decimal(obj):
-            if isinstance(obj, dict):
-                return {k: convert_to_decimal(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_to_decimal(item) for item in obj]
-            elif isinstance(obj, float) or isinstance(obj, int):
-                return Decimal(str(obj))
-            return obj
-        
-        metadata = convert_to_decimal(metadata)
+        now = datetime.utcnow()
+        timestamp = now.isoformat()
         
         # Tạo item
-        item = {
-            'userId': user_id,
-            'timestamp': timestamp,
-            'originalKey': original_key or '',
-            'processedKey': processed_key,
-            'metadata': metadata,
-            'ttl': int(datetime.utcnow().timestamp()) + (90 * 24 * 60 * 60)  # 90 ngày
-        }
+        try:
+            item = build_history_item(body, timestamp, now)
+        except ValueError as e:
+            return json_response(400, {
+                'error': str(e)
+            }, ALLOWED_METHODS)
         
         # Lưu vào DynamoDB
-        table.put_item(Item=item)
+        dynamodb_client.put_item(TableName=table_name, Item=to_item(item))
         
         print(f"Saved history for user {user_id} at {timestamp}")
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'POST,OPTIONS'
-            },
-            'body': json.dumps({
-                'message': 'Image history saved successfully',
-                'timestamp': timestamp
-            })
-        }
+        return json_response(200, {
+            'message': 'Image history saved successfully',
+            'timestamp': timestamp
+        }, ALLOWED_METHODS)
         
     except Exception as e:
         print(f"Error saving image history: {str(e)}")
         import traceback
         traceback.print_exc()
         
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'POST,OPTIONS'
-            },
-            'body': json.dumps({
-                'error': f'Failed to save image history: {str(e)}'
-            })
-        }
+        return json_response(500, {
+            'error': f'Failed to save image history: {str(e)}'
+        }, ALLOWED_METHODS)
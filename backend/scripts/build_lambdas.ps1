@@ -36,8 +36,13 @@ function Build-Lambda {
     }
     New-Item -ItemType Directory -Force -Path $BuildDir | Out-Null
     
-    # Copy Lambda code
-    Copy-Item (Join-Path $LambdaDir "handler.py") $BuildDir
+    # Copy Lambda code (handler.py and its sibling modules)
+    Copy-Item (Join-Path $LambdaDir "*.py") $BuildDir
+    
+    # Copy the shared runtime package (lazy AWS clients, responses)
+    $CommonDir = Join-Path $BuildDir "common"
+    New-Item -ItemType Directory -Force -Path $CommonDir | Out-Null
+    Copy-Item (Join-Path $BackendDir "lambdas\common\*.py") $CommonDir
     
     # Install dependencies if requirements.txt exists
     $RequirementsFile = Join-Path $LambdaDir "requirements.txt"
@@ -62,8 +67,13 @@ function Build-Lambda {
 # Build Image Processor Lambda
 Build-Lambda "image_processor"
 
-# Build Presigned URL Lambda
+# Build Presigned URL and Processing Status Lambdas
 Build-Lambda "get_presigned_url"
+Build-Lambda "get_processing_status"
+
+# Build Image History Lambdas
+Build-Lambda "save_image_history"
+Build-Lambda "get_image_history"
 
 Write-Host ""
 Write-Host "======================================" -ForegroundColor Cyan
@@ -31,8 +31,12 @@ build_lambda() {
     rm -f "$OUTPUT_ZIP"
     mkdir -p "$BUILD_DIR"
 
-    # Copy Lambda code
-    cp "$LAMBDA_DIR/handler.py" "$BUILD_DIR/"
+    # Copy Lambda code (handler.py and its sibling modules)
+    cp "$LAMBDA_DIR"/*.py "$BUILD_DIR/"
+
+    # Copy the shared runtime package (lazy AWS clients, responses)
+    mkdir -p "$BUILD_DIR/common"
+    cp "$BACKEND_DIR/lambdas/common"/*.py "$BUILD_DIR/common/"
 
     # Install dependencies if requirements.txt exists
     if [ -f "$LAMBDA_DIR/requirements.txt" ]; then
@@ -55,8 +59,13 @@ build_lambda() {
 # Build Image Processor Lambda
 build_lambda "image_processor"
 
-# Build Presigned URL Lambda
+# Build Presigned URL and Processing Status Lambdas
 build_lambda "get_presigned_url"
+build_lambda "get_processing_status"
+
+# Build Image History Lambdas
+build_lambda "save_image_history"
+build_lambda "get_image_history"
 
 echo ""
 echo "======================================"
@@ -0,0 +1,128 @@
+"""
+Measure Lambda cold-start cost locally
+Imports each handler in a fresh Python process (like a new Lambda container),
+reports the median import time, the slowest top-level imports (-X importtime)
+and, optionally, the time to create the AWS clients the handler uses
+
+Run: python measure_cold_start.py
+     python measure_cold_start.py --lambdas get_image_history --repeat 10 --clients
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAMBDAS_DIR = os.path.join(BACKEND_DIR, 'lambdas')
+
+LAMBDAS = ('image_processor', 'get_presigned_url', 'save_image_history', 'get_image_history')
+# Clients each function creates on its first request
+SERVICES = {
+    'image_processor': ('s3',),
+    'get_presigned_url': ('s3',),
+    'save_image_history': ('dynamodb',),
+    'get_image_history': ('dynamodb', 's3')
+}
+
+CHILD = '''
+import json, sys, time
+sys.path[:0] = [{lambda_dir!r}, {lambdas_dir!r}]
+start = time.perf_counter()
+import handler
+result = {{'import_ms': (time.perf_counter() - start) * 1000}}
+if {services!r}:
+    from common import client
+    start = time.perf_counter()
+    for service in {services!r}:
+        client(service)
+    result['clients_ms'] = (time.perf_counter() - start) * 1000
+print(json.dumps(result))
+'''
+
+
+def run_once(name, services, importtime=False):
+    """
+    Import one handler in a new interpreter; returns (timings, -X importtime output)
+    """
+    code = CHILD.format(lambda_dir=os.path.join(LAMBDAS_DIR, name), lambdas_dir=LAMBDAS_DIR, services=list(services))
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    # Keep instrumentation quiet and avoid writing .pyc files between runs
+    env['METRICS_MODE'] = 'off'
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    completed = subprocess.run(command, capture_output=True, text=True, env=env, cwd=BACKEND_DIR)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{name} failed to import:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def slowest_imports(importtime_output, top):
+    """
+    Top-level modules by cumulative import time (microseconds -> ms)
+    """
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        # Nesting is shown as two spaces per level; level 1 is what the handler imports directly
+        package = package[1:]
+        if (len(package) - len(package.lstrip())) // 2 == 1:
+            modules.append((int(cumulative) / 1000, package.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def measure(name, args):
+    services = SERVICES[name] if args.clients else ()
+    # One warm-up run so the OS file cache doesn't count against the first sample
+    run_once(name, services)
+
+    samples = [run_once(name, services)[0] for _ in range(args.repeat)]
+    _, importtime_output = run_once(name, (), importtime=True)
+
+    result = {
+        'lambda': name,
+        'repeat': args.repeat,
+        'import_ms': round(statistics.median(sample['import_ms'] for sample in samples), 2),
+        'slowest_imports': [{'module': module, 'ms': round(ms, 2)}
+                            for ms, module in slowest_imports(importtime_output, args.top)]
+    }
+    if services:
+        result['clients_ms'] = round(statistics.median(sample['clients_ms'] for sample in samples), 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start import time of the ImageHub Lambdas')
+    parser.add_argument('--lambdas', default=','.join(LAMBDAS), help='Functions to measure, comma separated')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per function (median is reported)')
+    parser.add_argument('--clients', action='store_true', help='Also time creating the AWS clients each function uses')
+    parser.add_argument('--top', type=int, default=5, help='Slowest imports to list per function')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for name in args.lambdas.split(','):
+        result = measure(name, args)
+        results.append(result)
+
+        line = f"{name:<20} import {result['import_ms']:8.2f} ms"
+        if 'clients_ms' in result:
+            line += f"   clients {result['clients_ms']:8.2f} ms"
+        print(line)
+        for entry in result['slowest_imports']:
+            print(f"    {entry['ms']:8.2f} ms  {entry['module']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,478 @@
+"""
+Re-render existing uploads offline (backfill)
+Lists a prefix of the source bucket, or a local directory laid out like one,
+and runs every upload through image_processor again: the manifest or the key
+format gives the settings (get_job_metadata / get_image_metadata), optionally
+overridden, and every rendition is written back under its processed/ key
+
+Encoding runs in a pool of worker processes; this process lists, prefetches
+sources and uploads outputs on threads, so an in-memory S3 stand-in works too.
+Progress is checkpointed to a JSON file (the last key before which everything
+is done) and a rerun with the same --checkpoint resumes after it
+
+Re-rendered objects keep their keys: CloudFront serves the old bytes until they
+expire or are invalidated. Their on-demand transform variants (transforms/) are deleted
+
+Run: python reprocess.py s3://imagehub-source-images/uploads/ s3://imagehub-processed-images --watermark ImageHub
+     python reprocess.py ./corpus ./out --workers 4 --rate 20 --checkpoint backfill.json --profile fast
+"""
+
+import argparse
+import collections
+import importlib.util
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PROCESSOR_DIR = os.path.join(BACKEND_DIR, 'lambdas', 'image_processor')
+sys.path.insert(0, PROCESSOR_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'lambdas'))
+
+# The worker pool is the parallelism; the processor's own pool, dedup cache,
+# metrics and history are for Lambda
+os.environ.setdefault('ENCODE_PROCESSES', '0')
+os.environ.setdefault('DEDUP_CACHE', 'none')
+os.environ.setdefault('METRICS_MODE', 'off')
+os.environ['HISTORY_FUNCTION_NAME'] = ''
+
+
+def _load_processor():
+    # Loaded by path: other Lambdas' handler.py may be importable as 'handler'
+    spec = importlib.util.spec_from_file_location('reprocess_image_processor', os.path.join(PROCESSOR_DIR, 'handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+processor = _load_processor()
+
+CACHE_CONTROL = 'max-age=31536000'  # Same as image_processor uploads
+# Seconds between checkpoint writes
+CHECKPOINT_INTERVAL = 5
+
+
+class LocalStore:
+    """
+    Directory whose files are addressed by their relative path with '/' separators
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def __str__(self):
+        return self.root
+
+    def list(self, prefix='', after=None):
+        """
+        Keys under prefix after the key after, in S3 (lexicographic) order,
+        walking the tree lazily
+        """
+        def walk(directory, base):
+            entries = []
+            with os.scandir(directory) as scan:
+                for entry in scan:
+                    if entry.is_dir():
+                        entries.append((f"{base}{entry.name}/", entry.path, True))
+                    elif entry.is_file():
+                        entries.append((f"{base}{entry.name}", entry.path, False))
+            for key, path, is_dir in sorted(entries):
+                if is_dir:
+                    # Only subtrees that can hold keys under prefix and after after
+                    if ((key.startswith(prefix) or prefix.startswith(key))
+                            and (after is None or key > after or after.startswith(key))):
+                        yield from walk(path, key)
+                elif key.startswith(prefix) and (after is None or key > after):
+                    yield key
+
+        if os.path.isdir(self.root):
+            yield from walk(self.root, '')
+
+    def read(self, key):
+        """
+        Returns (bytes, user metadata); local files have no metadata
+        """
+        with open(os.path.join(self.root, *key.split('/')), 'rb') as f:
+            return f.read(), {}
+
+    def write(self, key, data, content_type):
+        path = os.path.join(self.root, *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def delete_prefix(self, prefix):
+        """
+        Remove every key under prefix, a directory ending in '/'
+        """
+        shutil.rmtree(os.path.join(self.root, *prefix.rstrip('/').split('/')), ignore_errors=True)
+
+
+class S3Store:
+    """
+    S3 bucket through a boto3 client (or emulator.FakeS3Client)
+    """
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def __str__(self):
+        return f"s3://{self.bucket}"
+
+    def list(self, prefix='', after=None):
+        """
+        Keys under prefix after the key after, one listing page at a time
+        """
+        params = {'Bucket': self.bucket, 'Prefix': prefix}
+        if after:
+            params['StartAfter'] = after
+        while True:
+            response = self.client.list_objects_v2(**params)
+            for entry in response.get('Contents', []):
+                yield entry['Key']
+            if not response.get('IsTruncated'):
+                return
+            params['ContinuationToken'] = response['NextContinuationToken']
+
+    def read(self, key):
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
+        return response['Body'].read(), response.get('Metadata', {})
+
+    def write(self, key, data, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type,
+                               CacheControl=CACHE_CONTROL)
+
+    def delete_prefix(self, prefix):
+        for key in list(self.list(prefix)):
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+def open_store(location, client=None):
+    """
+    Store for s3://bucket[/prefix] or a directory; returns (store, prefix)
+    client replaces the default boto3 S3 client (e.g. emulator.FakeS3Client)
+    """
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        if client is None:
+            from common import client as aws_client
+            client = aws_client('s3')
+        return S3Store(client, bucket), prefix
+    return LocalStore(location), ''
+
+
+class RateLimiter:
+    """
+    Spaces calls to wait() so they average at most rate per second (0: unlimited)
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(self.next_time, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Checkpoint:
+    """
+    Resumable progress over keys handled in listing order but completed in any order
+    after is the last key before which every key is done; a resumed run lists
+    after it. Keys still in flight when the run stops are processed again
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.after = None
+        self.done = 0
+        self.failed = {}
+        self._in_flight = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._saved_at = time.monotonic()
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state['source'] != source:
+                raise ValueError(f"Checkpoint {path} is for {state['source']}, not {source}")
+            self.after = state['after']
+            self.done = state['done']
+            self.failed = state['failed']
+
+    def start(self, key):
+        with self._lock:
+            self._in_flight[key] = False
+
+    def finish(self, key, error=None):
+        with self._lock:
+            self._in_flight[key] = True
+            self.done += 1
+            if error:
+                self.failed[key] = error
+            else:
+                self.failed.pop(key, None)
+            while self._in_flight and next(iter(self._in_flight.values())):
+                self.after, _ = self._in_flight.popitem(last=False)
+        if time.monotonic() - self._saved_at >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = {
+                'source': self.source,
+                'after': self.after,
+                'done': self.done,
+                'failed': dict(self.failed),
+                'updatedAt': datetime.now(timezone.utc).isoformat()
+            }
+            self._saved_at = time.monotonic()
+            # Replaced atomically so an interrupted write never loses the previous state
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+
+
+class Progress:
+    """
+    Throughput counters, printed every interval seconds
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.images = 0
+        self.failed = 0
+        self.renditions = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._reported_at = self.start
+        self._lock = threading.Lock()
+
+    def add(self, bytes_in, outputs, error):
+        with self._lock:
+            self.images += 1
+            self.failed += 1 if error else 0
+            self.renditions += len(outputs)
+            self.bytes_in += bytes_in
+            self.bytes_out += sum(len(data) for _, _, data in outputs)
+            report = self.interval and time.perf_counter() - self._reported_at >= self.interval
+            if report:
+                self._reported_at = time.perf_counter()
+        if report:
+            print(self.line())
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            'images': self.images,
+            'failed': self.failed,
+            'renditions': self.renditions,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'elapsed_s': round(elapsed, 3),
+            'images_per_sec': round(self.images / elapsed, 2) if elapsed else None
+        }
+
+    def line(self):
+        summary = self.summary()
+        elapsed = summary['elapsed_s'] or 1
+        return (f"{summary['images']} images ({summary['failed']} failed), {summary['renditions']} renditions, "
+                f"{summary['images_per_sec']} images/s, {summary['bytes_in'] / elapsed / 1e6:.2f} MB/s in, "
+                f"{summary['bytes_out'] / elapsed / 1e6:.2f} MB/s out")
+
+
+def render_job(job):
+    """
+    Worker: render every rendition of one source
+    job is (key, data, metadata, output_name)
+    Returns (key, [(output key, content type, bytes)], error message or None)
+    """
+    key, data, metadata, output_name = job
+    outputs = []
+    try:
+        for _, rendition, output in processor.process_renditions(data, metadata):
+            with output:
+                output_key = processor.get_output_key(key, rendition, output_name)
+                content_type = processor.CONTENT_TYPES.get(rendition['format'].lower(), 'image/jpeg')
+                outputs.append((output_key, content_type, output.read()))
+    except Exception as e:
+        return key, [], f"{type(e).__name__}: {str(e)}"
+    return key, outputs, None
+
+
+def backfill(source, dest, prefix='', workers=0, prefetch=None, rate=0, overrides=None, checkpoint_path=None,
+             limit=None, report_interval=10, io_threads=8):
+    """
+    Reprocess every key under prefix of the source store into dest
+    workers: encoding processes (0 encodes in this process); prefetch: sources
+    downloaded ahead of the encoders (default twice the workers); rate: images
+    started per second (0: unlimited); limit: stop after that many images;
+    overrides replace fields of each upload's metadata (watermark, quality, profile)
+    Returns the progress summary with the checkpoint position
+    """
+    overrides = overrides or {}
+    checkpoint = Checkpoint(checkpoint_path, f"{source}/{prefix}")
+    progress = Progress(report_interval)
+    limiter = RateLimiter(rate)
+    prefetch = prefetch or max(2, workers * 2)
+    bucket = getattr(source, 'bucket', None)
+    if checkpoint.after:
+        print(f"Resuming after {checkpoint.after} ({checkpoint.done} done)")
+
+    def fetch(key):
+        data, object_metadata = source.read(key)
+        metadata, output_name = processor.get_job_metadata(bucket, key, object_metadata)
+        metadata.update(overrides)
+        return key, data, metadata, output_name
+
+    def store(result, size):
+        key, outputs, error = result
+        if error is None:
+            try:
+                for output_key, content_type, data in outputs:
+                    dest.write(output_key, data, content_type)
+            except Exception as e:
+                error = f"Upload failed: {str(e)}"
+        if error is None:
+            # Variants of the old outputs are keyed by their ETag and can't be served anymore
+            try:
+                for output_key, _, _ in outputs:
+                    dest.delete_prefix(processor.transform.variant_prefix(output_key))
+            except Exception as e:
+                print(f"Error deleting transform variants of {key}: {str(e)}")
+        if error:
+            print(f"Failed {key}: {error}")
+        progress.add(size, outputs, error)
+        checkpoint.finish(key, error)
+
+    keys = source.list(prefix, checkpoint.after)
+    if limit:
+        keys = (key for _, key in zip(range(limit), keys))
+
+    # Sidecar manifests are read through the processor's S3 client
+    from common import aws
+    replaced = aws.set_client('s3', source.client) if isinstance(source, S3Store) else None
+    # spawn: forking with the io threads running is unsafe
+    encoders = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) if workers else None
+    io_pool = ThreadPoolExecutor(io_threads)
+    downloads = collections.deque()
+    encoding = {}
+    uploads = set()
+
+    def collect(block):
+        # Hand finished encodes to the io threads, surface errors of finished uploads
+        if block:
+            wait(encoding, return_when=FIRST_COMPLETED)
+        for future in [future for future in encoding if future.done()]:
+            uploads.add(io_pool.submit(store, future.result(), encoding.pop(future)))
+        for future in [future for future in uploads if future.done()]:
+            uploads.discard(future)
+            future.result()
+
+    try:
+        while True:
+            # Listing is lazy: only prefetch keys ahead of the encoders are listed and downloading
+            while len(downloads) < prefetch:
+                key = next(keys, None)
+                if key is None:
+                    break
+                limiter.wait()
+                checkpoint.start(key)
+                downloads.append((key, io_pool.submit(fetch, key)))
+            if not downloads and not encoding:
+                break
+
+            if downloads and len(encoding) < max(workers, 1):
+                key, download = downloads.popleft()
+                try:
+                    job = download.result()
+                except Exception as e:
+                    uploads.add(io_pool.submit(store, (key, [], f"Download failed: {str(e)}"), 0))
+                    continue
+                if encoders is None:
+                    uploads.add(io_pool.submit(store, render_job(job), len(job[1])))
+                else:
+                    encoding[encoders.submit(render_job, job)] = len(job[1])
+                collect(block=False)
+            else:
+                collect(block=True)
+
+        wait(uploads)
+        collect(block=False)
+    except KeyboardInterrupt:
+        print("Interrupted, saving checkpoint")
+        raise
+    finally:
+        io_pool.shutdown(wait=True, cancel_futures=True)
+        if encoders is not None:
+            encoders.shutdown(wait=True, cancel_futures=True)
+        if isinstance(source, S3Store):
+            aws.set_client('s3', replaced)
+        checkpoint.save()
+
+    print(progress.line())
+    return dict(progress.summary(), after=checkpoint.after, failed_keys=sorted(checkpoint.failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-render existing ImageHub uploads')
+    parser.add_argument('source', help='s3://bucket/prefix or a directory of uploads')
+    parser.add_argument('dest', help='s3://bucket or a directory receiving processed/ keys')
+    parser.add_argument('--prefix', default='', help='Only keys under this prefix (appended to an S3 source prefix)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Encoding processes (0: in process)')
+    parser.add_argument('--prefetch', type=int, help='Sources downloaded ahead of the encoders (default 2 x workers)')
+    parser.add_argument('--rate', type=float, default=0, help='Images started per second (0: unlimited)')
+    parser.add_argument('--limit', type=int, help='Stop after this many images')
+    parser.add_argument('--checkpoint', help='JSON file to resume from and record progress in')
+    parser.add_argument('--report-interval', type=float, default=10, help='Seconds between throughput lines')
+    parser.add_argument('--watermark', help="Replace the watermark text, 'none' to remove it")
+    parser.add_argument('--quality', type=int, help='Replace the output quality')
+    parser.add_argument('--profile', choices=processor.manifest.PROFILES,
+                        help='Processing profile (fast is cheapest for bulk runs)')
+    parser.add_argument('--output', help='Write the JSON summary to this file')
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.watermark is not None:
+        overrides['watermark'] = None if args.watermark.lower() == 'none' else args.watermark
+    if args.quality is not None:
+        overrides['quality'] = args.quality
+    if args.profile:
+        overrides['profile'] = args.profile
+
+    source, prefix = open_store(args.source)
+    dest, _ = open_store(args.dest)
+    print(f"Reprocessing {source}/{prefix + args.prefix} into {dest} with {args.workers} workers")
+    summary = backfill(source, dest, prefix + args.prefix, args.workers, args.prefetch, args.rate, overrides,
+                       args.checkpoint, args.limit, args.report_interval)
+    if summary['failed_keys']:
+        print(f"{len(summary['failed_keys'])} failed (listed in the checkpoint)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
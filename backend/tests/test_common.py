@@ -0,0 +1,94 @@
+"""
+Local testing script for the shared Lambda runtime package
+Run: python test_common.py
+"""
+
+import json
+import sys
+import os
+from decimal import Decimal
+
+# Add lambdas directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas'))
+
+import common.aws
+from common import from_item, json_response, lazy_client, to_item
+
+
+def test_item_round_trip():
+    """Test conversion between Python values and DynamoDB AttributeValues"""
+    print("Testing item conversion...")
+
+    values = {
+        'userId': 'u1',
+        'width': Decimal('800'),
+        'ratio': Decimal('1.5'),
+        'metadata': {'watermark': None, 'tags': ['a', Decimal('2')], 'public': True}
+    }
+    item = to_item(values)
+
+    assert item['userId'] == {'S': 'u1'}
+    assert item['width'] == {'N': '800'}
+    assert item['metadata']['M']['tags'] == {'L': [{'S': 'a'}, {'N': '2'}]}
+    assert item['metadata']['M']['watermark'] == {'NULL': True}
+    assert from_item(item) == values
+
+    try:
+        to_item({'ratio': 1.5})
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("Expected TypeError for float")
+
+    print("✓ Item conversion test passed")
+
+
+def test_json_response_and_lazy_client():
+    """Test the response builder and deferred client creation"""
+    print("Testing response builder and lazy clients...")
+
+    response = json_response(200, {'count': Decimal('2'), 'ratio': Decimal('0.5')}, 'POST,OPTIONS',
+                             multi_value_headers={'Set-Cookie': ['a=1']})
+    assert response['statusCode'] == 200
+    assert response['headers']['Access-Control-Allow-Methods'] == 'POST,OPTIONS'
+    assert response['headers']['Content-Type'] == 'application/json'
+    assert json.loads(response['body']) == {'count': 2, 'ratio': 0.5}
+    assert response['multiValueHeaders'] == {'Set-Cookie': ['a=1']}
+
+    class FakeClient:
+        def head_object(self, **kwargs):
+            return kwargs
+
+    # Creating the proxy doesn't build a client; the first call uses the shared one
+    proxy = lazy_client('s3')
+    cache_key = ('s3', repr([]))
+    assert cache_key not in common.aws._clients
+    common.aws._clients[cache_key] = FakeClient()
+    try:
+        assert proxy.head_object(Bucket='b') == {'Bucket': 'b'}
+    finally:
+        del common.aws._clients[cache_key]
+
+    print("✓ Response builder and lazy client test passed")
+
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("Testing Shared Lambda Runtime")
+    print("=" * 50)
+    print()
+
+    try:
+        test_item_round_trip()
+        test_json_response_and_lazy_client()
+
+        print()
+        print("=" * 50)
+        print("✓ All tests passed!")
+        print("=" * 50)
+    except Exception as e:
+        print()
+        print("=" * 50)
+        print(f"✗ Test failed: {str(e)}")
+        print("=" * 50)
+        raise
@@ -0,0 +1,255 @@
+"""
+Local testing script for the end-to-end pipeline emulator
+Run: python test_emulator.py
+"""
+
+import base64
+import json
+import sys
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+# Add backend and lambdas directories to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../scripts'))
+
+from emulator import FakeDynamoDBClient, FakeS3Client, Pipeline
+from common import from_item, to_item
+from PIL import Image
+
+
+def make_image_bytes(size=(1200, 900), color=(200, 80, 40)):
+    """Create an encoded test image"""
+    output = BytesIO()
+    Image.new('RGB', size, color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+def test_fake_dynamodb_query():
+    """Test key conditions, paging and projection of the DynamoDB fake"""
+    print("Testing DynamoDB fake...")
+    
+    dynamodb = FakeDynamoDBClient(tables={'History': ('userId', 'timestamp')})
+    for day in range(1, 6):
+        dynamodb.put_item(TableName='History', Item=to_item({'userId': 'u1', 'timestamp': f'2024-01-0{day}', 'n': day}))
+    dynamodb.put_item(TableName='History', Item=to_item({'userId': 'u2', 'timestamp': '2024-01-01', 'n': 0}))
+    
+    query = {
+        'TableName': 'History',
+        'KeyConditionExpression': '#pk = :userId AND #sk BETWEEN :from AND :to',
+        'ExpressionAttributeNames': {'#pk': 'userId', '#sk': 'timestamp', '#f0': 'n'},
+        'ExpressionAttributeValues': {':userId': {'S': 'u1'}, ':from': {'S': '2024-01-02'}, ':to': {'S': '2024-01-05'}},
+        'ScanIndexForward': False,
+        'Limit': 3
+    }
+    first = dynamodb.query(**query)
+    assert [from_item(item)['n'] for item in first['Items']] == [5, 4, 3]
+    second = dynamodb.query(**dict(query, ExclusiveStartKey=first['LastEvaluatedKey'], ProjectionExpression='#f0'))
+    assert [from_item(item) for item in second['Items']] == [{'n': 2}]
+    assert 'LastEvaluatedKey' not in second
+    
+    print("✓ DynamoDB fake test passed")
+
+
+def test_pipeline_end_to_end():
+    """Test presign -> upload -> process -> status / save history -> get history"""
+    print("Testing end-to-end pipeline...")
+    
+    with Pipeline() as pipeline:
+        uploads = [
+            pipeline.upload(make_image_bytes(color=(i * 40, 80, 40)), f'photo {i}.jpg', user_id='user-1',
+                            width=400, height=300, format='webp', watermark='Demo_1')
+            for i in range(3)
+        ]
+        assert pipeline.status(uploads[0]['key']) == (202, {'key': uploads[0]['key'], 'status': 'pending'})
+        response = pipeline.process([upload['key'] for upload in uploads])
+        pipeline.drain()
+        items = pipeline.history('user-1', limit='2')
+        status_code, status = pipeline.status(uploads[0]['key'], wait=1)
+    
+    assert response['statusCode'] == 200
+    assert status_code == 200 and status['status'] == 'done'
+    assert status['processedKey'] == uploads[0]['processedKey']
+    assert sorted(item['processedKey'] for item in items) == sorted(upload['processedKey'] for upload in uploads)
+    assert all(item['processedUrl'] for item in items)
+    
+    output = Image.open(BytesIO(pipeline.s3.objects[(pipeline.processed_bucket, uploads[0]['processedKey'])]['Body']))
+    assert (output.format, output.size) == ('WEBP', (400, 300))
+    assert len(pipeline.metrics) == 3
+    assert pipeline.lambda_client.errors == []
+    
+    print("✓ End-to-end pipeline test passed")
+
+
+def test_pipeline_batch_multipart():
+    """Test a batch presign where the large file is uploaded in parts"""
+    print("Testing batch upload with multipart...")
+    
+    large = make_image_bytes(color=(10, 120, 200))
+    small = make_image_bytes(color=(200, 120, 10))
+    env = {'MULTIPART_THRESHOLD': str(len(large)), 'MULTIPART_PART_SIZE': str(len(large) // 3 + 1)}
+    with Pipeline(env=env) as pipeline:
+        uploads = pipeline.request_uploads([
+            {'filename': 'large.jpg', 'contentType': 'image/jpeg', 'size': len(large)},
+            {'filename': 'small.jpg', 'contentType': 'image/jpeg', 'size': len(small)},
+        ], user_id='user-2', width=200, height=150, format='jpeg')
+        for upload, data in zip(uploads, (large, small)):
+            pipeline.put(upload, data)
+        response = pipeline.process([upload['key'] for upload in uploads])
+        pipeline.drain()
+        items = pipeline.history('user-2')
+    
+    assert len(uploads[0]['multipart']['parts']) == 3 and 'multipart' not in uploads[1]
+    assert pipeline.s3.objects[(pipeline.source_bucket, uploads[0]['key'])]['Body'] == large
+    assert response['statusCode'] == 200
+    assert sorted(item['processedKey'] for item in items) == ['processed/large.jpeg', 'processed/small.jpeg']
+    
+    print("✓ Batch multipart test passed")
+
+
+def test_transform_single_flight():
+    """Test that concurrent misses of one variant render it once, then S3 serves it"""
+    print("Testing on-demand transforms...")
+    
+    with Pipeline(s3_latency=0.01) as pipeline:
+        upload = pipeline.upload(make_image_bytes(), 'photo.jpg', width=800, height=600, format='jpeg')
+        pipeline.process([upload['key']])
+        puts = pipeline.s3.calls['put_object']
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(lambda _: pipeline.transform(upload['processedKey'], w=200, fmt='webp'), range(4)))
+        again = pipeline.transform(upload['processedKey'], w=200, fmt='webp')
+        renders = pipeline.s3.calls['put_object'] - puts
+        invalid = pipeline.transform(upload['processedKey'], w=0, fmt='gif')
+        # Only the allowed steps are rendered
+        off_step = pipeline.transform(upload['processedKey'], w=250, q=83)
+        missing = pipeline.transform('processed/missing.jpg', w=200)
+        
+        import transform
+        transform.INLINE_MAX_BYTES, inline_max = 0, transform.INLINE_MAX_BYTES
+        try:
+            redirect = pipeline.transform(upload['processedKey'], w=300)
+        finally:
+            transform.INLINE_MAX_BYTES = inline_max
+        etag = pipeline.s3.objects[(pipeline.env['PROCESSED_BUCKET'], upload['processedKey'])]['ETag'].strip('"')
+        
+        # Uploading another photo.jpg replaces processed/photo.jpeg: its variants are rendered again
+        replaced = pipeline.upload(make_image_bytes(color=(40, 80, 200)), 'photo.jpg', width=800, height=600, format='jpeg')
+        pipeline.process([replaced['key']])
+        changed = pipeline.transform(replaced['processedKey'], w=200, fmt='webp')
+        # Edges revalidate with the ETag once CACHE_SECONDS have passed
+        unchanged = pipeline.transform(replaced['processedKey'], headers={'If-None-Match': changed['headers']['ETag']},
+                                       w=200, fmt='webp')
+        outdated = pipeline.transform(replaced['processedKey'], headers={'if-none-match': again['headers']['ETag']},
+                                      w=200, fmt='webp')
+        
+        # A renderer slower than the lease doesn't release the lease taken over from it
+        leases = pipeline.dynamodb.tables[pipeline.env['TRANSFORM_LEASE_TABLE']]
+        slow = transform.acquire_lease('transforms/slow')
+        assert transform.acquire_lease('transforms/slow') is None
+        for lease in leases.values():
+            lease['expiresAt'] = {'N': '0'}
+        taken_over = transform.acquire_lease('transforms/slow')
+        transform.release_lease('transforms/slow', slow)
+        held = [lease['owner']['S'] for lease in leases.values()]
+        transform.release_lease('transforms/slow', taken_over)
+    
+    assert [response['statusCode'] for response in responses] == [200] * 4
+    assert sorted(response['headers']['X-Transform-Cache'] for response in responses).count('miss') == 1
+    variant = Image.open(BytesIO(base64.b64decode(responses[0]['body'])))
+    assert (variant.format, variant.size) == ('WEBP', (200, 150))
+    
+    # The variant was stored once; the repeat is an S3 hit
+    assert renders == 1
+    assert again['headers']['X-Transform-Cache'] == 'hit' and again['body'] == responses[0]['body']
+    assert invalid['statusCode'] == 400 and missing['statusCode'] == 404
+    errors = json.loads(off_step['body'])['errors'][0]
+    assert off_step['statusCode'] == 400 and 'w must be one of' in errors and 'q must be one of' in errors
+    assert redirect['statusCode'] == 302
+    assert redirect['headers']['Location'] == f"/transforms/{upload['processedKey']}/{etag}/300x4000_q85.jpeg"
+    assert replaced['processedKey'] == upload['processedKey']
+    assert changed['headers']['X-Transform-Cache'] == 'miss' and changed['body'] != responses[0]['body']
+    assert changed['headers']['ETag'] != again['headers']['ETag']
+    assert unchanged['statusCode'] == 304 and unchanged['headers']['ETag'] == changed['headers']['ETag']
+    assert outdated['statusCode'] == 200 and outdated['body'] == changed['body']
+    assert again['headers']['Cache-Control'] == 'public, max-age=300, must-revalidate'
+    assert slow and taken_over and held == [taken_over]
+    assert pipeline.dynamodb.tables[pipeline.env['TRANSFORM_LEASE_TABLE']] == {}
+    
+    print("✓ Transform single-flight test passed")
+
+
+def test_reprocess_resume():
+    """Test the backfill CLI against the S3 fake and a local directory, resuming from a checkpoint"""
+    print("Testing reprocess backfill...")
+    
+    import reprocess
+    s3 = FakeS3Client()
+    keys = [f'uploads/169988923{i}_400x300_85_jpeg_none_photo{i}.jpg' for i in range(5)]
+    for index, key in enumerate(keys):
+        s3.put_object(Bucket='source', Key=key, Body=make_image_bytes(color=(index * 50, 80, 40)))
+    s3.put_object(Bucket='source', Key='uploads/1699889239_400x300_85_jpeg_none_broken.jpg', Body=b'not an image')
+    source, dest = reprocess.S3Store(s3, 'source'), reprocess.S3Store(s3, 'processed')
+    # Variants of a re-rendered output are deleted with it
+    s3.put_object(Bucket='processed', Key='transforms/processed/photo4.jpeg/0123/200x4000_q85.jpeg', Body=b'old')
+    
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = os.path.join(directory, 'checkpoint.json')
+        first = reprocess.backfill(source, dest, 'uploads/', limit=3, checkpoint_path=checkpoint, report_interval=0)
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        second = reprocess.backfill(source, dest, 'uploads/', overrides={'watermark': 'Backfill'}, rate=100,
+                                    checkpoint_path=checkpoint, report_interval=0)
+        
+        # The same corpus from a directory, encoded in worker processes
+        for key in keys[:2]:
+            os.makedirs(os.path.join(directory, 'corpus', 'uploads'), exist_ok=True)
+            with open(os.path.join(directory, 'corpus', *key.split('/')), 'wb') as f:
+                f.write(s3.objects[('source', key)]['Body'])
+        stale = os.path.join(directory, 'out', 'transforms', 'processed', 'photo1.jpeg', '0123')
+        os.makedirs(stale)
+        local = reprocess.backfill(reprocess.LocalStore(os.path.join(directory, 'corpus')),
+                                   reprocess.LocalStore(os.path.join(directory, 'out')), 'uploads/', workers=2)
+        local_output = Image.open(os.path.join(directory, 'out', 'processed', 'photo1.jpeg'))
+        local_output.load()
+        assert not os.path.exists(os.path.dirname(stale))
+    
+    assert (first['images'], saved['after'], saved['done']) == (3, keys[2], 3)
+    assert second['images'] == 3 and second['after'] == 'uploads/1699889239_400x300_85_jpeg_none_broken.jpg'
+    assert second['failed_keys'] == ['uploads/1699889239_400x300_85_jpeg_none_broken.jpg']
+    for index in range(5):
+        output = Image.open(BytesIO(s3.objects[('processed', f'processed/photo{index}.jpeg')]['Body']))
+        assert (output.format, output.size) == ('JPEG', (400, 300))
+    assert s3.objects[('processed', 'processed/photo4.jpeg')]['CacheControl'] == 'max-age=31536000'
+    assert not any(key.startswith('transforms/') for _, key in s3.objects)
+    assert local['images'] == 2 and local['failed'] == 0 and local_output.size == (400, 300)
+    
+    print("✓ Reprocess backfill test passed")
+
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("Testing Pipeline Emulator")
+    print("=" * 50)
+    print()
+    
+    try:
+        test_fake_dynamodb_query()
+        test_pipeline_end_to_end()
+        test_pipeline_batch_multipart()
+        test_transform_single_flight()
+        test_reprocess_resume()
+        
+        print()
+        print("=" * 50)
+        print("✓ All tests passed!")
+        print("=" * 50)
+    except Exception as e:
+        print()
+        print("=" * 50)
+        print(f"✗ Test failed: {str(e)}")
+        print("=" * 50)
+        raise
@@ -0,0 +1,225 @@
+"""
+Local testing script for Get Image History Lambda
+Run: python test_get_image_history.py
+"""
+
+import json
+import sys
+import os
+from decimal import Decimal
+
+# Add lambda directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas/get_image_history'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import handler as get_image_history
+from handler import lambda_handler, build_query, encode_token, decode_token
+from url_signer import SigningCache
+from common import from_item, to_item
+
+
+class FakeDynamoDBClient:
+    """Stand-in for the low-level query over one user's items, newest first"""
+
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda item: item['timestamp'], reverse=True)
+        self.queries = []
+
+    def query(self, TableName, Limit, ExclusiveStartKey=None, **kwargs):
+        self.queries.append(dict(kwargs, Limit=Limit, ExclusiveStartKey=ExclusiveStartKey))
+        items = self.items
+        if ExclusiveStartKey:
+            start = from_item(ExclusiveStartKey)
+            items = [item for item in items if item['timestamp'] < start['timestamp']]
+
+        page = items[:Limit]
+        response = {'Items': [to_item(item) for item in page]}
+        if len(items) > Limit:
+            response['LastEvaluatedKey'] = to_item({'userId': page[-1]['userId'], 'timestamp': page[-1]['timestamp']})
+        return response
+
+
+def run_with_client(fake_client, params):
+    original_client, original_bucket = get_image_history.dynamodb_client, get_image_history.bucket_name
+    get_image_history.dynamodb_client, get_image_history.bucket_name = fake_client, None
+    try:
+        return lambda_handler({'queryStringParameters': params}, None)
+    finally:
+        get_image_history.dynamodb_client, get_image_history.bucket_name = original_client, original_bucket
+
+
+def test_pagination():
+    """Test that nextToken walks through every item exactly once"""
+    print("Testing cursor pagination...")
+
+    fake_client = FakeDynamoDBClient([
+        {'userId': 'u1', 'timestamp': f'2026-01-0{day}T10:00:00', 'processedKey': f'processed/{day}.jpeg',
+         'metadata': {'width': Decimal('800')}}
+        for day in range(1, 8)
+    ])
+
+    seen = []
+    params = {'userId': 'u1', 'limit': '3'}
+    while True:
+        response = run_with_client(fake_client, params)
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        seen.extend(item['timestamp'] for item in body['items'])
+        if not body['nextToken']:
+            break
+        params = dict(params, nextToken=body['nextToken'])
+
+    assert seen == [f'2026-01-0{day}T10:00:00' for day in range(7, 0, -1)]
+    assert len(fake_client.queries) == 3
+
+    # Token của user khác bị từ chối
+    token = encode_token({'userId': 'u2', 'timestamp': '2026-01-05T10:00:00'})
+    response = run_with_client(fake_client, {'userId': 'u1', 'nextToken': token})
+    assert response['statusCode'] == 400
+    response = run_with_client(fake_client, {'userId': 'u1', 'nextToken': 'not-a-token'})
+    assert response['statusCode'] == 400
+
+    print("✓ Pagination test passed")
+
+
+def test_build_query():
+    """Test projection, time range and limit handling"""
+    print("Testing query building...")
+
+    query = build_query('u1', {'fields': 'processedKey,cloudfront-url', 'from': '2026-01-01T00:00:00Z',
+                               'to': '2026-01-31', 'limit': '500'})
+
+    assert query['Limit'] == get_image_history.MAX_LIMIT
+    names = query['ExpressionAttributeNames']
+    projected = [names[name] for name in query['ProjectionExpression'].split(', ')]
+    assert projected == ['userId', 'timestamp', 'processedKey', 'cloudfront-url']
+
+    assert query['KeyConditionExpression'] == '#pk = :userId AND #sk BETWEEN :from AND :to'
+    assert (names['#pk'], names['#sk']) == ('userId', 'timestamp')
+    assert query['ExpressionAttributeValues'] == {
+        ':userId': {'S': 'u1'},
+        ':from': {'S': '2026-01-01T00:00:00'},
+        ':to': {'S': '2026-01-31T23:59:59.999999'}
+    }
+
+    assert 'ProjectionExpression' not in build_query('u1', {})
+    assert decode_token(encode_token({'userId': 'u1', 'timestamp': 't'}), 'u1') == {'userId': 'u1', 'timestamp': 't'}
+
+    for params in [{'fields': 'password'}, {'from': 'yesterday'}, {'limit': '0'},
+                   {'from': '2026-02-01', 'to': '2026-01-01'}]:
+        try:
+            build_query('u1', params)
+        except ValueError:
+            continue
+        raise AssertionError(f"Expected ValueError for {params}")
+
+    print("✓ Query building test passed")
+
+
+def test_signing_cache():
+    """Test that URLs are signed once per (bucket, key, window)"""
+    print("Testing signing cache...")
+
+    signed = []
+
+    def sign(bucket, key, expires_in):
+        signed.append((bucket, key, expires_in))
+        return f"https://{bucket}/{key}?expires={expires_in}&n={len(signed)}"
+
+    cache = SigningCache(sign, expiration=3600, window=300, max_entries=2)
+
+    first = cache.get('b', 'processed/1.jpeg', now=1000)
+    assert cache.get('b', 'processed/1.jpeg', now=1199) == first
+    assert signed == [('b', 'processed/1.jpeg', 3900)]
+
+    # Window mới thì ký lại
+    assert cache.get('b', 'processed/1.jpeg', now=1200) != first
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # LRU giới hạn số entry
+    cache.get('b', 'processed/2.jpeg', now=1200)
+    cache.get('b', 'processed/3.jpeg', now=1200)
+    assert len(cache._entries) == 2
+
+    # Handler dùng cache giữa các lần gọi (container warm)
+    fake_client = FakeDynamoDBClient([{'userId': 'u1', 'timestamp': '2026-01-01T10:00:00',
+                             'processedKey': 'processed/a.jpeg', 'originalKey': 'uploads/a.jpg'}])
+    original = get_image_history.signing_cache, get_image_history.bucket_name, get_image_history.dynamodb_client
+    get_image_history.signing_cache = SigningCache(sign)
+    get_image_history.bucket_name, get_image_history.dynamodb_client = 'processed-bucket', fake_client
+    try:
+        del signed[:]
+        bodies = [json.loads(lambda_handler({'queryStringParameters': {'userId': 'u1'}}, None)['body'])
+                  for _ in range(3)]
+    finally:
+        get_image_history.signing_cache, get_image_history.bucket_name, get_image_history.dynamodb_client = original
+
+    assert len(signed) == 2
+    assert all(body['items'][0]['processedUrl'] == bodies[0]['items'][0]['processedUrl'] for body in bodies)
+
+    print("✓ Signing cache test passed")
+
+
+def test_placeholder_and_srcset():
+    """Test that placeholders are returned and srcset lists same-format renditions by width"""
+    print("Testing placeholder and srcset...")
+
+    placeholder = {'src': 'data:image/webp;base64,UklGRg==', 'width': Decimal('1600'), 'height': Decimal('1200')}
+    fake_client = FakeDynamoDBClient([
+        {'userId': 'u1', 'timestamp': '2026-01-02T10:00:00', 'processedKey': 'processed/a.jpeg',
+         'placeholder': placeholder,
+         'metadata': {'format': 'jpeg', 'outputWidth': Decimal('800'), 'outputHeight': Decimal('600'), 'renditions': [
+             {'name': 'thumbnail', 'format': 'jpeg', 'key': 'processed/a_thumbnail.jpeg', 'width': Decimal('200')},
+             {'name': 'thumbnail', 'format': 'webp', 'key': 'processed/a_thumbnail.webp', 'width': Decimal('200')},
+             {'name': 'full', 'format': 'jpeg', 'key': 'processed/a_full.jpeg', 'width': Decimal('1600')}
+         ]}},
+        # Ảnh cũ không có kích thước rendition
+        {'userId': 'u1', 'timestamp': '2026-01-01T10:00:00', 'processedKey': 'processed/b.jpeg',
+         'metadata': {'format': 'jpeg', 'renditions': []}}
+    ])
+    original = get_image_history.signing_cache, get_image_history.bucket_name, get_image_history.dynamodb_client
+    get_image_history.signing_cache = SigningCache(lambda bucket, key, expires_in: f"https://{bucket}/{key}")
+    get_image_history.bucket_name, get_image_history.dynamodb_client = 'processed-bucket', fake_client
+    try:
+        body = json.loads(lambda_handler({'queryStringParameters': {'userId': 'u1'}}, None)['body'])
+    finally:
+        get_image_history.signing_cache, get_image_history.bucket_name, get_image_history.dynamodb_client = original
+
+    latest, legacy = body['items']
+    assert latest['placeholder'] == {'src': placeholder['src'], 'width': 1600, 'height': 1200}
+    assert latest['srcset'] == ('https://processed-bucket/processed/a_thumbnail.jpeg 200w, '
+                                'https://processed-bucket/processed/a.jpeg 800w, '
+                                'https://processed-bucket/processed/a_full.jpeg 1600w')
+    assert 'srcset' not in legacy and 'placeholder' not in legacy
+
+    # placeholder có thể chọn qua fields
+    assert 'placeholder' in build_query('u1', {'fields': 'placeholder'})['ExpressionAttributeNames'].values()
+
+    print("✓ Placeholder and srcset test passed")
+
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("Running Get Image History Lambda Tests")
+    print("=" * 50)
+    print()
+
+    try:
+        test_pagination()
+        test_build_query()
+        test_signing_cache()
+        test_placeholder_and_srcset()
+
+        print()
+        print("=" * 50)
+        print("✓ All tests passed!")
+        print("=" * 50)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n✗ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
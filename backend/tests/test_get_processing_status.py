@@ -0,0 +1,137 @@
+"""
+Local testing script for Get Processing Status Lambda
+Run: python test_get_processing_status.py
+"""
+
+import json
+import sys
+import os
+
+# Add lambda directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas/get_processing_status'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import handler as processing_status
+from handler import handler, parse_request
+from common import to_item
+
+
+class FakeDynamoDBClient:
+    """Stand-in for get_item where the record appears after a number of reads"""
+
+    def __init__(self, record=None, appears_after=0):
+        self.record = record
+        self.appears_after = appears_after
+        self.reads = 0
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        assert ConsistentRead
+        self.reads += 1
+        if self.record is None or self.reads <= self.appears_after:
+            return {}
+        assert Key == {'uploadKey': {'S': self.record['uploadKey']}}
+        return {'Item': to_item(self.record)}
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def run_with_client(fake_client, params, context=None):
+    original = processing_status.dynamodb_client, processing_status.POLL_INTERVAL, processing_status.POLL_INTERVAL_MAX
+    processing_status.dynamodb_client = fake_client
+    processing_status.POLL_INTERVAL, processing_status.POLL_INTERVAL_MAX = 0.001, 0.005
+    try:
+        response = handler({'queryStringParameters': params}, context)
+    finally:
+        processing_status.dynamodb_client, processing_status.POLL_INTERVAL, processing_status.POLL_INTERVAL_MAX = original
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_parse_request():
+    """Test key and wait validation"""
+    print("Testing request validation...")
+
+    assert parse_request({'key': 'uploads/1_ab_photo.jpg'}) == ('uploads/1_ab_photo.jpg', processing_status.MAX_WAIT_SECONDS)
+    assert parse_request({'key': 'uploads/a.jpg', 'wait': '300'})[1] == processing_status.MAX_WAIT_SECONDS
+    for params in ({}, {'key': 'processed/a.jpeg'}, {'key': 'uploads/a.jpg', 'wait': 'soon'}, {'key': 'uploads/a.jpg', 'wait': '-1'},
+                   {'key': 'uploads/a.jpg', 'wait': 'nan'}, {'key': 'uploads/a.jpg', 'wait': 'inf'}):
+        try:
+            parse_request(params)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {params}")
+
+    status_code, body = run_with_client(FakeDynamoDBClient(), {'key': '../etc'})
+    assert status_code == 400 and body['errors']
+    status_code, body = run_with_client(FakeDynamoDBClient(), {'key': 'uploads/a.jpg', 'wait': 'nan'})
+    assert status_code == 400 and body['errors']
+
+    print("✓ Request validation test passed")
+
+
+def test_long_poll_returns_when_record_appears():
+    """Test that the request is held until the completion record is written"""
+    print("Testing long-poll...")
+
+    record = {'uploadKey': 'uploads/1_ab_photo.jpg', 'status': 'done', 'processedKey': 'processed/photo.jpeg',
+              'renditions': [], 'timings': {'TotalMs': 812}, 'ttl': 1700000000}
+    fake_client = FakeDynamoDBClient(record, appears_after=3)
+    status_code, body = run_with_client(fake_client, {'key': record['uploadKey'], 'wait': '5'})
+
+    assert status_code == 200
+    assert fake_client.reads == 4
+    assert body['status'] == 'done' and body['processedKey'] == 'processed/photo.jpeg'
+    assert body['timings'] == {'TotalMs': 812} and 'ttl' not in body
+
+    # Failures are reported as soon as they are recorded
+    failed = {'uploadKey': 'uploads/2_cd_bad.jpg', 'status': 'failed', 'error': 'cannot identify image file'}
+    status_code, body = run_with_client(FakeDynamoDBClient(failed), {'key': failed['uploadKey'], 'wait': '0'})
+    assert status_code == 200 and body['status'] == 'failed' and body['error'] == failed['error']
+
+    print("✓ Long-poll test passed")
+
+
+def test_long_poll_times_out():
+    """Test 202 when nothing is recorded within wait or the Lambda's remaining time"""
+    print("Testing long-poll timeout...")
+
+    fake_client = FakeDynamoDBClient()
+    status_code, body = run_with_client(fake_client, {'key': 'uploads/1_ab_photo.jpg', 'wait': '0.05'})
+    assert status_code == 202 and body == {'key': 'uploads/1_ab_photo.jpg', 'status': 'pending'}
+    assert fake_client.reads > 1
+
+    # Less remaining time than the response reserve: a single read
+    fake_client = FakeDynamoDBClient()
+    status_code, _ = run_with_client(fake_client, {'key': 'uploads/1_ab_photo.jpg', 'wait': '20'}, FakeContext(500))
+    assert status_code == 202 and fake_client.reads == 1
+
+    print("✓ Long-poll timeout test passed")
+
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("Testing Get Processing Status Lambda")
+    print("=" * 50)
+    print()
+
+    try:
+        test_parse_request()
+        test_long_poll_returns_when_record_appears()
+        test_long_poll_times_out()
+
+        print()
+        print("=" * 50)
+        print("✓ All tests passed!")
+        print("=" * 50)
+    except Exception as e:
+        print()
+        print("=" * 50)
+        print(f"✗ Test failed: {str(e)}")
+        print("=" * 50)
+        raise
@@ -3,14 +3,106 @@ Local testing script for Image Processor Lambda
 Run: python test_image_processor.py
 """
 
+import base64
+import hashlib
+import importlib.util
 import json
+import pickle
 import sys
 import os
+from io import BytesIO
 
 # Add lambda directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas/image_processor'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas'))
 
-from handler import handler, get_image_metadata, process_image
+import handler as image_processor
+from handler import handler, get_image_metadata, process_image, process_renditions, get_renditions, fit_size, load_reduced, add_watermark
+from botocore.exceptions import ClientError
+import banding
+import color
+import encoder
+import instrumentation
+import job_status
+import orientation
+import process_pool
+from dedup_cache import create_cache, rendition_digest
+from common import from_item, manifest
+from PIL import Image, ImageChops, ImageCms
+
+# Worker processes don't see module settings the tests change; only
+# test_process_pool_renditions enables them
+process_pool.ENCODE_PROCESSES = '0'
+
+
+class FakeS3Client:
+    """Minimal in-memory stand-in for the boto3 S3 client"""
+    
+    def __init__(self):
+        self.objects = {}
+        self.copies = 0
+    
+    def _get(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+        return self.objects[(Bucket, Key)]
+    
+    def get_object(self, Bucket, Key):
+        stored = self._get(Bucket, Key)
+        return {'Body': BytesIO(stored['Body']), 'Metadata': stored.get('Metadata', {})}
+    
+    def head_object(self, Bucket, Key):
+        return {'ETag': self._get(Bucket, Key)['ETag']}
+    
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        self.objects[(Bucket, Key)] = dict(kwargs, Body=Body, ETag=etag)
+        return {'ETag': etag}
+    
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        self.put_object(Bucket, Key, Fileobj.read(), **(ExtraArgs or {}))
+    
+    def copy_object(self, Bucket, Key, CopySource, CopySourceIfMatch=None, MetadataDirective=None, **kwargs):
+        source = self._get(CopySource['Bucket'], CopySource['Key'])
+        if CopySourceIfMatch and CopySourceIfMatch != source['ETag']:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': Key}}, 'CopyObject')
+        self.copies += 1
+        return self.put_object(Bucket, Key, source['Body'], **kwargs)
+
+
+def make_image_bytes(size=(1600, 1200), mode='RGB', image_format='JPEG'):
+    """Create an encoded test image"""
+    image = Image.new(mode, size, (200, 80, 40) if mode == 'RGB' else (200, 80, 40, 128))
+    output = BytesIO()
+    image.save(output, format=image_format)
+    return output.getvalue()
+
+
+def make_photo(size=(800, 600)):
+    """Create an image with gradients and noise, which lossy encoders can't compress trivially"""
+    red = Image.linear_gradient('L').resize(size)
+    green = Image.effect_noise(size, 32).point(lambda v: v // 2 + 64)
+    blue = Image.radial_gradient('L').resize(size)
+    return Image.merge('RGB', (red, green, blue))
+
+
+def with_encoder_settings(function, **settings):
+    """Run function with encoder module settings temporarily replaced"""
+    original = {name: getattr(encoder, name) for name in settings}
+    for name, value in settings.items():
+        setattr(encoder, name, value)
+    try:
+        return function()
+    finally:
+        for name, value in original.items():
+            setattr(encoder, name, value)
+
+
+def s3_record(bucket, key):
+    """Build an S3 event record"""
+    return {'s3': {'bucket': {'name': bucket}, 'object': {'key': key}}}
 
 def test_get_image_metadata():
     """Test metadata parsing"""
@@ -42,10 +134,676 @@ def test_invalid_metadata():
     print("✓ Invalid metadata test passed")
 
 
+def test_fit_size_matches_thumbnail():
+    """Test that fit_size computes the same size as Image.thumbnail"""
+    print("Testing fit_size...")
+    
+    for source, box in [((1600, 1200), (800, 600)), ((1200, 1600), (800, 600)),
+                        ((333, 777), (100, 100)), ((640, 480), (1024, 768)), ((1000, 3), (10, 10))]:
+        image = Image.new('RGB', source)
+        image.thumbnail(box)
+        assert fit_size(source, box) == image.size, f"{source} in {box}"
+    
+    print("✓ fit_size test passed")
+
+
+def test_process_renditions():
+    """Test that one decode produces every configured rendition"""
+    print("Testing multi-rendition processing...")
+    
+    metadata = get_image_metadata("uploads/1699889234_800x600_85_jpeg_ImageHub_photo.jpg")
+    
+    original_sizes, original_formats = image_processor.RENDITION_SIZES, image_processor.RENDITION_FORMATS
+    image_processor.RENDITION_SIZES = 'thumbnail:200x200,full:1600x1600'
+    image_processor.RENDITION_FORMATS = ['webp', 'jpeg']
+    try:
+        renditions = get_renditions(metadata)
+        outputs = {index: (rendition, Image.open(output))
+                   for index, rendition, output in process_renditions(make_image_bytes(size=(2000, 1500)), metadata)}
+    finally:
+        image_processor.RENDITION_SIZES, image_processor.RENDITION_FORMATS = original_sizes, original_formats
+    
+    assert len(renditions) == 5
+    assert [dict(outputs[index][0], output_size=None) for index in range(5)] == [dict(r, output_size=None) for r in renditions]
+    
+    expected = [(None, 'JPEG', (800, 600)), ('thumbnail', 'WEBP', (200, 150)), ('thumbnail', 'JPEG', (200, 150)),
+                ('full', 'WEBP', (1600, 1200)), ('full', 'JPEG', (1600, 1200))]
+    for index, (name, image_format, size) in enumerate(expected):
+        rendition, output = outputs[index]
+        assert rendition['name'] == name
+        assert (output.format, output.size) == (image_format, size)
+        assert rendition['output_size'] == size
+    
+    print("✓ Multi-rendition test passed")
+
+
+def test_process_pool_renditions():
+    """Test rendering sizes in worker processes from the shared decoded image"""
+    print("Testing process pool rendering...")
+    
+    photo = make_photo((1600, 1200))
+    source = BytesIO()
+    photo.save(source, format='PNG')
+    metadata = get_image_metadata("uploads/1699889234_800x600_85_png_ImageHub_photo.png")
+    renditions = [dict(rendition, format=image_format) for rendition, image_format in
+                  zip(get_renditions(metadata) * 3, ('png', 'webp', 'jpeg'))]
+    for rendition, (width, height) in zip(renditions, ((800, 600), (400, 300), (200, 150))):
+        rendition.update(name=f'w{width}', width=width, height=height)
+    
+    def render(processes):
+        process_pool.ENCODE_PROCESSES = processes
+        metrics = instrumentation.ImageMetrics('uploads/photo.png', 'off')
+        try:
+            outputs = {index: (rendition, output.read())
+                       for index, rendition, output in process_renditions(source.getvalue(), metadata, renditions, metrics)}
+        finally:
+            process_pool.ENCODE_PROCESSES = '0'
+        return outputs, metrics
+    
+    try:
+        serial, _ = render('0')
+        parallel, metrics = render('2')
+        assert process_pool.get_pool() is None
+        
+        assert sorted(parallel) == [0, 1, 2]
+        for index in range(3):
+            assert parallel[index][0] == serial[index][0]
+            expected, output = Image.open(BytesIO(serial[index][1])), Image.open(BytesIO(parallel[index][1]))
+            assert (output.format, output.size) == (expected.format, expected.size)
+        # The largest size is resized from the decoded image either way: identical lossless output
+        assert ImageChops.difference(Image.open(BytesIO(parallel[0][1])), Image.open(BytesIO(serial[0][1]))).getbbox() is None
+        
+        # Worker metrics are merged into the image's
+        assert metrics.stages['encode'] > 0 and metrics.stages['watermark'] > 0
+        assert metrics.counters['OutputPixels'] == 800 * 600 + 400 * 300 + 200 * 150
+        
+        # Errors raised in a worker reach the caller
+        process_pool.ENCODE_PROCESSES = '2'
+        try:
+            list(process_pool.get_pool().imap_unordered(process_pool.open_shared, [(('/nonexistent', 'RGB', (1, 1)),)]))
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError("worker error was not raised")
+        
+        # Arguments that cannot be sent do not cost a worker: later tasks and close() still run
+        pool = process_pool.get_pool()
+        for _ in range(pool.processes + 1):
+            try:
+                pool.run(process_pool.open_shared, lambda: None)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                pass
+            else:
+                raise AssertionError("unpicklable argument was sent")
+        try:
+            pool.run(process_pool.open_shared, ('/nonexistent', 'RGB', (1, 1)))
+        except FileNotFoundError:
+            pass
+        assert pool._idle.qsize() == pool.processes
+    finally:
+        process_pool.ENCODE_PROCESSES = '0'
+        process_pool.shutdown()
+    
+    print("✓ Process pool test passed")
+
+
+def test_processing_profiles():
+    """Test that profiles trade encoder effort and filters, with balanced as the default"""
+    print("Testing processing profiles...")
+    
+    source = BytesIO()
+    make_photo((2400, 1800)).save(source, format='JPEG', quality=92)
+    renditions = [{'name': None, 'width': 800, 'height': 600, 'format': 'jpeg', 'quality': 85},
+                  {'name': 'thumb', 'width': 200, 'height': 150, 'format': 'webp', 'quality': 85}]
+    
+    def render(profile):
+        metadata = {'width': 800, 'height': 600, 'quality': 85, 'format': 'jpeg', 'watermark': None}
+        profiled = [dict(rendition, profile=profile) for rendition in renditions]
+        return {index: (rendition, output.read())
+                for index, rendition, output in process_renditions(source.getvalue(), metadata, profiled)}
+    
+    fast, balanced, default = render('fast'), render('balanced'), render(None)
+    assert get_renditions({'width': 800, 'height': 600, 'quality': 85, 'format': 'jpeg', 'watermark': None})[0]['profile'] == 'balanced'
+    
+    # Sizes don't depend on the profile; fast gives up progressive JPEG
+    for outputs in (fast, balanced, default):
+        assert [Image.open(BytesIO(outputs[index][1])).size for index in range(2)] == [(800, 600), (200, 150)]
+    assert not Image.open(BytesIO(fast[0][1])).info.get('progressive')
+    assert Image.open(BytesIO(balanced[0][1])).info.get('progressive')
+    assert balanced[0][1] == default[0][1] and fast[0][1] != balanced[0][1]
+    
+    # The profile is part of the dedup digest, except for the default
+    digest = lambda rendition: rendition_digest('source', rendition, None, image_processor.encoding_settings(rendition))
+    assert digest(dict(renditions[0], profile='balanced')) == digest(renditions[0])
+    assert digest(dict(renditions[0], profile='fast')) != digest(renditions[0])
+    
+    # Profiles are requested through the manifest
+    assert manifest.build({'profile': 'fast'}, 'photo')['profile'] == 'fast'
+    assert manifest.validate(manifest.build({'profile': 'turbo'}, 'photo')) == ['profile must be one of: fast, balanced, best']
+    import profiles
+    assert tuple(profiles.PROFILES) == manifest.PROFILES
+    
+    # Unknown profiles are validation errors, a bad DEFAULT_PROFILE fails at import
+    try:
+        get_renditions({'width': 800, 'height': 600, 'quality': 85, 'format': 'jpeg', 'watermark': None, 'profile': 'turbo'})
+    except ValueError as e:
+        assert 'profile must be one of' in str(e)
+    else:
+        raise AssertionError("unknown profile was accepted")
+    original_default = os.environ.get('DEFAULT_PROFILE')
+    os.environ['DEFAULT_PROFILE'] = 'balancd'
+    try:
+        spec = importlib.util.spec_from_file_location('profiles_typo', profiles.__file__)
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    except ValueError as e:
+        assert 'DEFAULT_PROFILE' in str(e)
+    else:
+        raise AssertionError("DEFAULT_PROFILE typo was accepted")
+    finally:
+        if original_default is None:
+            del os.environ['DEFAULT_PROFILE']
+        else:
+            os.environ['DEFAULT_PROFILE'] = original_default
+    
+    print("✓ Processing profiles test passed")
+
+
+def test_adaptive_encoding():
+    """Test quality search against SSIM and byte targets"""
+    print("Testing adaptive encoding...")
+    
+    photo = make_photo()
+    rendition = {'name': None, 'width': 800, 'height': 600, 'format': 'jpeg', 'quality': 95}
+    fixed_size = len(image_processor.encode_image(photo, 'jpeg', 95).getvalue())
+    
+    def encode():
+        output, output_format = image_processor.encode_rendition(photo, rendition)
+        return output.read(), output_format
+    
+    # Perceptual target: smaller than the fixed quality while staying above the threshold
+    data, output_format = with_encoder_settings(encode, ENCODE_MODE='adaptive', TARGET_SSIM=0.95, TARGET_BYTES=0)
+    reference = encoder.luma_proxy(photo, encoder.proxy_size(photo.size))
+    score = encoder.ssim(reference, encoder.luma_proxy(Image.open(BytesIO(data)), reference.shape[::-1]))
+    assert output_format == 'jpeg'
+    assert len(data) < fixed_size
+    assert score >= 0.95, score
+    
+    # Byte budget wins over the perceptual target
+    budget = len(data) * 3 // 4
+    data, _ = with_encoder_settings(encode, ENCODE_MODE='adaptive', TARGET_SSIM=0.95, TARGET_BYTES=budget, MIN_QUALITY=10)
+    assert len(data) <= budget
+    
+    # 'auto' picks PNG for flat graphics and a lossy format for photos
+    graphic = Image.new('RGB', (400, 300), (255, 255, 255))
+    graphic.paste((30, 60, 200), (50, 50, 200, 150))
+    auto = dict(rendition, format='auto')
+    output, output_format = with_encoder_settings(lambda: image_processor.encode_rendition(graphic, auto),
+                                                  ENCODE_MODE='adaptive', TARGET_BYTES=0)
+    assert output_format == 'png'
+    assert ImageChops.difference(Image.open(output).convert('RGB'), graphic).getbbox() is None
+    _, output_format = with_encoder_settings(lambda: image_processor.encode_rendition(photo, auto),
+                                             ENCODE_MODE='adaptive', AUTO_FORMATS=['webp', 'jpeg', 'png'])
+    assert output_format in ('webp', 'jpeg')
+    
+    # A profile's compress level 0 (stored, no zlib) is used, not replaced by PNG_COMPRESS_LEVEL
+    import profiles
+    profiles.PROFILES['stored'] = dict(profiles.PROFILES['fast'], png_compress_level=0)
+    try:
+        png = dict(rendition, format='png')
+        stored, _ = with_encoder_settings(lambda: image_processor.encode_rendition(photo, dict(png, profile='stored')),
+                                          ENCODE_MODE='adaptive')
+        default, _ = with_encoder_settings(lambda: image_processor.encode_rendition(photo, png), ENCODE_MODE='adaptive')
+    finally:
+        del profiles.PROFILES['stored']
+    assert len(stored.read()) > len(default.read())
+    
+    # A source that already meets the target is stored as-is
+    source = BytesIO()
+    photo.save(source, format='JPEG', quality=70)
+    metadata = {'width': 800, 'height': 600, 'quality': 90, 'format': 'auto', 'watermark': None}
+    outputs = with_encoder_settings(lambda: list(process_renditions(source.getvalue(), metadata)),
+                                    ENCODE_MODE='adaptive', TARGET_BYTES=0)
+    (_, rendition, output), = outputs
+    assert rendition['format'] == 'jpeg'
+    assert output.read() == source.getvalue()
+    
+    print("✓ Adaptive encoding test passed")
+
+
+def test_load_reduced():
+    """Test reduced-resolution decoding of large sources"""
+    print("Testing reduced-resolution decode...")
+    
+    # JPEG is scaled during decode (DCT scaling), never below 2x the target
+    image = load_reduced(Image.open(BytesIO(make_image_bytes(size=(4000, 3000)))), (800, 600))
+    assert image.size == (2000, 1500)
+    
+    image = load_reduced(Image.open(BytesIO(make_image_bytes(size=(4000, 3000)))), (200, 150))
+    assert image.size == (500, 375)
+    
+    # PNG is decoded in full then box-reduced by an integer factor
+    image = load_reduced(Image.open(BytesIO(make_image_bytes(size=(4000, 3000), image_format='PNG'))), (800, 600))
+    assert image.size == (2000, 1500)
+    
+    # Output size is unaffected by the decode scale
+    metadata = get_image_metadata("uploads/1699889234_800x600_85_jpeg_none_photo.jpg")
+    output = Image.open(BytesIO(process_image(make_image_bytes(size=(4000, 3000)), metadata)))
+    assert output.size == (800, 600)
+    
+    print("✓ Reduced-resolution decode test passed")
+
+
+def test_banded_decode():
+    """Test that sources above the decode limit are decoded in bands or rejected"""
+    print("Testing banded decode...")
+    
+    photo = make_photo((1237, 911))
+    photo.putalpha(Image.linear_gradient('L').resize(photo.size))
+    source = BytesIO()
+    photo.save(source, format='PNG')
+    source = source.getvalue()
+    palette = BytesIO()
+    photo.convert('RGB').quantize(64).save(palette, format='PNG', transparency=3)
+    
+    original = banding.MAX_DECODE_BYTES, banding.BAND_BYTES
+    banding.MAX_DECODE_BYTES, banding.BAND_BYTES = 1024 * 1024, 64 * 1024
+    try:
+        # Same pixels as a full decode and box reduce, with at most MAX_DECODE_BYTES held
+        image = load_reduced(Image.open(BytesIO(source)), (400, 300), reducing_gap=1.0)
+        assert image.size == (413, 304) and image.mode == 'RGBA'
+        assert ImageChops.difference(image, photo.reduce(3)).getbbox() is None
+        
+        # Palette transparency is applied band by band
+        image = load_reduced(Image.open(BytesIO(palette.getvalue())), (400, 300), reducing_gap=1.0)
+        expected = Image.open(BytesIO(palette.getvalue())).convert('RGBA').reduce(3)
+        assert image.mode == 'RGBA' and ImageChops.difference(image, expected).getbbox() is None
+        
+        # The end-to-end output is unaffected
+        metadata = get_image_metadata("uploads/1699889234_400x300_85_png_none_photo.png")
+        output = Image.open(BytesIO(process_image(source, metadata)))
+        assert output.size == (400, 295)
+        
+        # Formats that can't be decoded in bands fail instead of exhausting memory
+        webp = BytesIO()
+        photo.save(webp, format='WEBP')
+        try:
+            load_reduced(Image.open(webp), (400, 300))
+        except banding.ImageTooLargeError:
+            pass
+        else:
+            raise AssertionError("oversized WebP was decoded")
+        
+        # Sources are checked against MAX_SOURCE_PIXELS; Pillow's global limit is left alone
+        default_limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, 100000
+        try:
+            assert banding.open_source(BytesIO(source)).size == photo.size
+            assert Image.MAX_IMAGE_PIXELS == 100000
+            try:
+                Image.open(BytesIO(source))
+            except Image.DecompressionBombError:
+                pass
+            else:
+                raise AssertionError("global decompression bomb limit was lifted")
+        finally:
+            Image.MAX_IMAGE_PIXELS = default_limit
+        original_source_pixels, banding.MAX_SOURCE_PIXELS = banding.MAX_SOURCE_PIXELS, 100000
+        try:
+            banding.open_source(BytesIO(source))
+        except banding.ImageTooLargeError:
+            pass
+        else:
+            raise AssertionError("source above MAX_SOURCE_PIXELS was opened")
+        finally:
+            banding.MAX_SOURCE_PIXELS = original_source_pixels
+    finally:
+        banding.MAX_DECODE_BYTES, banding.BAND_BYTES = original
+    
+    print("✓ Banded decode test passed")
+
+
+def test_color_pipeline():
+    """Test mode normalization and alpha flattening"""
+    print("Testing colour pipeline...")
+    
+    # Palette with transparency keeps its alpha, 16-bit greyscale is scaled rather than clipped
+    palette = Image.new('RGBA', (4, 4), (10, 20, 30, 0)).quantize(4)
+    palette.info['transparency'] = 0
+    assert color.normalize_mode(palette).mode == 'RGBA'
+    assert color.normalize_mode(Image.new('I;16', (4, 4), 40000)).getpixel((0, 0)) == 156
+    assert color.normalize_mode(Image.new('CMYK', (4, 4))).mode == 'RGB'
+    
+    # Flattening composites onto white with a single paste
+    image = Image.new('RGBA', (4, 4), (200, 80, 40, 128))
+    flat = color.flatten(image)
+    assert flat.mode == 'RGB'
+    assert flat.getpixel((0, 0)) == (227, 167, 147)
+    assert color.flatten(Image.new('LA', (4, 4), (0, 0))).getpixel((0, 0)) == 255
+    
+    # Large transparent palette PNGs are reduced after normalization and flattened once for JPEG
+    source = Image.new('RGBA', (3000, 2000), (0, 0, 0, 0))
+    source.paste((30, 60, 200, 255), (0, 0, 1500, 2000))
+    encoded = BytesIO()
+    source.quantize(8).save(encoded, format='PNG', transparency=0)
+    metadata = get_image_metadata("uploads/1699889234_600x400_85_jpeg_none_logo.png")
+    metrics = instrumentation.ImageMetrics('uploads/logo.png', 'off')
+    output = Image.open(next(process_renditions(encoded.getvalue(), metadata, metrics=metrics))[2])
+    assert (output.format, output.size) == ('JPEG', (600, 400))
+    assert max(abs(a - b) for a, b in zip(output.getpixel((450, 200)), (255, 255, 255))) <= 2
+    assert 'flatten' in metrics.stages
+    
+    print("✓ Colour pipeline test passed")
+
+
+def test_orientation_and_metadata():
+    """Test EXIF rotation, metadata stripping and ICC conversion"""
+    print("Testing orientation and metadata...")
+    
+    # Stored landscape with red on the left; orientation 6 displays it rotated 90° clockwise
+    stored = Image.new('RGB', (1600, 800), (0, 0, 255))
+    stored.paste((255, 0, 0), (0, 0, 800, 800))
+    exif = Image.Exif()
+    exif[orientation.ORIENTATION_TAG] = 6
+    exif[0x010f] = 'PhoneMaker'
+    srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    encoded = BytesIO()
+    stored.save(encoded, format='JPEG', exif=exif.tobytes(), icc_profile=srgb, quality=95)
+    
+    for output_format in ('jpeg', 'png', 'webp'):
+        metadata = {'width': 300, 'height': 600, 'quality': 90, 'format': output_format, 'watermark': None}
+        output = Image.open(next(process_renditions(encoded.getvalue(), metadata))[2])
+        assert output.size == (300, 600)
+        assert output.getpixel((150, 50))[0] > 200 and output.getpixel((150, 550))[2] > 200
+        # No EXIF, XMP or profile in any format
+        assert not output.info.get('exif') and not output.info.get('icc_profile'), output_format
+    
+    # Keeping metadata preserves the EXIF with the orientation reset
+    metadata = {'width': 300, 'height': 600, 'quality': 90, 'format': 'jpeg', 'watermark': None}
+    original = orientation.STRIP_METADATA
+    orientation.STRIP_METADATA = False
+    try:
+        output = Image.open(next(process_renditions(encoded.getvalue(), metadata))[2])
+    finally:
+        orientation.STRIP_METADATA = original
+    assert output.getexif()[orientation.ORIENTATION_TAG] == 1
+    assert output.getexif()[0x010f] == 'PhoneMaker'
+    
+    # Non-sRGB profiles are converted and dropped, sRGB ones are only dropped
+    wide = srgb.replace('sRGB'.encode('utf-16-be'), 'Wide'.encode('utf-16-be'))
+    tagged = Image.new('RGB', (8, 8), (200, 100, 50))
+    tagged.info['icc_profile'] = wide
+    assert color.needs_srgb_conversion(tagged)
+    converted = color.to_srgb(tagged)
+    assert 'icc_profile' not in converted.info
+    assert max(abs(a - b) for a, b in zip(converted.getpixel((0, 0)), (200, 100, 50))) <= 2
+    tagged.info['icc_profile'] = srgb
+    assert not color.needs_srgb_conversion(tagged)
+    
+    print("✓ Orientation and metadata test passed")
+
+
+def test_progressive_and_placeholder():
+    """Test progressive JPEG output and LQIP placeholders (decoded and fallback paths)"""
+    print("Testing progressive output and placeholders...")
+    
+    metadata = {'width': 400, 'height': 400, 'quality': 85, 'format': 'jpeg', 'watermark': None}
+    stored = Image.new('RGB', (1200, 600), (0, 0, 255))
+    exif = Image.Exif()
+    exif[orientation.ORIENTATION_TAG] = 6
+    encoded = BytesIO()
+    stored.save(encoded, format='JPEG', exif=exif.tobytes())
+    
+    details = {}
+    _, rendition, output = next(process_renditions(encoded.getvalue(), metadata, details=details))
+    assert Image.open(output).info.get('progressive')
+    assert rendition['output_size'] == (200, 400)
+    
+    # Placeholder of the upright image, with the full source size for layout
+    decoded = details['placeholder']
+    assert (decoded['width'], decoded['height']) == (600, 1200)
+    thumbnail = Image.open(BytesIO(base64.b64decode(decoded['src'].split(',', 1)[1])))
+    assert thumbnail.size == (8, 16)
+    assert len(decoded['src']) < 300
+    
+    # Without rendering (all renditions cached), it comes from a reduced decode
+    fallback = image_processor.source_placeholder(BytesIO(encoded.getvalue()))
+    assert (fallback['width'], fallback['height']) == (600, 1200)
+    assert Image.open(BytesIO(base64.b64decode(fallback['src'].split(',', 1)[1]))).size == (8, 16)
+    
+    print("✓ Progressive output and placeholder test passed")
+
+
+def test_download_source_spools_to_disk():
+    """Test that large sources spill to a temporary file instead of staying in memory"""
+    print("Testing spooled download...")
+    
+    fake_s3 = FakeS3Client()
+    fake_s3.objects[('src', 'uploads/big.png')] = {'Body': make_image_bytes(size=(1000, 1000), image_format='PNG')}
+    
+    original_client, original_spool = image_processor.s3_client, image_processor.SPOOL_MAX_SIZE
+    image_processor.s3_client, image_processor.SPOOL_MAX_SIZE = fake_s3, 1024
+    try:
+        source, digest, _ = image_processor.download_source('src', 'uploads/big.png')
+        with source:
+            assert source._rolled
+            assert Image.open(source).size == (1000, 1000)
+        assert digest == hashlib.sha256(fake_s3.objects[('src', 'uploads/big.png')]['Body']).hexdigest()
+    finally:
+        image_processor.s3_client, image_processor.SPOOL_MAX_SIZE = original_client, original_spool
+    
+    print("✓ Spooled download test passed")
+
+
+def test_dedup_cache():
+    """Test that identical uploads are copied instead of reprocessed"""
+    print("Testing dedup cache...")
+    
+    fake_s3 = FakeS3Client()
+    image_bytes = make_image_bytes()
+    for key in ['uploads/1_400x300_80_jpeg_none_a.jpg', 'uploads/2_400x300_80_jpeg_none_b.jpg',
+                'uploads/3_400x300_80_jpeg_none_c.jpg']:
+        fake_s3.objects[('src', key)] = {'Body': image_bytes}
+    
+    original_client, original_cache = image_processor.s3_client, image_processor.rendition_cache
+    image_processor.s3_client = fake_s3
+    image_processor.rendition_cache = create_cache('memory')
+    try:
+        first = image_processor.process_record('src', 'uploads/1_400x300_80_jpeg_none_a.jpg')
+        second = image_processor.process_record('src', 'uploads/2_400x300_80_jpeg_none_b.jpg')
+        
+        # Overwrite the cached object: the next lookup must not serve it
+        fake_s3.put_object(Bucket=image_processor.PROCESSED_BUCKET, Key='processed/a.jpeg', Body=b'other')
+        fake_s3.put_object(Bucket=image_processor.PROCESSED_BUCKET, Key='processed/b.jpeg', Body=b'other')
+        third = image_processor.process_record('src', 'uploads/3_400x300_80_jpeg_none_c.jpg')
+        stats = image_processor.rendition_cache.stats()
+    finally:
+        image_processor.s3_client, image_processor.rendition_cache = original_client, original_cache
+    
+    assert first['renditions'][0]['cached'] is False
+    assert second['renditions'][0]['cached'] is True
+    assert third['renditions'][0]['cached'] is False
+    assert fake_s3.copies == 1
+    assert stats == {'hits': 1, 'misses': 1, 'stale': 1}
+    
+    output = fake_s3.objects[(image_processor.PROCESSED_BUCKET, 'processed/c.jpeg')]['Body']
+    assert Image.open(BytesIO(output)).size == (400, 300)
+    
+    print("✓ Dedup cache test passed")
+
+
+def test_add_watermark_cached_region():
+    """Test that watermark tiles are reused and only the text region changes"""
+    print("Testing cached watermark...")
+    
+    image_processor.render_watermark_tile.cache_clear()
+    image = Image.new('RGB', (800, 600), (10, 200, 30))
+    
+    first = add_watermark(image, 'ImageHub')
+    second = add_watermark(image, 'ImageHub')
+    
+    assert image_processor.render_watermark_tile.cache_info().hits == 1
+    assert first.tobytes() == second.tobytes()
+    assert image.getpixel((790, 590)) == (10, 200, 30), "input image must not be modified"
+    
+    # Text is drawn in the bottom right corner only
+    bbox = ImageChops.difference(first, image).getbbox()
+    assert bbox[0] > 400 and bbox[1] > 500
+    
+    # Transparent inputs are flattened onto white
+    assert add_watermark(Image.new('RGBA', (200, 100), (0, 0, 0, 0)), 'ImageHub').getpixel((0, 0)) == (255, 255, 255)
+    
+    print("✓ Cached watermark test passed")
+
+
+def test_instrumentation_records_stages():
+    """Test that one metrics record per image is sent to the configured sink"""
+    print("Testing per-stage instrumentation...")
+    
+    fake_s3 = FakeS3Client()
+    key = 'uploads/1699889234_400x300_80_webp_ImageHub_photo.jpg'
+    fake_s3.objects[('src', key)] = {'Body': make_image_bytes()}
+    
+    records = []
+    original_client, original_cache = image_processor.s3_client, image_processor.rendition_cache
+    image_processor.s3_client, image_processor.rendition_cache = fake_s3, None
+    instrumentation.set_sink(records.append)
+    try:
+        image_processor.process_record('src', key)
+    finally:
+        instrumentation.set_sink(None)
+        image_processor.s3_client, image_processor.rendition_cache = original_client, original_cache
+    
+    assert len(records) == 1
+    record = records[0]
+    for stage in ('download', 'decode', 'resize', 'watermark', 'encode', 'upload'):
+        assert record[f"{stage.capitalize()}Ms"] > 0, stage
+    assert record['SourcePixels'] == 1600 * 1200
+    assert record['OutputPixels'] == 400 * 300
+    assert record['InputBytes'] == len(fake_s3.objects[('src', key)]['Body'])
+    assert record['OutputBytes'] > 0
+    assert record['sourceKey'] == key
+    
+    # Switched off at runtime
+    os.environ['METRICS_MODE'] = 'off'
+    try:
+        assert instrumentation.start_image(key) is instrumentation.NULL_METRICS
+    finally:
+        del os.environ['METRICS_MODE']
+    
+    print("✓ Instrumentation test passed")
+
+
+def test_handler_records_history():
+    """Test that uploads carrying a user id are sent to save_image_history in one async call"""
+    print("Testing server-side history recording...")
+    
+    class FakeLambdaClient:
+        def __init__(self):
+            self.invocations = []
+        
+        def invoke(self, FunctionName, InvocationType, Payload):
+            self.invocations.append((FunctionName, InvocationType, json.loads(Payload)))
+    
+    fake_s3 = FakeS3Client()
+    keys = [f"uploads/169988923{i}_400x300_80_jpeg_none_photo{i}.jpg" for i in range(3)]
+    for i, key in enumerate(keys):
+        fake_s3.objects[('src', key)] = {'Body': make_image_bytes(), 'Metadata': {'user-id': 'user-1'} if i else {}}
+    
+    fake_lambda = FakeLambdaClient()
+    original = image_processor.s3_client, image_processor.lambda_client, image_processor.HISTORY_FUNCTION_NAME
+    image_processor.s3_client, image_processor.lambda_client = fake_s3, fake_lambda
+    image_processor.HISTORY_FUNCTION_NAME = 'save-image-history'
+    try:
+        response = handler({'Records': [s3_record('src', key) for key in keys]}, None)
+    finally:
+        image_processor.s3_client, image_processor.lambda_client, image_processor.HISTORY_FUNCTION_NAME = original
+    
+    assert response['statusCode'] == 200
+    assert len(fake_lambda.invocations) == 1
+    function_name, invocation_type, payload = fake_lambda.invocations[0]
+    assert (function_name, invocation_type) == ('save-image-history', 'Event')
+    assert [entry['originalKey'] for entry in payload['items']] == keys[1:]
+    entry = payload['items'][0]
+    placeholder = entry.pop('placeholder')
+    assert entry == {
+        'userId': 'user-1',
+        'originalKey': keys[1],
+        'processedKey': 'processed/photo1.jpeg',
+        'metadata': {'width': 400, 'height': 300, 'quality': 80, 'format': 'jpeg', 'watermark': None, 'renditions': [],
+                     'outputWidth': 400, 'outputHeight': 300}
+    }
+    assert placeholder['src'].startswith('data:image/webp;base64,')
+    assert (placeholder['width'], placeholder['height']) == (1600, 1200)
+    
+    print("✓ Server-side history test passed")
+
+
+def test_handler_manifest():
+    """Test that options come from the upload manifest (metadata or sidecar) instead of the key"""
+    print("Testing processing manifest...")
+    
+    job_manifest = {
+        'version': 1, 'outputName': 'my_photo', 'width': 300, 'height': 200, 'quality': 80,
+        'format': 'webp', 'watermark': 'My_Brand', 'renditions': [{'name': 'thumb', 'width': 100, 'height': 100}]
+    }
+    # Underscores in the watermark and filename break key parsing
+    key = "uploads/1699889234_800x600_85_jpeg_My_Brand_my_photo.jpg"
+    sidecar_key = "uploads/1699889235_800x600_85_jpeg_none_large.jpg"
+    
+    fake_s3 = FakeS3Client()
+    fake_s3.objects[('src', key)] = {'Body': make_image_bytes(), 'Metadata': {'manifest': json.dumps(job_manifest)}}
+    fake_s3.objects[('src', sidecar_key)] = {'Body': make_image_bytes(size=(800, 600)),
+                                             'Metadata': {'manifest-key': 'manifests/large.json'}}
+    fake_s3.objects[('src', 'manifests/large.json')] = {
+        'Body': json.dumps(dict(job_manifest, outputName='large', format='png', watermark=None)).encode('utf-8')
+    }
+    
+    original_client = image_processor.s3_client
+    image_processor.s3_client = fake_s3
+    try:
+        response = handler({'Records': [s3_record('src', key), s3_record('src', sidecar_key)]}, None)
+    finally:
+        image_processor.s3_client = original_client
+    
+    assert response['statusCode'] == 200, response
+    outputs = {output_key: Image.open(BytesIO(stored['Body']))
+               for (bucket, output_key), stored in fake_s3.objects.items() if bucket == image_processor.PROCESSED_BUCKET}
+    assert {output_key: (output.format, output.size) for output_key, output in outputs.items()} == {
+        'processed/my_photo.webp': ('WEBP', (267, 200)),
+        'processed/my_photo_thumb.webp': ('WEBP', (100, 75)),
+        'processed/large.png': ('PNG', (267, 200)),
+        'processed/large_thumb.png': ('PNG', (100, 75))
+    }
+    
+    # Unsupported manifest versions fail the record instead of falling back to defaults
+    fake_s3.objects[('src', key)]['Metadata'] = {'manifest': json.dumps(dict(job_manifest, version=99))}
+    image_processor.s3_client = fake_s3
+    try:
+        response = handler({'Records': [s3_record('src', key)]}, None)
+    finally:
+        image_processor.s3_client = original_client
+    assert response['statusCode'] == 500
+    
+    # outputName names the processed keys, a missing or unsafe one is a validation error
+    for output_name in (None, '../private/x', ''):
+        bad = {name: value for name, value in dict(job_manifest, outputName=output_name).items() if value is not None}
+        try:
+            manifest.loads(json.dumps(bad))
+        except ValueError as e:
+            assert 'outputName' in str(e)
+        else:
+            raise AssertionError(f"accepted outputName {output_name!r}")
+    
+    print("✓ Processing manifest test passed")
+
+
 def test_handler_event():
     """Test Lambda handler with mock S3 event"""
     print("Testing Lambda handler...")
     
+    key = 'uploads/1699889234_800x600_85_jpeg_none_test.jpg'
+    fake_s3 = FakeS3Client()
+    fake_s3.objects[('test-source-bucket', key)] = {'Body': make_image_bytes()}
+    
     # Mock S3 event
     event = {
         'Records': [{
@@ -54,16 +812,153 @@ def test_handler_event():
                     'name': 'test-source-bucket'
                 },
                 'object': {
-                    'key': 'uploads/1699889234_800x600_85_jpeg_none_test.jpg'
+                    'key': key
                 }
             }
         }]
     }
     
-    # Note: This will fail without actual S3 access
-    # For full testing, use localstack or moto
-    print("Mock event created successfully")
-    print(json.dumps(event, indent=2))
+    original_client = image_processor.s3_client
+    image_processor.s3_client = fake_s3
+    try:
+        response = handler(event, None)
+    finally:
+        image_processor.s3_client = original_client
+    
+    assert response['statusCode'] == 200
+    output = Image.open(BytesIO(fake_s3.objects[(image_processor.PROCESSED_BUCKET, 'processed/test.jpeg')]['Body']))
+    assert (output.format, output.size) == ('JPEG', (800, 600))
+    
+    print("✓ Lambda handler test passed")
+
+
+def test_handler_records_status():
+    """Test completion records for processed and failed uploads"""
+    print("Testing completion records...")
+    
+    class FakeStatusTable:
+        def __init__(self):
+            self.items = {}
+        
+        def put_item(self, TableName, Item):
+            assert TableName == 'job-status'
+            self.items[Item['uploadKey']['S']] = from_item(Item)
+    
+    fake_s3 = FakeS3Client()
+    key = 'uploads/1699889234_400x300_80_jpeg_none_photo.jpg'
+    fake_s3.objects[('src', key)] = {'Body': make_image_bytes()}
+    fake_table = FakeStatusTable()
+    
+    original = image_processor.s3_client, job_status.dynamodb_client, job_status.STATUS_TABLE
+    image_processor.s3_client, job_status.dynamodb_client, job_status.STATUS_TABLE = fake_s3, fake_table, 'job-status'
+    try:
+        handler({'Records': [s3_record('src', key), s3_record('src', 'uploads/missing.jpg')]}, None)
+    finally:
+        image_processor.s3_client, job_status.dynamodb_client, job_status.STATUS_TABLE = original
+    
+    done = fake_table.items[key]
+    assert done['status'] == 'done' and done['processedKey'] == 'processed/photo.jpeg'
+    assert done['placeholder']['src'].startswith('data:image/')
+    assert done['timings']['TotalMs'] > 0 and 'EncodeMs' in done['timings']
+    assert done['ttl'] > 0
+    
+    failed = fake_table.items['uploads/missing.jpg']
+    assert failed['status'] == 'failed' and failed['error']
+    assert 'processedKey' not in failed
+    
+    print("✓ Completion record test passed")
+
+
+def test_handler_batch_partial_failure():
+    """Test that every record is processed and failures are reported per record"""
+    print("Testing batch event with a failing record...")
+    
+    fake_s3 = FakeS3Client()
+    good_keys = [f"uploads/169988923{i}_400x300_80_jpeg_none_photo{i}.jpg" for i in range(3)]
+    for key in good_keys:
+        fake_s3.objects[('src', key)] = {'Body': make_image_bytes()}
+    
+    original_client = image_processor.s3_client
+    image_processor.s3_client = fake_s3
+    try:
+        event = {'Records': [s3_record('src', key) for key in good_keys] + [s3_record('src', 'uploads/missing.jpg')]}
+        response = handler(event, None)
+    finally:
+        image_processor.s3_client = original_client
+    
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 207
+    assert len(body['results']) == 3
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'uploads/missing.jpg'}]
+    
+    for i in range(3):
+        stored = fake_s3.objects[(image_processor.PROCESSED_BUCKET, f"processed/photo{i}.jpeg")]
+        assert Image.open(BytesIO(stored['Body'])).size == (400, 300)
+    
+    print("✓ Batch partial failure test passed")
+
+
+def test_handler_sqs_event():
+    """Test S3 notifications delivered through SQS"""
+    print("Testing SQS-wrapped S3 event...")
+    
+    fake_s3 = FakeS3Client()
+    key = "uploads/1699889234_200x200_80_webp_none_photo.png"
+    fake_s3.objects[('src', key)] = {'Body': make_image_bytes(mode='RGBA', image_format='PNG')}
+    
+    event = {'Records': [
+        {'eventSource': 'aws:sqs', 'messageId': 'msg-1', 'body': json.dumps({'Records': [s3_record('src', key)]})},
+        {'eventSource': 'aws:sqs', 'messageId': 'msg-2', 'body': 'not json'}
+    ]}
+    
+    original_client = image_processor.s3_client
+    image_processor.s3_client = fake_s3
+    try:
+        response = handler(event, None)
+    finally:
+        image_processor.s3_client = original_client
+    
+    assert response['statusCode'] == 207
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'msg-2'}]
+    assert (image_processor.PROCESSED_BUCKET, 'processed/photo.webp') in fake_s3.objects
+    
+    print("✓ SQS event test passed")
+
+
+def test_handler_sqs_malformed_message():
+    """Test that a message without S3 records fails alone, and that an unexpected error fails every message"""
+    print("Testing malformed SQS message...")
+    
+    fake_s3 = FakeS3Client()
+    key = "uploads/1699889234_200x150_80_jpeg_none_photo.jpg"
+    fake_s3.objects[('src', key)] = {'Body': make_image_bytes()}
+    
+    event = {'Records': [
+        {'eventSource': 'aws:sqs', 'messageId': 'msg-bad', 'body': json.dumps({'Records': [{'eventName': 'x'}]})},
+        {'eventSource': 'aws:sqs', 'messageId': 'msg-good', 'body': json.dumps({'Records': [s3_record('src', key)]})}
+    ]}
+    
+    original_client = image_processor.s3_client
+    original_extract = image_processor.extract_s3_records
+    image_processor.s3_client = fake_s3
+    try:
+        response = handler(event, None)
+        
+        def broken(event):
+            raise RuntimeError('unexpected')
+        image_processor.extract_s3_records = broken
+        crashed = handler(event, None)
+    finally:
+        image_processor.s3_client = original_client
+        image_processor.extract_s3_records = original_extract
+    
+    assert response['statusCode'] == 207
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'msg-bad'}]
+    assert "KeyError" in json.loads(response['body'])['errors'][0]['error']
+    assert (image_processor.PROCESSED_BUCKET, 'processed/photo.jpeg') in fake_s3.objects
+    assert crashed['batchItemFailures'] == [{'itemIdentifier': 'msg-bad'}, {'itemIdentifier': 'msg-good'}]
+    
+    print("✓ Malformed SQS message test passed")
 
 
 if __name__ == '__main__':
@@ -75,7 +970,27 @@ if __name__ == '__main__':
     try:
         test_get_image_metadata()
         test_invalid_metadata()
+        test_fit_size_matches_thumbnail()
+        test_process_renditions()
+        test_process_pool_renditions()
+        test_processing_profiles()
+        test_adaptive_encoding()
+        test_load_reduced()
+        test_banded_decode()
+        test_color_pipeline()
+        test_orientation_and_metadata()
+        test_progressive_and_placeholder()
+        test_download_source_spools_to_disk()
+        test_dedup_cache()
+        test_add_watermark_cached_region()
+        test_instrumentation_records_stages()
+        test_handler_records_history()
+        test_handler_manifest()
         test_handler_event()
+        test_handler_records_status()
+        test_handler_batch_partial_failure()
+        test_handler_sqs_event()
+        test_handler_sqs_malformed_message()
         
         print()
         print("=" * 50)
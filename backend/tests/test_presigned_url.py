@@ -9,8 +9,11 @@ import os
 
 # Add lambda directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas/get_presigned_url'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas'))
 
+import handler as presigned_url
 from handler import validate_request, generate_object_key
+from botocore.exceptions import ClientError
 
 
 def test_validate_request_valid():
@@ -46,49 +49,163 @@ def test_validate_request_invalid():
     errors = validate_request(body)
     assert len(errors) > 0, "Expected validation errors"
     
+    # The filename names the processed objects: it must make a single key segment
+    for filename in ('../x/photo.jpg', '.jpg', '..'):
+        errors = validate_request({'filename': filename, 'contentType': 'image/jpeg'})
+        assert len(errors) == 1 and errors[0].startswith('outputName'), (filename, errors)
+    assert validate_request({'filename': 42, 'contentType': 'image/jpeg'}) == ['filename must be a string']
+    
     print(f"✓ Invalid request test passed (found {len(errors)} errors)")
 
 
+def test_validate_request_user_id():
+    """Test user id validation (sent as S3 object metadata)"""
+    print("Testing userId validation...")
+    
+    body = {'filename': 'test.jpg', 'contentType': 'image/jpeg', 'userId': 'a1b2c3d4-0000-1111-2222-333344445555'}
+    assert validate_request(body) == []
+    
+    for user_id in ['', 'ngườidùng', 'x' * 129, 42]:
+        errors = validate_request(dict(body, userId=user_id))
+        assert errors == ['userId must be an ASCII string of at most 128 characters'], user_id
+    
+    print("✓ userId validation test passed")
+
+
 def test_generate_object_key():
     """Test S3 object key generation"""
     print("Testing object key generation...")
     
-    key = generate_object_key(
-        filename='test photo.jpg',
-        width=800,
-        height=600,
-        quality=85,
-        output_format='jpeg',
-        watermark='ImageHub'
-    )
-    
-    assert 'uploads/' in key
-    assert '800x600' in key
-    assert '85' in key
-    assert 'jpeg' in key
-    assert 'ImageHub' in key
-    assert 'test_photo.jpg' in key
+    key = generate_object_key('test photo.jpg')
+    
+    # Options travel in the manifest, the key only identifies the upload
+    assert key.startswith('uploads/')
+    assert key.endswith('_test_photo.jpg')
+    assert key != generate_object_key('test photo.jpg')
     
     print(f"✓ Generated key: {key}")
 
 
-def test_generate_object_key_no_watermark():
-    """Test object key generation without watermark"""
-    print("Testing object key without watermark...")
+def test_manifest_metadata():
+    """Test that processing options are sent as a manifest in the upload's metadata"""
+    print("Testing processing manifest...")
     
-    key = generate_object_key(
-        filename='test.jpg',
-        width=1024,
-        height=768,
-        quality=90,
-        output_format='png',
-        watermark=None
-    )
+    class FakeS3Client:
+        def __init__(self):
+            self.objects = {}
+        
+        def generate_presigned_url(self, operation, Params, ExpiresIn, HttpMethod):
+            self.params = Params
+            return 'https://example.com/upload'
+        
+        def put_object(self, Bucket, Key, Body, ContentType):
+            self.objects[Key] = json.loads(Body)
     
-    assert 'none' in key
-    assert 'png' in key
+    body = {'filename': 'my photo.jpg', 'contentType': 'image/jpeg', 'width': 400, 'height': 300,
+            'format': 'webp', 'watermark': 'Ảnh_của_tôi'}
+    fake_s3 = FakeS3Client()
+    original_client = presigned_url.s3_client
+    presigned_url.s3_client = fake_s3
+    try:
+        response = json.loads(presigned_url.handler({'body': json.dumps(body)}, None)['body'])
+        
+        # Manifests too large for object metadata go to a sidecar
+        renditions = [{'name': f'size-{i}', 'width': 100 * (i + 1), 'height': 100 * (i + 1)} for i in range(10)]
+        large = json.loads(presigned_url.handler({'body': json.dumps(dict(body, renditions=renditions, watermark='Ả' * 200))}, None)['body'])
+    finally:
+        presigned_url.s3_client = original_client
     
-    print(f"✓ Generated key: {key}")
+    assert response['processedKey'] == 'processed/my_photo.webp'
+    manifest = json.loads(response['uploadHeaders']['x-amz-meta-manifest'])
+    assert response['uploadHeaders']['x-amz-meta-manifest'].isascii()
+    assert manifest == {'version': 1, 'outputName': 'my_photo', 'width': 400, 'height': 300, 'quality': 85,
+                        'format': 'webp', 'watermark': 'Ảnh_của_tôi'}
+    
+    sidecar_key = large['uploadHeaders']['x-amz-meta-manifest-key']
+    assert 'x-amz-meta-manifest' not in large['uploadHeaders']
+    assert fake_s3.params['Metadata'] == {'manifest-key': sidecar_key}
+    assert fake_s3.objects[sidecar_key]['renditions'] == renditions
+    
+    errors = validate_request(dict(body, renditions=[{'name': 'bad name', 'width': 0, 'height': 100}]))
+    assert errors == ['renditions[0].name must be unique, 1-32 letters, digits or dashes',
+                      'renditions[0].width must be between 1 and 4000']
+    
+    print("✓ Processing manifest test passed")
+
+
+def test_batch_and_multipart():
+    """Test signing a batch of files, with multipart uploads for large ones"""
+    print("Testing batch and multipart uploads...")
+    
+    class FakeS3Client:
+        def __init__(self):
+            self.created = []
+            self.completed = []
+        
+        def generate_presigned_url(self, operation, Params, ExpiresIn, HttpMethod):
+            return f"https://example.com/{operation}/{Params['Key']}/{Params.get('PartNumber', '')}"
+        
+        def create_multipart_upload(self, **params):
+            self.created.append(params)
+            return {'UploadId': f'upload-{len(self.created)}'}
+        
+        def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+            if UploadId != 'upload-1':
+                raise ClientError({'Error': {'Code': 'NoSuchUpload', 'Message': 'gone'}}, 'CompleteMultipartUpload')
+            self.completed.append((Key, MultipartUpload['Parts']))
+    
+    def call(body):
+        response = presigned_url.handler({'body': json.dumps(body)}, None)
+        return response['statusCode'], json.loads(response['body'])
+    
+    fake_s3 = FakeS3Client()
+    original_client = presigned_url.s3_client
+    presigned_url.s3_client = fake_s3
+    try:
+        # Options outside 'files' apply to every file
+        status_code, body = call({'width': 400, 'height': 300, 'format': 'webp', 'files': [
+            {'filename': 'a.jpg', 'contentType': 'image/jpeg', 'size': 200000},
+            {'filename': 'b.png', 'contentType': 'image/png', 'size': 11 * 1024 * 1024 // 10 * 9, 'format': 'png'},
+        ]})
+        assert status_code == 200 and len(body['uploads']) == 2
+        single, multipart = body['uploads']
+        assert single['uploadUrl'].startswith('https://example.com/put_object/') and 'multipart' not in single
+        assert single['processedKey'] == 'processed/a.webp'
+        assert json.loads(single['uploadHeaders']['x-amz-meta-manifest'])['width'] == 400
+        
+        # 9.9MB in 5MB parts, content type and manifest set when the upload is created
+        assert multipart['uploadUrl'] is None and multipart['processedKey'] == 'processed/b.png'
+        assert multipart['multipart']['uploadId'] == 'upload-1'
+        assert [part['partNumber'] for part in multipart['multipart']['parts']] == [1, 2]
+        assert fake_s3.created[0]['Key'] == multipart['key'] and fake_s3.created[0]['ContentType'] == 'image/png'
+        assert 'manifest' in fake_s3.created[0]['Metadata']
+        
+        # The whole batch is rejected with the index of each invalid file
+        status_code, body = call({'files': [{'filename': 'a.jpg', 'contentType': 'image/jpeg'},
+                                            {'filename': 'b.gif', 'contentType': 'image/gif', 'size': 20 * 1024 * 1024}]})
+        assert status_code == 400
+        assert body['errors'] == ['files[1].contentType must be one of: image/jpeg, image/jpg, image/png, image/webp',
+                                  f'files[1].size must be between 1 and {presigned_url.MAX_FILE_SIZE} bytes']
+        assert call({'files': []})[0] == 400
+        
+        # Completion sends the parts in order
+        status_code, body = call({'action': 'complete', 'key': multipart['key'], 'uploadId': 'upload-1',
+                                  'parts': [{'partNumber': 2, 'etag': '"b"'}, {'partNumber': 1, 'etag': '"a"'}]})
+        assert status_code == 200 and body == {'key': multipart['key'], 'completed': True}
+        assert fake_s3.completed == [(multipart['key'], [{'PartNumber': 1, 'ETag': '"a"'}, {'PartNumber': 2, 'ETag': '"b"'}])]
+        
+        status_code, body = call({'action': 'complete', 'key': multipart['key'], 'uploadId': 'upload-9',
+                                  'parts': [{'partNumber': 1, 'etag': '"a"'}]})
+        assert status_code == 400 and body['errors'] == ['NoSuchUpload: gone']
+        
+        status_code, body = call({'action': 'complete', 'key': 'processed/a.png', 'uploadId': 'upload-1', 'parts': [{'partNumber': 0}]})
+        assert status_code == 400 and body['errors'] == ['key must be an upload key (uploads/...)',
+                                                          'parts[0].partNumber must be between 1 and 10000',
+                                                          'parts[0].etag is required']
+    finally:
+        presigned_url.s3_client = original_client
+    
+    print("✓ Batch and multipart test passed")
 
 
 def test_mock_api_gateway_event():
@@ -123,8 +240,10 @@ if __name__ == '__main__':
     try:
         test_validate_request_valid()
         test_validate_request_invalid()
+        test_validate_request_user_id()
         test_generate_object_key()
-        test_generate_object_key_no_watermark()
+        test_manifest_metadata()
+        test_batch_and_multipart()
         test_mock_api_gateway_event()
         
         print()
@@ -0,0 +1,197 @@
+"""
+Local testing script for Save Image History Lambda
+Run: python test_save_image_history.py
+"""
+
+import json
+import sys
+import os
+from decimal import Decimal
+
+# Add lambda directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas/save_image_history'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../lambdas'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import handler as save_image_history
+from handler import lambda_handler, convert_to_decimal
+from common import from_item
+
+
+class FakeDynamoDBClient:
+    """Stand-in for batch_write_item that leaves some items unprocessed"""
+    
+    def __init__(self, unprocessed_rounds=1):
+        self.unprocessed_rounds = unprocessed_rounds
+        self.calls = []
+        self.items = []
+    
+    def batch_write_item(self, RequestItems):
+        (table_name, requests), = RequestItems.items()
+        self.calls.append(len(requests))
+        assert len(requests) <= 25
+        
+        # Accept at most the first request, hand the rest back as unprocessed
+        if self.unprocessed_rounds > 0:
+            self.unprocessed_rounds -= 1
+            accepted = 1 if len(requests) > 1 else 0
+            self.items.extend(from_item(request['PutRequest']['Item']) for request in requests[:accepted])
+            return {'UnprocessedItems': {table_name: requests[accepted:]}}
+        
+        self.items.extend(from_item(request['PutRequest']['Item']) for request in requests)
+        return {'UnprocessedItems': {}}
+
+
+def run_with_client(fake_client, event):
+    original_client, original_backoff = save_image_history.dynamodb_client, save_image_history.BACKOFF_BASE
+    save_image_history.dynamodb_client, save_image_history.BACKOFF_BASE = fake_client, 0
+    try:
+        return lambda_handler(event, None)
+    finally:
+        save_image_history.dynamodb_client, save_image_history.BACKOFF_BASE = original_client, original_backoff
+
+
+def test_convert_to_decimal():
+    """Test float/int conversion for DynamoDB"""
+    print("Testing Decimal conversion...")
+    
+    converted = convert_to_decimal({'width': 800, 'ratio': 1.5, 'tags': [1, 'a'], 'watermark': None, 'flag': True})
+    
+    assert converted == {'width': Decimal('800'), 'ratio': Decimal('1.5'), 'tags': [Decimal('1'), 'a'],
+                         'watermark': None, 'flag': True}
+    
+    print("✓ Decimal conversion test passed")
+
+
+def test_batch_save_retries_unprocessed():
+    """Test batch writes of 60 entries with unprocessed items"""
+    print("Testing batch save...")
+    
+    entries = [{'userId': 'user-1', 'processedKey': f'processed/{i}.jpeg', 'metadata': {'width': 800}}
+               for i in range(60)]
+    fake_client = FakeDynamoDBClient(unprocessed_rounds=2)
+    
+    response = run_with_client(fake_client, {'body': json.dumps({'items': entries})})
+    body = json.loads(response['body'])
+    
+    assert response['statusCode'] == 200, body
+    assert body['saved'] == 60
+    assert len(fake_client.items) == 60
+    assert fake_client.items[0]['metadata'] == {'width': Decimal('800')}
+    # 3 chunks (25, 25, 10) plus 2 retries of unprocessed items
+    assert fake_client.calls == [25, 24, 23, 25, 10]
+    # Timestamps are unique so no key is dropped
+    assert len({item['timestamp'] for item in fake_client.items}) == 60
+    
+    print("✓ Batch save test passed")
+
+
+def test_batch_save_reports_invalid_and_unprocessed():
+    """Test partial failures in a batch"""
+    print("Testing batch save partial failure...")
+    
+    entries = [
+        {'userId': 'user-1', 'processedKey': 'processed/a.jpeg', 'timestamp': '2024-01-01T00:00:00'},
+        {'userId': 'user-1'},
+        {'userId': 'user-1', 'processedKey': 'processed/b.jpeg', 'timestamp': '2024-01-01T00:00:01'}
+    ]
+    fake_client = FakeDynamoDBClient(unprocessed_rounds=100)
+    
+    original_attempts = save_image_history.MAX_WRITE_ATTEMPTS
+    save_image_history.MAX_WRITE_ATTEMPTS = 3
+    try:
+        response = run_with_client(fake_client, {'items': entries})
+    finally:
+        save_image_history.MAX_WRITE_ATTEMPTS = original_attempts
+    body = json.loads(response['body'])
+    
+    assert response['statusCode'] == 207
+    assert body['errors'] == [{'index': 1, 'error': 'userId and processedKey are required'}]
+    assert body['saved'] == 1
+    assert body['unprocessed'] == [{'userId': 'user-1', 'timestamp': '2024-01-01T00:00:01'}]
+    
+    print("✓ Batch partial failure test passed")
+
+
+def test_batch_save_rejects_empty():
+    """Test validation of the items list"""
+    print("Testing empty batch...")
+    
+    response = run_with_client(FakeDynamoDBClient(), {'items': []})
+    assert response['statusCode'] == 400
+    
+    print("✓ Empty batch test passed")
+
+
+def test_batch_save_rejects_invalid_timestamp():
+    """Test that client timestamps must be ISO-8601 strings and nothing is written otherwise"""
+    print("Testing batch timestamp validation...")
+    
+    fake_client = FakeDynamoDBClient(unprocessed_rounds=0)
+    response = run_with_client(fake_client, {'items': [
+        {'userId': 'u1', 'processedKey': 'processed/a.jpeg', 'timestamp': 1704067200},
+        {'userId': 'u1', 'processedKey': 'processed/b.jpeg', 'timestamp': 'yesterday'}
+    ]})
+    body = json.loads(response['body'])
+    
+    assert response['statusCode'] == 400
+    assert [error['index'] for error in body['errors']] == [0, 1]
+    assert body['errors'][0]['error'] == 'timestamp must be an ISO-8601 string'
+    assert fake_client.calls == [] and fake_client.items == []
+    
+    response = run_with_client(fake_client, {'items': [
+        {'userId': 'u1', 'processedKey': 'processed/a.jpeg', 'timestamp': ['2024-01-01']},
+        {'userId': 'u1', 'processedKey': 'processed/b.jpeg', 'timestamp': '2024-01-01T00:00:00+00:00'}
+    ]})
+    body = json.loads(response['body'])
+    
+    assert response['statusCode'] == 207
+    assert body['saved'] == 1 and body['errors'][0]['index'] == 0
+    assert fake_client.items[0]['timestamp'] == '2024-01-01T00:00:00+00:00'
+    
+    print("✓ Batch timestamp validation test passed")
+
+
+def test_placeholder_saved_inline():
+    """Test that a valid placeholder is stored with the item and an invalid one is rejected"""
+    print("Testing inline placeholder...")
+    
+    placeholder = {'src': 'data:image/webp;base64,UklGRg==', 'width': 1600, 'height': 1200}
+    fake_client = FakeDynamoDBClient(unprocessed_rounds=0)
+    response = run_with_client(fake_client, {'items': [
+        {'userId': 'u1', 'processedKey': 'processed/a.jpeg', 'placeholder': placeholder},
+        {'userId': 'u1', 'processedKey': 'processed/b.jpeg', 'placeholder': {'src': 'javascript:alert(1)', 'width': 1, 'height': 1}}
+    ]})
+    body = json.loads(response['body'])
+    
+    assert response['statusCode'] == 207
+    assert body['saved'] == 1 and body['errors'][0]['index'] == 1
+    assert fake_client.items[0]['placeholder'] == {'src': placeholder['src'], 'width': Decimal('1600'), 'height': Decimal('1200')}
+    
+    print("✓ Inline placeholder test passed")
+
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("Testing Save Image History Lambda")
+    print("=" * 50)
+    print()
+    
+    try:
+        test_convert_to_decimal()
+        test_batch_save_retries_unprocessed()
+        test_batch_save_reports_invalid_and_unprocessed()
+        test_batch_save_rejects_empty()
+        test_batch_save_rejects_invalid_timestamp()
+        test_placeholder_saved_inline()
+        
+        print()
+        print("=" * 50)
+        print("✓ All tests passed!")
+        print("=" * 50)
+    except Exception as e:
+        print()
+        print("=" * 50)
+        print(f"✗ Test failed: {str(e)}")
+        print("=" * 50)
+        raise
@@ -1,7 +1,7 @@
 import { useState, useEffect } from "react";
 import "./App.css";
 
-import { validateFile, processImage} from "./services/api";
+import { validateFile, processImage, saveImageHistory, SERVER_SIDE_HISTORY } from "./services/api";
 import { createImagePreview, safeParseInt } from "./utils/helpers";
 
 //  THƯ VIỆN AMPLIFY
@@ -112,7 +112,7 @@ function App() {
             setProcessedImage(processedImageUrl);
 
             // Lưu lịch sử nếu user đã đăng nhập
-            if (user && uploadedKey) {
+            if (user && uploadedKey && !SERVER_SIDE_HISTORY) {
 
                 const { getCurrentUser: getUser } = await import('./services/auth.js');
                 const currentUser = await getUser();
@@ -3,12 +3,26 @@ import { getImageHistory } from '../services/api';
 import { getCurrentUser } from '../services/auth';
 import './ImageHistory.css';
 
+const PAGE_SIZE = 20;
+// Chỉ lấy các thuộc tính cần để hiển thị (processedKey + metadata để backend tạo srcset)
+const HISTORY_FIELDS = ['processedKey', 'metadata', 'placeholder', 'cloudfront-url'];
+// Độ rộng hiển thị của ô ảnh theo breakpoint trong ImageHistory.css
+const THUMBNAIL_SIZES = '(max-width: 480px) 100vw, (max-width: 768px) 50vw, 400px';
+
+// Ảnh xem trước siêu nhỏ (data URI) hiển thị làm nền mờ trong lúc tải ảnh thật
+const placeholderStyle = (item) => (
+  item.placeholder?.src ? { backgroundImage: `url("${item.placeholder.src}")` } : undefined
+);
+
 function ImageHistory({ onClose }) {
   const [history, setHistory] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [selectedImage, setSelectedImage] = useState(null);
   const [userId, setUserId] = useState(null);
+  const [nextToken, setNextToken] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [loadedImages, setLoadedImages] = useState({});
 
   useEffect(() => {
     loadHistory();
@@ -24,10 +38,11 @@ function ImageHistory({ onClose }) {
       const fetchedUserId = currentUser?.userId || 'temp';
       setUserId(fetchedUserId);
       
-      const data = await getImageHistory(fetchedUserId, 50);
+      const data = await getImageHistory(fetchedUserId, PAGE_SIZE, { fields: HISTORY_FIELDS });
       console.log('History data received:', data);
       console.log('History items:', data.items);
       setHistory(data.items || []);
+      setNextToken(data.nextToken || null);
     } catch (err) {
       setError(err.message || 'Không thể tải lịch sử ảnh');
       console.error('Load history error:', err);
@@ -36,6 +51,21 @@ function ImageHistory({ onClose }) {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextToken || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const data = await getImageHistory(userId, PAGE_SIZE, { fields: HISTORY_FIELDS, nextToken });
+      setHistory((items) => [...items, ...(data.items || [])]);
+      setNextToken(data.nextToken || null);
+    } catch (err) {
+      setError(err.message || 'Không thể tải lịch sử ảnh');
+      console.error('Load more history error:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDownload = async (url) => {
     try {
       const response = await fetch(url);
@@ -102,24 +132,36 @@ function ImageHistory({ onClose }) {
             {history.map((item, index) => {
               console.log(`Item ${index}:`, {
                 processedKey: item.processedKey,
-                cloudfrontUrl: item['cloudfront-url'],
+                processedUrl: item.processedUrl,
                 metadata: item.metadata
               });
               
+              const imageKey = `${item.userId}-${item.timestamp}`;
               return (
               <div key={`${item.userId}-${item.timestamp}-${index}`} className="history-item">
-                <div className="history-image-container" onClick={() => setSelectedImage(item)}>
-                  {item['cloudfront-url'] ? (
+                <div
+                  className={`history-image-container${item.placeholder?.src ? ' has-placeholder' : ''}`}
+                  style={placeholderStyle(item)}
+                  onClick={() => setSelectedImage(item)}
+                >
+                  {item.processedUrl ? (
                     <img 
-                      src={item['cloudfront-url']} 
+                      src={item.processedUrl} 
+                      srcSet={item.srcset}
+                      sizes={item.srcset ? THUMBNAIL_SIZES : undefined}
+                      width={item.placeholder?.width}
+                      height={item.placeholder?.height}
+                      className={loadedImages[imageKey] ? 'loaded' : undefined}
                       alt={`Processed ${item.timestamp}`}
                       loading="lazy"
+                      decoding="async"
                       onError={(e) => {
-                        console.error('Image load error:', item['cloudfront-url']);
+                        console.error('Image load error:', item.processedUrl);
+                        e.target.removeAttribute('srcset');
                         e.target.src = 'data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg" width="200" height="200"><rect fill="%23ddd"/><text x="50%" y="50%" fill="%23999" text-anchor="middle">No Image</text></svg>';
                       }}
                       onLoad={() => {
-                        console.log('Image loaded successfully:', item['cloudfront-url']);
+                        setLoadedImages((loaded) => ({ ...loaded, [imageKey]: true }));
                       }}
                     />
                   ) : (
@@ -149,9 +191,9 @@ function ImageHistory({ onClose }) {
                       )}
                     </div>
                   )}
-                  {item['cloudfront-url'] && (
+                  {item.processedUrl && (
                     <button 
-                      onClick={() => handleDownload(item['cloudfront-url'])}
+                      onClick={() => handleDownload(item.processedUrl)}
                       className="download-btn-small"
                     >
                       <svg width="16" height="16" viewBox="0 0 24 24" fill="none">
@@ -167,8 +209,16 @@ function ImageHistory({ onClose }) {
           </div>
         )}
 
+        {!loading && !error && nextToken && (
+          <div className="history-load-more">
+            <button onClick={loadMore} className="retry-btn" disabled={loadingMore}>
+              {loadingMore ? 'Đang tải...' : 'Tải thêm'}
+            </button>
+          </div>
+        )}
+
         {/* Modal xem ảnh phóng to */}
-        {selectedImage && selectedImage['cloudfront-url'] && (
+        {selectedImage && selectedImage.processedUrl && (
           <div className="image-preview-modal" onClick={() => setSelectedImage(null)}>
             <div className="image-preview-content" onClick={(e) => e.stopPropagation()}>
               <button 
@@ -178,10 +228,17 @@ function ImageHistory({ onClose }) {
               >
                 &times;
               </button>
-              <img src={selectedImage['cloudfront-url']} alt="Preview" />
+              <img
+                src={selectedImage.processedUrl}
+                srcSet={selectedImage.srcset}
+                sizes={selectedImage.srcset ? '90vw' : undefined}
+                style={placeholderStyle(selectedImage)}
+                className="preview-image"
+                alt="Preview"
+              />
               <div className="preview-actions">
                 <button 
-                  onClick={() => handleDownload(selectedImage['cloudfront-url'], selectedImage.timestamp)}
+                  onClick={() => handleDownload(selectedImage.processedUrl, selectedImage.timestamp)}
                   className="download-btn-large"
                 >
                   <svg width="20" height="20" viewBox="0 0 24 24" fill="none">
@@ -6,6 +6,14 @@ const API_GATEWAY_URL = import.meta.env.VITE_API_GATEWAY_URL || 'https://8rzkjed
 const CLOUDFRONT_URL = import.meta.env.VITE_CLOUDFRONT_URL || 'https://d14vg5o4yx9zqx.cloudfront.net'
 const SAVE_HISTORY_URL = import.meta.env.VITE_SAVE_HISTORY_URL
 const GET_HISTORY_URL = import.meta.env.VITE_GET_HISTORY_URL || 'https://8rzkjedi72.execute-api.ap-southeast-1.amazonaws.com/v1/history'
+// Endpoint long-poll trạng thái xử lý (get_processing_status); không cấu hình thì quay lại HEAD polling
+const STATUS_URL = import.meta.env.VITE_STATUS_URL
+const STATUS_WAIT_SECONDS = 20
+const STATUS_TIMEOUT = 90000
+// Số part của multipart upload được tải song song
+const MULTIPART_CONCURRENCY = 4
+// Khi bật, image_processor tự ghi lịch sử nên frontend không gọi saveImageHistory nữa
+export const SERVER_SIDE_HISTORY = import.meta.env.VITE_SERVER_SIDE_HISTORY === 'true'
 
 
 const getAuthToken = async () => {
@@ -59,9 +67,10 @@ export const getPresignedUrl = async (params) => {
  * @param {string} uploadUrl 
  * @param {File} file 
  * @param {Function} onProgress 
+ * @param {Object} uploadHeaders - header đã được ký cùng URL (vd: x-amz-meta-user-id)
  * @returns {Promise<void>}
  */
-export const uploadToS3 = (uploadUrl, file, onProgress) => {
+export const uploadToS3 = (uploadUrl, file, onProgress, uploadHeaders = {}) => {
   return new Promise((resolve, reject) => {
     const xhr = new XMLHttpRequest()
 
@@ -86,18 +95,125 @@ export const uploadToS3 = (uploadUrl, file, onProgress) => {
 
     xhr.open('PUT', uploadUrl)
     xhr.setRequestHeader('Content-Type', file.type)
+    Object.entries(uploadHeaders).forEach(([name, value]) => {
+      xhr.setRequestHeader(name, value)
+    })
     xhr.send(file)
   })
 }
 
 /**
- * Lấy ảnh đã xử lý từ CloudFront với retry logic
+ * Ký nhiều file trong một request (batch), ví dụ cả album
+ * @param {Array<Object>} files - [{ filename, contentType, size, ...options riêng }]
+ * @param {Object} options - options dùng chung (width, height, quality, format, watermark, userId)
+ * @returns {Promise<Array<Object>>} - upload của từng file, cùng thứ tự với files
+ */
+export const getPresignedUrls = async (files, options = {}) => {
+  const { uploads } = await getPresignedUrl({ ...options, files })
+  return uploads
+}
+
+/**
+ * Upload file theo từng part song song (file lớn), rồi hoàn tất multipart upload
+ * ETag của mỗi part được đọc từ response header (bucket CORS có expose ETag)
+ * @param {Object} upload - upload trả về từ getPresignedUrl(s), có upload.multipart
+ * @param {File} file
+ * @param {Function} onProgress
+ * @returns {Promise<void>}
+ */
+export const uploadMultipartToS3 = async (upload, file, onProgress) => {
+  const { uploadId, partSize, parts } = upload.multipart
+  const loaded = new Array(parts.length).fill(0)
+  const etags = new Array(parts.length)
+  let next = 0
+
+  const uploadPart = (part, index) => new Promise((resolve, reject) => {
+    const xhr = new XMLHttpRequest()
+    xhr.upload.addEventListener('progress', (e) => {
+      loaded[index] = e.loaded
+      if (onProgress) {
+        const total = loaded.reduce((sum, value) => sum + value, 0)
+        onProgress(Math.round((total / file.size) * 100))
+      }
+    })
+    xhr.addEventListener('load', () => {
+      if (xhr.status >= 200 && xhr.status < 300) {
+        etags[index] = xhr.getResponseHeader('ETag')
+        resolve()
+      } else {
+        reject(new Error(`Upload part ${part.partNumber} failed with status ${xhr.status}`))
+      }
+    })
+    xhr.addEventListener('error', () => reject(new Error(`Upload part ${part.partNumber} failed`)))
+
+    const start = (part.partNumber - 1) * partSize
+    xhr.open('PUT', part.url)
+    xhr.send(file.slice(start, start + partSize))
+  })
+
+  // MULTIPART_CONCURRENCY worker lấy lần lượt các part chưa upload
+  const worker = async () => {
+    while (next < parts.length) {
+      const index = next++
+      await uploadPart(parts[index], index)
+    }
+  }
+  await Promise.all(Array.from({ length: Math.min(MULTIPART_CONCURRENCY, parts.length) }, worker))
+
+  await getPresignedUrl({
+    action: 'complete',
+    key: upload.key,
+    uploadId,
+    parts: parts.map((part, index) => ({ partNumber: part.partNumber, etag: etags[index] }))
+  })
+}
+
+/**
+ * Upload file với upload trả về từ getPresignedUrl(s): một PUT hoặc multipart
+ * @param {Object} upload
+ * @param {File} file
+ * @param {Function} onProgress
+ * @returns {Promise<void>}
+ */
+export const uploadFile = (upload, file, onProgress) => {
+  if (upload.multipart) {
+    return uploadMultipartToS3(upload, file, onProgress)
+  }
+  return uploadToS3(upload.uploadUrl, file, onProgress, upload.uploadHeaders)
+}
+
+/**
+ * URL ảnh đã xử lý ở kích thước/định dạng khác, tạo theo yêu cầu qua CloudFront /img/
+ * (mỗi biến thể chỉ render một lần rồi được cache), không cần upload lại
+ * @param {string} processedKey - vd: processed/photo.jpeg
+ * @param {Object} options - { width, height, format, quality }, cần width hoặc height
+ *   width/height/quality phải thuộc các mức TRANSFORM_SIZES/TRANSFORM_QUALITIES của backend, nếu không sẽ bị 400
+ * @returns {string}
+ */
+export const getTransformUrl = (processedKey, { width, height, format, quality } = {}) => {
+  const params = new URLSearchParams()
+  if (width) params.set('w', width)
+  if (height) params.set('h', height)
+  if (format) params.set('fmt', format)
+  if (quality) params.set('q', quality)
+  const path = processedKey.split('/').map(encodeURIComponent).join('/')
+  return `${CLOUDFRONT_URL}/img/${path}?${params.toString()}`
+}
+
+/**
+ * Lấy ảnh đã xử lý: long-poll endpoint trạng thái khi có VITE_STATUS_URL,
+ * nếu không thì HEAD CloudFront mỗi giây đến khi ảnh tồn tại
  * @param {string} s3Key
  * @param {Function} onProgress
+ * @param {string} [processedKey] - key trả về từ presigned URL API (nếu có)
  * @returns {Promise<string>}
  */
-export const getProcessedImage = async (s3Key, onProgress) => {
-  const processedKey = s3Key.replace('uploads/', 'processed/')
+export const getProcessedImage = async (s3Key, onProgress, processedKey) => {
+  if (STATUS_URL) {
+    return waitForProcessing(s3Key, onProgress)
+  }
+
+  processedKey = processedKey || s3Key.replace('uploads/', 'processed/')
   const cloudFrontUrl = `${CLOUDFRONT_URL}/${processedKey}`
 
   const maxRetries = 20
@@ -123,6 +239,52 @@ export const getProcessedImage = async (s3Key, onProgress) => {
   throw new Error('Timeout: Không thể lấy ảnh đã xử lý. Vui lòng thử lại sau.')
 }
 
+/**
+ * Chờ image_processor xử lý xong bằng long-poll endpoint trạng thái
+ * Server giữ request đến khi có completion record (tối đa STATUS_WAIT_SECONDS),
+ * nên ảnh được trả về ngay khi xong và lỗi xử lý được báo ngay lập tức
+ * @param {string} s3Key - key upload trả về từ getPresignedUrl
+ * @param {Function} onProgress
+ * @returns {Promise<string>} - CloudFront URL của ảnh đã xử lý
+ */
+export const waitForProcessing = async (s3Key, onProgress) => {
+  const deadline = Date.now() + STATUS_TIMEOUT
+  const query = new URLSearchParams({ key: s3Key, wait: String(STATUS_WAIT_SECONDS) })
+  let attempt = 0
+
+  while (Date.now() < deadline) {
+    let response
+    try {
+      response = await fetch(`${STATUS_URL}?${query.toString()}`)
+    } catch (err) {
+      // Lỗi mạng: chờ một chút rồi thử lại
+      await new Promise(resolve => setTimeout(resolve, 1000))
+      continue
+    }
+
+    if (response.status === 200) {
+      const status = await response.json()
+      if (status.status === 'failed') {
+        throw new Error(`Xử lý ảnh thất bại: ${status.error || 'Lỗi không xác định'}`)
+      }
+      return `${CLOUDFRONT_URL}/${status.processedKey}`
+    }
+
+    if (response.status !== 202) {
+      const error = await response.json().catch(() => ({}))
+      throw new Error(error.message || 'Không thể lấy trạng thái xử lý ảnh')
+    }
+
+    // 202: vẫn đang xử lý, request tiếp theo lại được giữ đến khi có kết quả
+    attempt += 1
+    if (onProgress) {
+      onProgress(Math.min(95, 50 + attempt * 15))
+    }
+  }
+
+  throw new Error('Timeout: Không thể lấy ảnh đã xử lý. Vui lòng thử lại sau.')
+}
+
 /**
  * Validate file trước khi upload
  * @param {File} file 
@@ -159,7 +321,8 @@ export const processImage = async ({
   height,
   quality,
   format,
-  watermark
+  watermark,
+  profile
 }, {
   onProgress,
   onUploadKey
@@ -179,27 +342,33 @@ export const processImage = async ({
     
     // Bước 1: Lấy presigned URL với key có chứa userId
     onProgress(5)
-    const { uploadUrl, key } = await getPresignedUrl({
+    const upload = await getPresignedUrl({
       key: s3Key,
+      userId: currentUser?.userId,
       filename: file.name,
       contentType: file.type,
+      size: file.size,
       width: parseInt(width),
       height: parseInt(height),
       quality: parseInt(quality),
       format: format,
-      watermark: watermark
+      watermark: watermark,
+      // fast | balanced | best, bỏ trống thì dùng profile mặc định của backend
+      profile: profile
     })
     
+    const { key, processedKey } = upload
+    
     if (onUploadKey) {
       onUploadKey(key)
     }
 
-    // Bước 2: Upload lên S3
-    await uploadToS3(uploadUrl, file, onProgress)
+    // Bước 2: Upload lên S3 (file lớn được upload theo từng part song song)
+    await uploadFile(upload, file, onProgress)
     onProgress(50)
 
     // Bước 3: Lấy ảnh đã xử lý từ CloudFront
-    const processedImageUrl = await getProcessedImage(key, onProgress)
+    const processedImageUrl = await getProcessedImage(key, onProgress, processedKey)
     onProgress(100)
 
     return processedImageUrl
@@ -250,8 +419,10 @@ export const saveImageHistory = async (historyData) => {
  * Lấy lịch sử ảnh của user
  * @param {string} userId 
  * @param {number} limit 
+ * @param {Object} options - { nextToken, fields, from, to }
+ * @returns {Promise<Object>} - { items, count, nextToken }
  */
-export const getImageHistory = async (userId, limit = 50) => {
+export const getImageHistory = async (userId, limit = 50, options = {}) => {
   if (!GET_HISTORY_URL) {
     throw new Error('GET_HISTORY_URL not configured');
   }
@@ -267,7 +438,14 @@ export const getImageHistory = async (userId, limit = 50) => {
       headers['Authorization'] = `Bearer ${token}`;
     }
     
-    const url = `${GET_HISTORY_URL}?userId=${encodeURIComponent(userId)}&limit=${limit}`;
+    const query = new URLSearchParams({ userId, limit: String(limit) });
+    // nextToken lấy từ response trang trước, fields là danh sách thuộc tính cần lấy
+    ['nextToken', 'fields', 'from', 'to'].forEach((name) => {
+      if (options[name]) {
+        query.set(name, Array.isArray(options[name]) ? options[name].join(',') : options[name]);
+      }
+    });
+    const url = `${GET_HISTORY_URL}?${query.toString()}`;
     
     const response = await fetch(url, {
       method: 'GET',